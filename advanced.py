@@ -167,6 +167,42 @@ print(other_way_magic(*x_y_list, **z_dict))
 # Fancier file I/O
 # ----------------------------------------------------------------------
 
+# Binary files with the struct module
+# A format string gives the layout of a record: '<' little endian with no
+# padding, 'd' float64, 'i' int32, 'f' float32, '8s' 8 bytes
+import struct
+record = struct.Struct('<dif8s')
+print(record.size)      # 24 bytes
+data = record.pack(1.4e9, 72, 21.5, b'KSEA')
+print(record.unpack(data))
+
+# To write many records, pack them into a preallocated bytearray and
+# write it through a memoryview, which slices without copying
+buf = bytearray(record.size * 100)
+for i in range(100):
+    record.pack_into(buf, i * record.size, 1.4e9 + 60 * i, i, 20.0, b'KSEA')
+with open('data/telemetry.bin', 'wb') as f:
+    f.write(memoryview(buf)[:50 * record.size])     # The first 50 records
+
+with open('data/telemetry.bin', 'rb') as f:
+    raw = f.read()
+for values in record.iter_unpack(raw):
+    print(values)
+
+# records.py adds a file header describing the layout, bulk writes of
+# numpy structured arrays, and reads that memory-map the file as an array
+import records
+schema = records.Schema([('time', 'd'), ('station', 'i'), ('temp', 'f'),
+                         ('id', '8s')])
+with records.RecordWriter('data/telemetry.rec', schema) as w:
+    for values in record.iter_unpack(raw):
+        w.write(*values)
+recs = records.read('data/telemetry.rec')   # No copies of the data
+print(recs['temp'].mean())
+print(recs[recs['station'] > 45])
+for chunk in records.iter_chunks('data/telemetry.rec', chunk_records=10):
+    print(chunk['time'].min(), chunk['time'].max())
+
 
 # ----------------------------------------------------------------------
 # Errors and exceptions
@@ -176,3 +212,24 @@ print(other_way_magic(*x_y_list, **z_dict))
 # ----------------------------------------------------------------------
 # sys module
 # ----------------------------------------------------------------------
+
+import sys
+
+print(sys.version)
+print(sys.platform)
+print(sys.path)         # Directories searched for modules to import
+
+# sys.getsizeof gives the size in bytes of an object itself, not of the
+# objects it refers to
+print(sys.getsizeof(word_counts))   # Just the dict's hash table
+print(sys.getsizeof([v1, v2]))      # Just the list of 2 pointers
+
+# memsize.py adds up everything reachable from an object, counting
+# shared objects once, and breaks the total down by type and by owner
+import memsize
+print(memsize.deep_size(word_counts))
+report = memsize.profile({'word_counts': word_counts,
+                          'word_counts2': word_counts2,
+                          'vectors': [v1, v2]})
+print(report)
+print(report.by_type['str'])        # [bytes, number of objects]
@@ -0,0 +1,513 @@
+"""
+Appendable, chunked array storage on disk.
+
+np.save('some_array', arr) in the file I/O section of science_numpy.py
+writes a whole array at once, and np.load('some_array.npy') reads all of
+it back.  Adding rows means rewriting the file, and compressing it
+(np.savez_compressed) means decompressing everything to read a slice.
+An ArrayStore is a directory of chunks of a fixed number of rows, plus a
+small JSON header:
+
+- append() adds rows along the leading axis, rewriting at most the
+  last, partially filled chunk
+- Each chunk is a .npy file, or compressed with zlib, bz2 or lzma.
+  Chunks that don't compress are stored uncompressed.
+- Reads such as store[1000:2000, 3] only touch the chunks they need:
+  uncompressed chunks are memory-mapped, so only the pages in the slice
+  are read, and compressed chunks are decompressed into a small cache
+- Chunks are read, decompressed, compressed and written by a thread
+  pool (zlib, bz2 and lzma release the GIL)
+- The header is replaced after the chunks are written, so a crash in
+  the middle of append() leaves the previous contents readable
+
+Example
+-------
+>>> import arrayio
+>>> store = arrayio.ArrayStore.create('data/temps', 'float32',
+...                                   row_shape=(180, 360),
+...                                   compression='zlib')
+>>> for day in days:
+...     store.append(read_day(day))       # (ntimes, 180, 360) each
+>>> store = arrayio.load('data/temps')
+>>> store.shape
+>>> store[-30:, 90, :]                    # Reads only the last chunk(s)
+>>> arrayio.save('data/arr', arr)         # Like np.save
+>>> import outofcore
+>>> outofcore.Chunked(store.chunks).mean(axis=0)
+
+Run this module as a script for a benchmark against np.save / np.load:
+python arrayio.py
+"""
+
+from __future__ import division
+
+import bz2
+import collections
+import json
+import lzma
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from concurrent import futures
+
+import numpy as np
+
+HEADER = 'header.json'
+
+# Default chunk size in bytes
+CHUNK_BYTES = 2**20
+
+# Default number of threads for reading and writing chunks
+THREADS = 4
+
+# Number of memory-mapped (uncompressed) chunks to keep open
+MAX_OPEN = 256
+
+# Compression functions: name -> (compress(data, level), decompress,
+# default level).  zlib's fastest level compresses typical arrays
+# nearly as well as the default, at several times the speed.
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level),
+             zlib.decompress, 1),
+    'bz2': (lambda data, level: bz2.compress(data, level),
+            bz2.decompress, 9),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level),
+             lzma.decompress, 0),
+}
+
+
+def _replace(filename, write):
+    """Call write(f) on a temporary file, then rename it to `filename`."""
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, filename)
+
+
+def _write_header(path, header):
+    _replace(os.path.join(path, HEADER),
+             lambda f: f.write(json.dumps(header).encode()))
+
+
+class ArrayStore(object):
+    """An array stored as a directory of chunks along its leading axis."""
+
+    def __init__(self, path, threads=THREADS, cache=8):
+        """
+        Open an existing store.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the store.
+        threads : int, optional
+            Number of threads reading and writing chunks.
+        cache : int, optional
+            Number of decompressed chunks to keep for reuse by later
+            reads.  Up to MAX_OPEN uncompressed chunks are also kept open
+            as memory maps.
+        """
+        self.path = path
+        self.threads = threads
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache
+        self._open = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        with open(os.path.join(path, HEADER)) as f:
+            header = json.load(f)
+        self.dtype = np.lib.format.descr_to_dtype(
+            _from_json(header['dtype']))
+        self.row_shape = tuple(header['row_shape'])
+        self.chunk_rows = header['chunk_rows']
+        self.compression = header['compression']
+        self.level = header['level']
+        self._length = header['length']
+        self._codecs = header['chunks']
+
+    @classmethod
+    def create(cls, path, dtype, row_shape=(), chunk_rows=None,
+               chunk_bytes=CHUNK_BYTES, compression=None, level=None,
+               threads=THREADS, cache=8):
+        """
+        Create an empty store, replacing any existing one at `path`.
+        Any other non-empty directory at `path` is left alone, and
+        raises ValueError.
+
+        Parameters
+        ----------
+        path : str
+            Directory to create.
+        dtype : data-type
+            Data type of the array.
+        row_shape : tuple of int, optional
+            Shape of each row, i.e. of the array minus its leading axis.
+        chunk_rows : int, optional
+            Number of rows per chunk.  Default is as many as fit in
+            `chunk_bytes`.  Smaller chunks make small reads of compressed
+            stores cheaper; larger ones compress better.
+        compression : {None, 'zlib', 'bz2', 'lzma'}, optional
+            How to compress the chunks.
+        level : int, optional
+            Compression level.  Default is 1 for zlib, 9 for bz2 and 0
+            for lzma.
+        """
+        dtype = np.dtype(dtype)
+        row_shape = tuple(int(n) for n in row_shape)
+        if compression is not None and compression not in CODECS:
+            raise ValueError('Unknown compression %r, expected one of %s'
+                             % (compression, sorted(CODECS)))
+        if chunk_rows is None:
+            row_bytes = dtype.itemsize * int(np.prod(row_shape))
+            chunk_rows = max(1, chunk_bytes // max(row_bytes, 1))
+        if compression is not None and level is None:
+            level = CODECS[compression][2]
+        if os.path.isfile(os.path.join(path, HEADER)):
+            shutil.rmtree(path)
+        elif os.path.isdir(path) and os.listdir(path):
+            raise ValueError('%r is not an array store, refusing to replace '
+                             'it' % path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        header = {'dtype': np.lib.format.dtype_to_descr(dtype),
+                  'row_shape': row_shape, 'chunk_rows': int(chunk_rows),
+                  'compression': compression, 'level': level,
+                  'length': 0, 'chunks': []}
+        _write_header(path, header)
+        return cls(path, threads, cache)
+
+    # ------------------------------------------------------------------
+    # Properties
+
+    @property
+    def shape(self):
+        return (self._length,) + self.row_shape
+
+    @property
+    def ndim(self):
+        return 1 + len(self.row_shape)
+
+    @property
+    def nbytes(self):
+        """Size of the array in memory."""
+        return self.dtype.itemsize * int(np.prod(self.shape))
+
+    @property
+    def nchunks(self):
+        return len(self._codecs)
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return 'ArrayStore(%r, shape=%s, dtype=%s, %d chunks, %s)' % (
+            self.path, self.shape, self.dtype, self.nchunks,
+            self.compression or 'uncompressed')
+
+    def _map(self, func, items):
+        """Return list(map(func, items)), in the thread pool if worthwhile."""
+        items = list(items)
+        if self.threads <= 1 or len(items) <= 1:
+            return [func(x) for x in items]
+        if self._pool is None:
+            self._pool = futures.ThreadPoolExecutor(self.threads)
+        return list(self._pool.map(func, items))
+
+    def close(self):
+        """Shut down the thread pool (it is restarted if needed)."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    # ------------------------------------------------------------------
+    # Chunk files
+
+    def _filename(self, i, codec):
+        return os.path.join(self.path, 'chunk%06d.%s' % (i, codec or 'npy'))
+
+    def _chunk_length(self, i):
+        return min(self.chunk_rows, self._length - i * self.chunk_rows)
+
+    def _read_chunk(self, i):
+        """Return chunk `i` as an array (read-only), via the caches."""
+        codec = self._codecs[i]
+        cache, size = ((self._open, MAX_OPEN) if codec is None
+                       else (self._cache, self._cache_size))
+        with self._lock:
+            chunk = cache.get(i)
+            if chunk is not None:
+                cache.move_to_end(i)
+                return chunk
+        filename = self._filename(i, codec)
+        if codec is None:
+            chunk = np.load(filename, mmap_mode='r')
+        else:
+            with open(filename, 'rb') as f:
+                data = CODECS[codec][1](f.read())
+            chunk = np.frombuffer(data, dtype=self.dtype).reshape(
+                (-1,) + self.row_shape)
+        with self._lock:
+            cache[i] = chunk
+            while len(cache) > size:
+                cache.popitem(last=False)
+        return chunk
+
+    def _write_chunk(self, i, chunk):
+        """Write chunk `i`, returning its codec (None if uncompressed)."""
+        chunk = np.ascontiguousarray(chunk)
+        codec = self.compression
+        if codec is not None:
+            data = CODECS[codec][0](chunk.tobytes(), self.level)
+            if len(data) >= chunk.nbytes:
+                codec = None    # Incompressible
+        if codec is None:
+            _replace(self._filename(i, None),
+                     lambda f: np.lib.format.write_array(f, chunk))
+        else:
+            _replace(self._filename(i, codec), lambda f: f.write(data))
+        return codec
+
+    def _save_header(self, length, codecs):
+        _write_header(self.path, {
+            'dtype': np.lib.format.dtype_to_descr(self.dtype),
+            'row_shape': self.row_shape, 'chunk_rows': self.chunk_rows,
+            'compression': self.compression, 'level': self.level,
+            'length': length, 'chunks': codecs})
+
+    # ------------------------------------------------------------------
+    # Writing
+
+    def append(self, rows):
+        """
+        Append `rows`, an array of shape (n,) + row_shape, to the store.
+
+        The last chunk, if partly filled, is rewritten with the new rows
+        added.  Chunks are compressed and written in the thread pool.
+        """
+        rows = np.asarray(rows, dtype=self.dtype)
+        if rows.shape[1:] != self.row_shape:
+            raise ValueError('Rows have shape %s, expected (n,) + %s'
+                             % (rows.shape, self.row_shape))
+        if not len(rows):
+            return
+        first = self._length // self.chunk_rows
+        fill = self._length % self.chunk_rows
+        if fill:
+            rows = np.concatenate([self._read_chunk(first)[:fill], rows])
+        pieces = [(first + j, rows[start:start + self.chunk_rows])
+                  for j, start in enumerate(range(0, len(rows),
+                                                  self.chunk_rows))]
+        codecs = self._map(lambda piece: self._write_chunk(*piece), pieces)
+        new_codecs = self._codecs[:first] + codecs
+        old_codecs = self._codecs
+        self._save_header(self._length - fill + len(rows), new_codecs)
+        self._length += len(rows) - fill
+        self._codecs = new_codecs
+        with self._lock:
+            self._cache.pop(first, None)
+            self._open.pop(first, None)
+        # A rewritten chunk may have changed between compressed and not.
+        # The old file is removed only once the new header no longer
+        # refers to it, so a crash before this leaves the store readable.
+        if fill and new_codecs[first] != old_codecs[first]:
+            os.remove(self._filename(first, old_codecs[first]))
+
+    # ------------------------------------------------------------------
+    # Reading
+
+    def _rows(self, key):
+        """
+        Return (row numbers, True if `key` selects a single row, True if
+        the rows are consecutive) for an index along the leading axis.
+        """
+        n = self._length
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            return np.arange(start, stop, step), False, step == 1
+        if isinstance(key, (int, np.integer)):
+            if not -n <= key < n:
+                raise IndexError('index %d is out of bounds for axis 0 with '
+                                 'size %d' % (key, n))
+            return np.array([key % n]), True, True
+        key = np.asarray(key)
+        if key.dtype == bool:
+            if key.shape != (n,):
+                raise IndexError('boolean index has shape %s, expected (%d,)'
+                                 % (key.shape, n))
+            return np.flatnonzero(key), False, False
+        if key.dtype.kind not in 'iu' or key.ndim != 1:
+            raise IndexError('Only integers, slices and 1-D integer or '
+                             'boolean arrays can index the leading axis')
+        if key.size and (key.min() < -n or key.max() >= n):
+            raise IndexError('index out of bounds for axis 0 with size %d'
+                             % n)
+        return key % n if n else key, False, False
+
+    def __getitem__(self, key):
+        """
+        Read a selection into an in-memory array.
+
+        The index along the leading axis can be an integer, a slice, or
+        a 1-D integer or boolean array.  Indices along the other axes
+        are applied to each chunk as it is read.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if not key or key[0] is Ellipsis:
+            key = (slice(None),) + key
+        rows, single, consecutive = self._rows(key[0])
+        rest = key[1:]
+        row_shape = np.empty((0,) + self.row_shape,
+                             self.dtype)[(slice(None),) + rest].shape[1:]
+        out = np.empty((len(rows),) + row_shape, dtype=self.dtype)
+        if not len(rows):
+            return out
+
+        # Split the rows into runs in the same chunk
+        chunk_ids = rows // self.chunk_rows
+        starts = np.flatnonzero(np.diff(chunk_ids)) + 1
+        bounds = zip(np.concatenate([[0], starts]),
+                     np.concatenate([starts, [len(rows)]]))
+
+        def read(bound):
+            a, b = bound
+            i = chunk_ids[a]
+            local = rows[a:b] - i * self.chunk_rows
+            if consecutive:
+                local = slice(local[0], local[-1] + 1)
+            # Index the rows first, so that an integer array in `rest`
+            # isn't broadcast against the row numbers
+            out[a:b] = self._read_chunk(i)[local][(slice(None),) + rest]
+        self._map(read, bounds)
+        return out[0] if single else out
+
+    def chunks(self):
+        """Iterate over the chunks (read-only arrays), in order."""
+        for i in range(self.nchunks):
+            yield self._read_chunk(i)[:self._chunk_length(i)]
+
+    def read(self):
+        """Read the whole array into memory."""
+        return self[:]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.read()
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def _from_json(descr):
+    """Convert a dtype descr read from JSON back to the form numpy uses."""
+    if not isinstance(descr, list):
+        return descr
+    # Fields are (name, descr) or (name, descr, shape), with names that
+    # may be (title, name) pairs
+    fields = []
+    for field in descr:
+        name = tuple(field[0]) if isinstance(field[0], list) else field[0]
+        fields.append((name, _from_json(field[1]))
+                      + tuple(tuple(shape) for shape in field[2:]))
+    return fields
+
+
+def save(path, arr, chunk_rows=None, chunk_bytes=CHUNK_BYTES,
+         compression=None, level=None, threads=THREADS):
+    """
+    Save `arr` as a new store at directory `path`, like np.save.
+
+    See ArrayStore.create for the parameters.  Returns the store.
+    """
+    arr = np.asanyarray(arr)
+    if arr.ndim == 0:
+        raise ValueError('Can only save arrays with at least 1 dimension')
+    store = ArrayStore.create(path, arr.dtype, arr.shape[1:], chunk_rows,
+                              chunk_bytes, compression, level, threads)
+    store.append(arr)
+    return store
+
+
+def load(path, threads=THREADS, cache=8):
+    """Open the store at directory `path`.  Data is read on indexing."""
+    return ArrayStore(path, threads, cache)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(shape=(20000, 50, 50), nreads=500, nappends=100,
+              dirname=None):
+    """
+    Compare saving, appending, loading and random slice reads of a
+    float32 array (with values rounded like measurements, so that it
+    compresses) against .npy files.
+
+    Note that reads mostly come from the operating system's page cache,
+    not the disk.
+    """
+    dirname = tempfile.mkdtemp(dir=dirname)
+    try:
+        rng = np.random.RandomState(0)
+        arr = (20 + 10 * rng.randn(*shape)).round(1).astype(np.float32)
+        npy = os.path.join(dirname, 'arr.npy')
+        starts = rng.randint(0, shape[0] - 10, size=nreads)
+        pieces = np.array_split(arr, nappends)
+        print('%s float32 array (%.0f MB)' % (shape, arr.nbytes / 1e6))
+
+        def timed(label, func):
+            t0 = time.time()
+            result = func()
+            elapsed = time.time() - t0
+            print('  %-40s %8.3f s' % (label, elapsed))
+            return result
+
+        def size(path):
+            if os.path.isfile(path):
+                return os.path.getsize(path)
+            return sum(os.path.getsize(os.path.join(path, name))
+                       for name in os.listdir(path))
+
+        def append_npy():
+            # np.save can only write the whole array again
+            for i in range(1, nappends + 1):
+                np.save(npy, np.concatenate(pieces[:i]))
+
+        def read_slices(a):
+            return [np.array(a[s:s + 10]) for s in starts]
+
+        print('.npy file')
+        timed('np.save', lambda: np.save(npy, arr))
+        timed('%d appends (concatenate + np.save)' % nappends, append_npy)
+        timed('np.load', lambda: np.load(npy))
+        mm = np.load(npy, mmap_mode='r')
+        ref = timed('%d reads of a[i:i+10] with mmap' % nreads,
+                    lambda: read_slices(mm))
+        print('  %-40s %8.0f MB' % ('size on disk', size(npy) / 1e6))
+        del mm
+
+        for compression in (None, 'zlib'):
+            path = os.path.join(dirname, 'store')
+            print('ArrayStore, %s' % (compression or 'uncompressed'))
+            timed('save', lambda: save(path, arr, compression=compression))
+
+            def append():
+                store = ArrayStore.create(path, arr.dtype, arr.shape[1:],
+                                          compression=compression)
+                for piece in pieces:
+                    store.append(piece)
+            timed('%d appends' % nappends, append)
+            store = load(path)
+            full = timed('load + read all', lambda: load(path).read())
+            res = timed('%d reads of a[i:i+10]' % nreads,
+                        lambda: read_slices(store))
+            print('  %-40s %8.0f MB' % ('size on disk', size(path) / 1e6))
+            assert np.array_equal(full, arr)
+            assert all(np.array_equal(a, b) for a, b in zip(ref, res))
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -398,6 +398,13 @@ def shouting(s):
 
 print(shouting('Soft kitty. Warm kitty. Little ball of fur.'))
 
+# To apply the same kind of transform to millions of lines, see
+# strtransform.py, which compiles the chain of string methods once and
+# runs it on a whole batch of lines at a time:
+# from strtransform import StringTransform
+# shout = StringTransform().replace('.', '!').upper().suffix('!!!')
+# shout.apply(lines)
+
 print("""
 Indentation is Python's way of grouping elements.  An indented
 line is not the same as a non-indented line, and the level of
@@ -448,6 +455,12 @@ def f(x):
     return x % 3 == 0 or x % 5 == 0
 print(filter(f, range(2, 25)))
 
+# map() and filter() build the complete list of results in memory.  For
+# long (or endless) streams, see pipeline.py for lazy generator versions
+# which can also process the stream in numpy chunks:
+# import pipeline
+# print(pipeline.Pipeline(range(2, 25)).filter(f).map(cube).collect())
+
 # ----------------------------------------------
 # Dictionaries
 # ----------------------------------------------
@@ -607,6 +620,11 @@ from zoo import visit # Import only the visit function from zoo
 # nested in modules, in order to propagate through source code edits you can
 # a) Exit ipython and start a new session, or
 # b) Use the %reset magic command to clear the ipython interactive namespace
+# c) Use reloader.py, which reloads only the edited modules and the modules
+#    that import them, in dependency order, without touching numpy etc.:
+#    import reloader
+#    r = reloader.Reloader()
+#    r.enable_ipython()     # Reload changed modules before each command
 #
 # If a script expects command line arguments, these can be passed to the script
 # after the file path in the %run command as though on the command line:
@@ -653,6 +671,14 @@ with open(filename, 'rU') as f:
     for line in f:
         print(str(count) + ' ' + line)
         count += 1
+
+# Printing once per line is slow for big files.  A sink from sinks.py
+# collects the output and writes it in large blocks:
+# import sinks
+# with open(filename, 'rU') as f, sinks.StreamSink() as out:
+#     out.write_lines(str(count) + ' ' + line
+#                     for count, line in enumerate(f))
+
 # ----------------------------------------------------------------------
 # Writing a file
 
@@ -679,6 +705,13 @@ now = ('%d/%d/%d %d:%d:%d' %
        (now.month, now.day, now.year, now.hour, now.minute, now.second))
 print(now)
 
+# For formatting or parsing large arrays of timestamps (e.g. from log
+# files), per-item strftime/strptime is very slow.  See timestamps.py for
+# vectorized conversions between epoch times, datetime64 and strings:
+# import timestamps
+# stamps = timestamps.format_datetimes(dt64_array, '%Y-%m-%d %H:%M:%S')
+# dt64_array = timestamps.parse_datetimes(stamps, '%Y-%m-%d %H:%M:%S')
+
 # ----------------------------------------------------------------------
 # Random numbers
 print('Random numbers')
@@ -0,0 +1,723 @@
+"""
+Block-wise evaluation of elementwise array expressions.
+
+An expression like np.sqrt(xs ** 2 + ys ** 2) from the heat map section
+of science_plots.py is evaluated by numpy one operation at a time, and
+each operation makes a full-size temporary array: xs ** 2, ys ** 2,
+their sum, and finally the square root.  For 10**8 element grids that
+is several hundred MB per temporary, and every operation streams its
+inputs and outputs through main memory instead of the CPU cache.
+
+This module compiles an expression once into a short program of numpy
+ufunc calls, then runs the whole program on one block of rows at a time:
+
+- Each block is small enough for its temporaries to stay in cache, and
+  the temporaries are allocated once and reused for every block
+- The final operation writes straight into a single output array (which
+  can be supplied with `out`), so the peak memory is the inputs plus the
+  output plus a few blocks
+- Blocks are split across threads (numpy releases the GIL inside ufunc
+  loops), each thread with its own temporaries
+- Inputs are broadcast, so open grids like x[None, :] and y[:, None]
+  never have to be expanded to full arrays
+
+Expressions can be strings, using numpy ufunc names with or without the
+np. prefix plus where(), or operator trees built from var() and the
+function wrappers in this module:
+
+Example
+-------
+>>> import blockeval
+>>> z = blockeval.evaluate('sqrt(xs ** 2 + ys ** 2)')   # Uses local xs, ys
+>>> expr = blockeval.Expression('np.where(arr > 0, 2, arr)')
+>>> result = expr(arr=arr, out=result)
+>>> x, y = blockeval.var('x'), blockeval.var('y')
+>>> expr = blockeval.Expression(blockeval.sqrt(((x - 2) / 2)**2 + (y - 2)**2))
+>>> z2 = expr(x=xs, y=ys, threads=4)
+
+Functions of coordinates, like z above, can be evaluated on a grid
+without making the coordinate arrays from np.meshgrid at all: grid()
+gives the expression (or a Python function) open 1 x nx and ny x 1 axes,
+and fills the output one tile at a time within a fixed memory budget.
+
+>>> z = blockeval.grid('sqrt(x ** 2 + y ** 2)', x=points, y=points)
+>>> xi, yi = blockeval.mesh(lon, lat)     # Read-only views, no copies
+
+Run this module as a script for benchmarks on 10**8 element grids and
+on a 20000 x 20000 grid:
+python blockeval.py
+"""
+
+from __future__ import division
+
+import ast
+import os
+import sys
+import time
+import tracemalloc
+from concurrent import futures
+
+import numpy as np
+
+# Target number of elements per block: big enough that the per-call
+# overhead of the ufuncs doesn't matter, small enough that (with float64)
+# a few temporaries stay in a typical L2/L3 cache
+BLOCK = 2**16
+
+
+# ----------------------------------------------------------------------
+# Operator trees
+# ----------------------------------------------------------------------
+
+_BINARY = {
+    ast.Add: 'add', ast.Sub: 'subtract', ast.Mult: 'multiply',
+    ast.Div: 'true_divide', ast.FloorDiv: 'floor_divide',
+    ast.Mod: 'remainder', ast.Pow: 'power', ast.BitAnd: 'bitwise_and',
+    ast.BitOr: 'bitwise_or', ast.BitXor: 'bitwise_xor',
+}
+_UNARY = {ast.USub: 'negative', ast.UAdd: 'positive', ast.Invert: 'invert',
+          ast.Not: 'logical_not'}
+_COMPARE = {
+    ast.Lt: 'less', ast.LtE: 'less_equal', ast.Gt: 'greater',
+    ast.GtE: 'greater_equal', ast.Eq: 'equal', ast.NotEq: 'not_equal',
+}
+_ALIASES = {'abs': 'absolute', 'pow': 'power'}
+
+
+class Expr(object):
+    """
+    Node of an expression tree.
+
+    kind is 'var' (an input array named `name`), 'const' (a scalar
+    `value`) or 'call' (numpy function `name` applied to `args`).
+    Arithmetic, comparison and bitwise operators build new nodes.
+    """
+
+    def __init__(self, kind, name=None, value=None, args=()):
+        self.kind = kind
+        self.name = name
+        self.value = value
+        self.args = tuple(args)
+
+    def __repr__(self):
+        if self.kind == 'var':
+            return self.name
+        if self.kind == 'const':
+            return repr(self.value)
+        return '%s(%s)' % (self.name, ', '.join(repr(a) for a in self.args))
+
+    def _op(name):
+        def method(self, other):
+            return call(name, self, other)
+        return method
+
+    def _rop(name):
+        def method(self, other):
+            return call(name, other, self)
+        return method
+
+    __add__, __radd__ = _op('add'), _rop('add')
+    __sub__, __rsub__ = _op('subtract'), _rop('subtract')
+    __mul__, __rmul__ = _op('multiply'), _rop('multiply')
+    __truediv__, __rtruediv__ = _op('true_divide'), _rop('true_divide')
+    __div__, __rdiv__ = __truediv__, __rtruediv__
+    __floordiv__ = _op('floor_divide')
+    __rfloordiv__ = _rop('floor_divide')
+    __mod__, __rmod__ = _op('remainder'), _rop('remainder')
+    __pow__, __rpow__ = _op('power'), _rop('power')
+    __and__, __rand__ = _op('bitwise_and'), _rop('bitwise_and')
+    __or__, __ror__ = _op('bitwise_or'), _rop('bitwise_or')
+    __xor__, __rxor__ = _op('bitwise_xor'), _rop('bitwise_xor')
+    __lt__, __le__ = _op('less'), _op('less_equal')
+    __gt__, __ge__ = _op('greater'), _op('greater_equal')
+    __eq__, __ne__ = _op('equal'), _op('not_equal')
+    __hash__ = object.__hash__
+    del _op, _rop
+
+    def __neg__(self):
+        return call('negative', self)
+
+    def __pos__(self):
+        return self
+
+    def __invert__(self):
+        return call('invert', self)
+
+    def __abs__(self):
+        return call('absolute', self)
+
+    def variables(self):
+        """Return the sorted names of the input variables."""
+        if self.kind == 'var':
+            return [self.name]
+        if self.kind == 'const':
+            return []
+        return sorted(set(n for a in self.args for n in a.variables()))
+
+
+def _as_expr(x):
+    return x if isinstance(x, Expr) else Expr('const', value=x)
+
+
+def var(name):
+    """Return an expression for the input array called `name`."""
+    return Expr('var', name=name)
+
+
+def call(name, *args):
+    """Return an expression for numpy function `name` of `args`."""
+    name = _ALIASES.get(name, name)
+    if name != 'where' and not isinstance(getattr(np, name, None), np.ufunc):
+        raise ValueError('%s is not a numpy ufunc' % name)
+    return Expr('call', name=name, args=[_as_expr(a) for a in args])
+
+
+def _wrapper(name):
+    def func(*args):
+        return call(name, *args)
+    func.__name__ = name
+    func.__doc__ = 'Return an expression for np.%s.' % name
+    return func
+
+
+sqrt, exp, log, log10 = [_wrapper(n)
+                         for n in ('sqrt', 'exp', 'log', 'log10')]
+sin, cos, tan, arctan2 = [_wrapper(n)
+                          for n in ('sin', 'cos', 'tan', 'arctan2')]
+hypot, minimum, maximum = [_wrapper(n)
+                           for n in ('hypot', 'minimum', 'maximum')]
+where = _wrapper('where')
+
+
+def parse(source):
+    """Parse a string expression into an Expr tree."""
+    return _convert(ast.parse(source.strip(), mode='eval').body)
+
+
+def _convert(node):
+    """Convert an ast node to an Expr."""
+    if isinstance(node, ast.Name):
+        return var(node.id)
+    if isinstance(node, ast.Constant) and isinstance(
+            node.value, (bool, int, float, complex)):
+        return Expr('const', value=node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        return call(_BINARY[type(node.op)], _convert(node.left),
+                    _convert(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        return call(_UNARY[type(node.op)], _convert(node.operand))
+    if isinstance(node, ast.Compare):
+        # a < b < c means (a < b) & (b < c)
+        operands = [_convert(node.left)] + [_convert(c)
+                                            for c in node.comparators]
+        result = None
+        for i, op in enumerate(node.ops):
+            if type(op) not in _COMPARE:
+                break
+            term = call(_COMPARE[type(op)], operands[i], operands[i + 1])
+            result = term if result is None else \
+                call('logical_and', result, term)
+        else:
+            return result
+    if isinstance(node, ast.BoolOp):
+        name = 'logical_and' if isinstance(node.op, ast.And) else \
+            'logical_or'
+        result = _convert(node.values[0])
+        for value in node.values[1:]:
+            result = call(name, result, _convert(value))
+        return result
+    if isinstance(node, ast.Call) and not node.keywords:
+        func = node.func
+        if (isinstance(func, ast.Attribute)
+                and isinstance(func.value, ast.Name)
+                and func.value.id in ('np', 'numpy')):
+            name = func.attr
+        elif isinstance(func, ast.Name):
+            name = func.id
+        else:
+            name = None
+        if name:
+            return call(name, *[_convert(a) for a in node.args])
+    raise ValueError('Unsupported expression: %s' % ast.dump(node))
+
+
+# ----------------------------------------------------------------------
+# Compiled expressions
+# ----------------------------------------------------------------------
+
+def _simplify(name, args):
+    """Replace x**2 and x**0.5 with the faster square and sqrt."""
+    if name == 'power' and args[1].kind == 'const':
+        if args[1].value == 2:
+            return 'square', args[:1]
+        if args[1].value == 0.5:
+            return 'sqrt', args[:1]
+    return name, args
+
+
+def _call(name, args, out=None):
+    """Apply numpy function `name` to `args`, into `out` if given."""
+    if name != 'where':
+        return getattr(np, name)(*args, out=out)
+    if out is None:
+        return np.where(*args)
+    cond, a, b = args
+    np.copyto(out, b)
+    if np.shape(cond) == out.shape and (np.ndim(a) == 0 or
+                                        np.shape(a) == out.shape):
+        np.putmask(out, cond, a)    # Faster, but doesn't broadcast
+    else:
+        np.copyto(out, a, where=cond)
+    return out
+
+
+def _run_program(program, env, temps, out, hoisted):
+    """
+    Run `program` on one block.
+
+    temps[i] is the buffer for step i, and hoisted[i] the result of
+    step i if it was computed once for all blocks.
+    """
+    values = []
+    last = len(program) - 1
+    for i, (name, refs) in enumerate(program):
+        if i in hoisted:
+            values.append(hoisted[i])
+            continue
+        args = []
+        for kind, ref in refs:
+            if kind == 'var':
+                args.append(env[ref])
+            elif kind == 'const':
+                args.append(ref)
+            else:
+                args.append(values[ref])
+        values.append(_call(name, args, out if i == last else temps[i]))
+
+
+class Expression(object):
+    """Elementwise expression compiled for block-wise evaluation."""
+
+    def __init__(self, expr):
+        """
+        Compile `expr`, a string or an Expr tree.
+
+        Strings may use arithmetic, comparison and bitwise operators,
+        `and`, `or` and `not` (elementwise), numpy ufuncs by name (e.g.
+        sqrt or np.sqrt), and where(cond, a, b).
+        """
+        if isinstance(expr, str):
+            self.source = expr
+            expr = parse(expr)
+        else:
+            self.source = repr(expr)
+        self.tree = expr
+        self.variables = expr.variables()
+        # Program: list of (function name, [(kind, ref)]) in evaluation
+        # order, where kind is 'var', 'const' or 'step' (an earlier step)
+        self.program = []
+        root = self._compile(expr)
+        if root[0] != 'step':
+            # A bare variable or constant: copy it
+            self.program.append(('positive', [root]))
+
+    def __repr__(self):
+        return 'Expression(%r)' % self.source
+
+    def _compile(self, node):
+        if node.kind == 'var':
+            return ('var', node.name)
+        if node.kind == 'const':
+            return ('const', node.value)
+        name, args = _simplify(node.name, node.args)
+        refs = [self._compile(a) for a in args]
+        self.program.append((name, refs))
+        return ('step', len(self.program) - 1)
+
+    def _dtypes(self, arrays):
+        """Work out the dtype of each step on one-element samples."""
+        env = {}
+        for name, value in arrays.items():
+            if isinstance(value, np.ndarray):
+                env[name] = value.reshape(-1)[:1] if value.size \
+                    else np.zeros(1, value.dtype)
+            else:
+                env[name] = value
+        dtypes = []
+        values = []
+        with np.errstate(all='ignore'):
+            for name, refs in self.program:
+                args = [env[r] if k == 'var' else r if k == 'const'
+                        else values[r] for k, r in refs]
+                result = np.asarray(_call(name, args))
+                values.append(result)
+                dtypes.append(result.dtype)
+        return dtypes
+
+    def __call__(self, out=None, threads=None, block=BLOCK, **arrays):
+        """
+        Evaluate the expression.
+
+        Parameters
+        ----------
+        out : ndarray, optional
+            Array for the result, with the broadcast shape of the inputs.
+        threads : int, optional
+            Number of threads.  Default is the number of CPUs.
+        block : int, optional
+            Target number of elements per block.
+        **arrays
+            Value of each variable: arrays (broadcast against each other)
+            or scalars.
+
+        Returns
+        -------
+        out : ndarray
+        """
+        missing = [n for n in self.variables if n not in arrays]
+        if missing:
+            raise NameError('No value for %s' % ', '.join(missing))
+        arrays = dict((n, arrays[n] if np.isscalar(arrays[n])
+                       else np.asarray(arrays[n])) for n in self.variables)
+        shape = np.broadcast_shapes(*[np.shape(v) for v in arrays.values()])
+        dtypes = self._dtypes(arrays)
+        if out is None:
+            out = np.empty(shape, dtype=dtypes[-1])
+        elif out.shape != shape:
+            raise ValueError('out has shape %s, expected %s'
+                             % (out.shape, shape))
+
+        # Evaluate in blocks along the first axis of the output.  Inputs
+        # keep their own (broadcastable) shapes, and steps that don't
+        # vary along the first axis are computed once, not per block.
+        bshape = shape or (1,)
+        ndim = len(bshape)
+        env = {}
+        for name, value in arrays.items():
+            if isinstance(value, np.ndarray):
+                value = value.reshape((1,) * (ndim - value.ndim)
+                                      + value.shape)
+            env[name] = value
+        step_shapes = []
+        hoisted = {}
+        last = len(self.program) - 1
+        for i, (name, refs) in enumerate(self.program):
+            arg_shapes = [np.shape(env[r]) if k == 'var' else
+                          () if k == 'const' else step_shapes[r]
+                          for k, r in refs]
+            step_shape = np.broadcast_shapes(*arg_shapes)
+            step_shape = (1,) * (ndim - len(step_shape)) + step_shape
+            step_shapes.append(step_shape)
+            if step_shape[0] == 1 and i < last:
+                args = [env[r] if k == 'var' else r if k == 'const'
+                        else hoisted[r] for k, r in refs]
+                hoisted[i] = _call(name, args)
+        varying = [n for n, v in env.items()
+                   if isinstance(v, np.ndarray) and v.shape[0] > 1]
+
+        out_b = out.reshape(bshape)
+        row_size = int(np.prod(bshape[1:]))
+        rows = max(1, block // max(row_size, 1))
+        blocks = [(lo, min(lo + rows, bshape[0]))
+                  for lo in range(0, bshape[0], rows)]
+        threads = min(threads or os.cpu_count() or 1, max(len(blocks), 1))
+
+        def work(my_blocks):
+            temps = [None if i in hoisted else
+                     np.empty((rows,) + step_shapes[i][1:], dtype=dt)
+                     for i, dt in enumerate(dtypes)]
+            block_env = dict(env)
+            for lo, hi in my_blocks:
+                for n in varying:
+                    block_env[n] = env[n][lo:hi]
+                _run_program(self.program, block_env,
+                             [t if t is None else t[:hi - lo]
+                              for t in temps],
+                             out_b[lo:hi], hoisted)
+
+        if threads <= 1:
+            work(blocks)
+        else:
+            # Each thread gets a contiguous range of blocks
+            bounds = np.linspace(0, len(blocks), threads + 1).astype(int)
+            with futures.ThreadPoolExecutor(threads) as pool:
+                tasks = [pool.submit(work, blocks[bounds[i]:bounds[i + 1]])
+                         for i in range(threads)]
+                for task in tasks:
+                    task.result()
+        return out
+
+
+_expression_cache = {}
+
+
+def _compiled(expr):
+    """Return an Expression for `expr`, reusing compiled strings."""
+    if isinstance(expr, Expression):
+        return expr
+    if isinstance(expr, str):
+        if expr not in _expression_cache:
+            _expression_cache[expr] = Expression(expr)
+        return _expression_cache[expr]
+    return Expression(expr)
+
+
+def evaluate(expr, local_dict=None, out=None, threads=None):
+    """
+    Evaluate a string expression block by block.
+
+    Variables are looked up in `local_dict`, or else in the namespace of
+    the caller (locals, then globals).  Compiled string expressions are
+    cached.
+    """
+    compiled = _compiled(expr)
+    if local_dict is None:
+        frame = sys._getframe(1)
+        local_dict = dict(frame.f_globals)
+        local_dict.update(frame.f_locals)
+    arrays = {}
+    for name in compiled.variables:
+        if name not in local_dict:
+            raise NameError('name %r is not defined' % name)
+        arrays[name] = local_dict[name]
+    return compiled(out=out, threads=threads, **arrays)
+
+
+# ----------------------------------------------------------------------
+# Functions on grids
+# ----------------------------------------------------------------------
+
+# Default memory budget in bytes for each tile of grid() with a function
+MEMORY = 64 * 2**20
+
+# Allowance for temporaries made by a function, in multiples of its output
+_FUNC_TEMPS = 4
+
+
+def open_grid(*axes, **kwargs):
+    """
+    Return coordinate axes reshaped to broadcast against each other.
+
+    Same as np.meshgrid(*axes, sparse=True): for two axes x and y, the
+    result is x as a 1 x nx array and y as an ny x 1 array, which combine
+    like the full meshgrid arrays in any numpy expression.
+
+    Parameters
+    ----------
+    *axes : 1-D arrays
+    indexing : {'xy', 'ij'}, optional
+        As for np.meshgrid: 'xy' (default) puts the first axis along the
+        columns, 'ij' along the rows.
+    """
+    indexing = kwargs.pop('indexing', 'xy')
+    if kwargs:
+        raise TypeError('Unexpected arguments %s' % ', '.join(kwargs))
+    return np.meshgrid(*[np.asarray(a) for a in axes], sparse=True,
+                       copy=False, indexing=indexing)
+
+
+def mesh(*axes, **kwargs):
+    """
+    Return full-size coordinate arrays like np.meshgrid, as views.
+
+    The arrays are read-only broadcast views of the axes, so they take
+    no memory of their own.  Use them to pass coordinates to functions
+    that need full arrays, like Basemap.pcolormesh().  Takes the same
+    arguments as open_grid().
+    """
+    grids = open_grid(*axes, **kwargs)
+    shape = np.broadcast_shapes(*[g.shape for g in grids])
+    return [np.broadcast_to(g, shape) for g in grids]
+
+
+def grid(func, out=None, dtype=None, indexing='xy', memory=MEMORY,
+         threads=None, **axes):
+    """
+    Evaluate a function of coordinates over the grid of `axes`.
+
+    Same result as func(*np.meshgrid(...)), but the full coordinate
+    arrays are never made, and the result is written straight into the
+    output array, one tile of rows at a time.
+
+    Parameters
+    ----------
+    func : str, Expr, Expression or function
+        Expression whose variables are the axis names, or a function
+        taking the axis names as keyword arguments and working on
+        broadcast numpy arrays.
+    out : ndarray, optional
+        Array for the result, e.g. a np.memmap for grids bigger than
+        memory.
+    dtype : dtype, optional
+        dtype of the result if `out` isn't given.  Default is the dtype
+        `func` returns.
+    indexing : {'xy', 'ij'}, optional
+        As for np.meshgrid.  With 'xy', the result for axes x and y has
+        shape (len(y), len(x)).
+    memory : int, optional
+        Approximate memory budget in bytes per tile when `func` is a
+        function (expressions use small fixed-size blocks).
+    threads : int, optional
+        Number of threads.  Default is the number of CPUs.
+    **axes : 1-D arrays
+        Coordinates along each axis, in order (x, y, ...).
+
+    Returns
+    -------
+    out : ndarray
+
+    Example
+    -------
+    >>> points = np.arange(-5, 5, 0.01)
+    >>> z = grid('sqrt(x ** 2 + y ** 2)', x=points, y=points)
+    >>> z = grid(lambda x, y: np.sqrt(x ** 2 + y ** 2), x=points, y=points)
+    """
+    names = list(axes)
+    coords = dict(zip(names, open_grid(*[axes[n] for n in names],
+                                       indexing=indexing)))
+    shape = np.broadcast_shapes(*[c.shape for c in coords.values()])
+    if not callable(func) or isinstance(func, Expression):
+        expr = _compiled(func)
+        if out is None and dtype is not None:
+            out = np.empty(shape, dtype=dtype)
+        return expr(out=out, threads=threads, **coords)
+
+    # Function: evaluate tiles of rows, with coordinates sliced to match
+    row_bytes = 8 * int(np.prod(shape[1:]))
+    rows = max(1, memory // (_FUNC_TEMPS * row_bytes))
+    tiles = [(lo, min(lo + rows, shape[0]))
+             for lo in range(0, shape[0], rows)]
+
+    def tile(lo, hi):
+        return func(**dict((n, c[lo:hi] if c.shape[0] > 1 else c)
+                           for n, c in coords.items()))
+
+    first = np.asarray(tile(*tiles[0]))
+    if out is None:
+        out = np.empty(shape, dtype=dtype or first.dtype)
+    elif out.shape != shape:
+        raise ValueError('out has shape %s, expected %s' % (out.shape, shape))
+    out[:tiles[0][1]] = first
+    del first
+
+    def work(my_tiles):
+        for lo, hi in my_tiles:
+            out[lo:hi] = tile(lo, hi)
+
+    tiles = tiles[1:]
+    threads = min(threads or os.cpu_count() or 1, max(len(tiles), 1))
+    if threads <= 1:
+        work(tiles)
+    else:
+        with futures.ThreadPoolExecutor(threads) as pool:
+            for task in [pool.submit(work, tiles[i::threads])
+                         for i in range(threads)]:
+                task.result()
+    return out
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _measure(func):
+    """Return (result, seconds, peak MB allocated) for func()."""
+    t0 = time.time()
+    result = func()
+    elapsed = time.time() - t0
+    # Measure memory in a separate run: tracing slows down the block loop
+    del result
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def benchmark(n=10**4, threads=None):
+    """
+    Compare numpy and block-wise evaluation on an n x n grid.
+
+    The grid coordinates are open (1 x n and n x 1 instead of meshgrid
+    arrays), so the memory measured is the temporaries and the output.
+    """
+    points = np.linspace(-5, 5, n)
+    xs, ys = points[None, :], points[:, None]
+    arr = np.random.RandomState(0).randn(n, n)
+    cases = [
+        ('np.sqrt(xs ** 2 + ys ** 2)', dict(xs=xs, ys=ys)),
+        ('np.sqrt(((xs-2)/2)**2 + (ys-2)**2)', dict(xs=xs, ys=ys)),
+        ('np.where(arr > 0, 2, arr)', dict(arr=arr)),
+    ]
+    print('%d x %d grid (%.0e elements), %d threads'
+          % (n, n, n * n, threads or os.cpu_count() or 1))
+    for source, arrays in cases:
+        print(source)
+        ref, t_np, mb_np = _measure(lambda: eval(source, {'np': np}, arrays))
+        print('  %-18s %8.3f s  peak %7.0f MB' % ('numpy', t_np, mb_np))
+        expr = Expression(source)
+        result, t_be, mb_be = _measure(lambda: expr(threads=threads,
+                                                    **arrays))
+        print('  %-18s %8.3f s  peak %7.0f MB' % ('blockeval', t_be, mb_be))
+        assert np.array_equal(result, ref)
+        del ref
+        out = result
+        _, t_out, mb_out = _measure(lambda: expr(out=out, threads=threads,
+                                                 **arrays))
+        print('  %-18s %8.3f s  peak %7.0f MB' % ('blockeval, out=',
+                                                  t_out, mb_out))
+        print('  %.1fx faster, %.0f MB less peak memory (%.0f MB with out=)'
+              % (t_np / t_be, mb_np - mb_be, mb_np - mb_out))
+        del result, out
+
+
+def benchmark_grid(n=5000, big=20000, memory=MEMORY):
+    """
+    Compare np.meshgrid with grid() on an n x n grid, then run grid() on
+    a big x big grid, which is too large for the meshgrid approach.
+
+    Memory is reported as the peak allocated apart from the output.
+    """
+    def run(label, func, nbytes):
+        z, elapsed, peak = _measure(func)
+        print('%-40s %8.3f s  workspace %7.0f MB'
+              % (label, elapsed, peak - nbytes / 1e6))
+        return z
+
+    points = np.linspace(-5, 5, n)
+    nbytes = 8 * n * n
+    print('%d x %d grid' % (n, n))
+
+    def with_meshgrid():
+        xs, ys = np.meshgrid(points, points)
+        return np.sqrt(xs ** 2 + ys ** 2)
+
+    ref = run('np.meshgrid, numpy expression', with_meshgrid, nbytes)
+    z = run("grid('sqrt(x ** 2 + y ** 2)')",
+            lambda: grid('sqrt(x ** 2 + y ** 2)', x=points, y=points), nbytes)
+    assert np.array_equal(z, ref)
+    del z
+    z = run('grid(function)', lambda: grid(
+        lambda x, y: np.sqrt(x ** 2 + y ** 2), x=points, y=points,
+        memory=memory), nbytes)
+    assert np.array_equal(z, ref)
+    del z, ref
+
+    points = np.linspace(-5, 5, big)
+    nbytes = 4 * big * big
+    print('%d x %d grid, float32 output (meshgrid would need %.1f GB of '
+          'float64 coordinates)' % (big, big, 2 * 8 * big * big / 1e9))
+    run("grid('sqrt(x ** 2 + y ** 2)')",
+        lambda: grid('sqrt(x ** 2 + y ** 2)', x=points, y=points,
+                     dtype=np.float32), nbytes)
+    run('grid(function)', lambda: grid(
+        lambda x, y: np.sqrt(x ** 2 + y ** 2), x=points, y=points,
+        dtype=np.float32, memory=memory), nbytes)
+
+
+if __name__ == '__main__':
+    benchmark()
+    print()
+    benchmark_grid()
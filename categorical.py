@@ -0,0 +1,273 @@
+"""
+Categorical arrays: string labels stored as small integer codes.
+
+The Boolean indexing section of science_numpy.py builds masks like
+(cats == 'tabby') | (cats == 'siamese') by comparing every string in the
+array, which for 10**7 rows means comparing hundreds of megabytes of
+characters and allocating a temporary mask per comparison.  A Categorical
+stores each label once, in a table of categories, plus one integer code
+per row:
+
+- Comparing with a label compares integer codes, and isin() looks the
+  codes up in a small Boolean table, so masks cost one pass over a
+  1-byte (usually) code array
+- The row indices of every category are computed together the first
+  time they are needed and then cached, so repeated filtering with
+  select() / rows() skips building masks altogether
+- Memory use is 1, 2 or 4 bytes per row instead of the string length
+
+Example
+-------
+>>> from categorical import Categorical
+>>> cats = Categorical(['tabby', 'calico', 'siamese', 'tabby', 'siamese',
+...                     'calico', 'calico'])
+>>> data[cats == 'tabby']                       # Same as with strings
+>>> data[cats.isin(['tabby', 'siamese'])]
+>>> cats.select(data, 'tabby', 'siamese')       # Uses cached row indices
+>>> cats.value_counts()
+
+Run this module as a script for a benchmark on 10**7 rows:
+python categorical.py
+"""
+
+from __future__ import division
+
+import time
+
+import numpy as np
+
+import setops
+
+# Label used for rows whose value is not one of the categories
+MISSING = -1
+
+
+def _code_dtype(ncategories):
+    """Return the smallest signed integer dtype for the codes."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if ncategories <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class Categorical(object):
+    """Array of labels stored as integer codes into a category table."""
+
+    def __init__(self, values, categories=None):
+        """
+        Encode `values` as codes into `categories`.
+
+        Parameters
+        ----------
+        values : array_like
+            Labels, e.g. a list or 1-D ndarray of strings.
+        categories : array_like, optional
+            Distinct labels.  Default is the sorted unique values.  Values
+            that are not in `categories` get code MISSING (-1).
+        """
+        values = np.asarray(values).ravel()
+        if categories is None:
+            codes, categories = setops.factorize(values, sort=True)
+        else:
+            categories = np.asarray(categories).ravel()
+            if len(setops.unique(categories, sort=False)) < len(categories):
+                raise ValueError('Categories must be distinct')
+            codes = setops.index_of(values, categories)
+        self._init(codes.astype(_code_dtype(len(categories))), categories)
+
+    @classmethod
+    def from_codes(cls, codes, categories):
+        """Create a Categorical from existing codes and categories."""
+        self = cls.__new__(cls)
+        categories = np.asarray(categories).ravel()
+        codes = np.asarray(codes).ravel()
+        if codes.size and (codes.min() < MISSING
+                           or codes.max() >= len(categories)):
+            raise ValueError('Codes out of range for %d categories'
+                             % len(categories))
+        self._init(codes.astype(_code_dtype(len(categories))), categories)
+        return self
+
+    def _init(self, codes, categories):
+        # Codes are read-only, so cached row indices can't go stale
+        codes.flags.writeable = False
+        self.codes = codes
+        self.categories = categories
+        self._positions = None
+        self._order = None
+        self._offsets = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return 'Categorical(%d rows, categories=%s)' % (
+            len(self), np.array2string(self.categories, threshold=10))
+
+    @property
+    def nbytes(self):
+        """Memory used by the codes and the category table."""
+        return self.codes.nbytes + self.categories.nbytes
+
+    def code(self, label):
+        """Return the code of `label`, or None if it isn't a category."""
+        if self._positions is None:
+            self._positions = dict(
+                (x, i) for i, x in enumerate(self.categories.tolist()))
+        try:
+            return self._positions.get(label)
+        except TypeError:   # Unhashable
+            return None
+
+    def to_array(self):
+        """Return the labels as a plain ndarray (missing values are '')."""
+        if not (self.codes == MISSING).any():
+            return self.categories[self.codes]
+        table = np.concatenate([self.categories,
+                                np.zeros(1, self.categories.dtype)])
+        return table[self.codes]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.to_array()
+        return arr if dtype is None else arr.astype(dtype)
+
+    def __getitem__(self, key):
+        """Index like an ndarray, returning a label or a Categorical."""
+        codes = self.codes[key]
+        if np.ndim(codes) == 0:
+            return self.categories[codes] if codes != MISSING else None
+        return Categorical.from_codes(codes, self.categories)
+
+    # ------------------------------------------------------------------
+    # Masks
+
+    def __eq__(self, label):
+        if isinstance(label, Categorical):
+            return self.to_array() == label.to_array()
+        code = self.code(label)
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self.codes == code
+
+    def __ne__(self, label):
+        return ~(self == label)
+
+    __hash__ = None
+
+    def isin(self, labels, invert=False):
+        """Boolean mask of rows whose label is in `labels`."""
+        found = self._found(labels)
+        if invert:
+            found = ~found
+        # found[-1] is the entry for MISSING codes
+        return found[self.codes]
+
+    def _found(self, labels):
+        """Boolean table over codes (plus MISSING) for `labels`."""
+        found = np.zeros(len(self.categories) + 1, dtype=bool)
+        for label in np.atleast_1d(labels).tolist():
+            code = self.code(label)
+            if code is not None:
+                found[code] = True
+        return found
+
+    # ------------------------------------------------------------------
+    # Row indices
+
+    def _group(self):
+        """Sort row numbers by code, once."""
+        if self._order is None:
+            # A stable sort keeps the rows of each category in order
+            self._order = np.argsort(self.codes, kind='stable')
+            counts = np.bincount(self.codes.astype(np.intp) + 1,
+                                 minlength=len(self.categories) + 1)
+            self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def rows(self, *labels):
+        """
+        Return the sorted row indices of rows with any of `labels`.
+
+        The indices of each category are cached, so this is cheap to call
+        again.  data[cats.rows('tabby')] equals data[cats == 'tabby'].
+        """
+        self._group()
+        codes = set(self.code(label) for label in labels)
+        codes.discard(None)
+        parts = [self._order[self._offsets[code + 1]:self._offsets[code + 2]]
+                 for code in codes]
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        if len(parts) == 1:
+            # A read-only view, so callers can't change the cached indices
+            part = parts[0].view()
+            part.flags.writeable = False
+            return part
+        return np.sort(np.concatenate(parts))
+
+    def select(self, data, *labels):
+        """
+        Return the rows of `data` with any of `labels`.
+
+        Same as data[cats.isin(labels)], using the cached row indices
+        instead of building a mask.
+        """
+        return np.take(data, self.rows(*labels), axis=0)
+
+    def value_counts(self):
+        """Return the categories and the number of rows of each."""
+        counts = np.bincount(self.codes[self.codes != MISSING],
+                             minlength=len(self.categories))
+        return self.categories, counts
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(n=10**7, repeat=5):
+    """Compare masks and filtering on a string array and a Categorical."""
+    rng = np.random.RandomState(0)
+    breeds = np.array(['tabby', 'calico', 'siamese', 'persian', 'bengal',
+                       'sphynx', 'ragdoll', 'maine coon', 'burmese',
+                       'abyssinian'])
+    cats = breeds[rng.randint(0, len(breeds), size=n)]
+    data = rng.randn(n)
+
+    def timed(label, func):
+        t0 = time.time()
+        for _ in range(repeat):
+            result = func()
+        elapsed = (time.time() - t0) / repeat
+        print('%-44s %8.4f s' % (label, elapsed))
+        return result, elapsed
+
+    print('%d rows, %d categories' % (n, len(breeds)))
+    cat, _ = timed('Categorical(cats) (one-off encoding)',
+                   lambda: Categorical(cats))
+    print('Memory: %.0f MB as strings, %.0f MB as Categorical'
+          % (cats.nbytes / 1e6, cat.nbytes / 1e6))
+
+    rows = [
+        ("cats == 'tabby'",
+         lambda: cats == 'tabby',
+         lambda: cat == 'tabby'),
+        ("(cats == 'tabby') | (cats == 'siamese')",
+         lambda: (cats == 'tabby') | (cats == 'siamese'),
+         lambda: cat.isin(['tabby', 'siamese'])),
+        ("data[cats == 'tabby']",
+         lambda: data[cats == 'tabby'],
+         lambda: cat.select(data, 'tabby')),
+        ("data[(cats == 'tabby') | (cats == 'siamese')]",
+         lambda: data[(cats == 'tabby') | (cats == 'siamese')],
+         lambda: cat.select(data, 'tabby', 'siamese')),
+    ]
+    for label, strings, categorical in rows:
+        print(label)
+        ref, t_str = timed('  string array', strings)
+        res, t_cat = timed('  Categorical', categorical)
+        assert np.array_equal(ref, res)
+        print('  %.1fx faster' % (t_str / t_cat))
+
+
+if __name__ == '__main__':
+    benchmark()
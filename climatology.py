@@ -0,0 +1,346 @@
+"""
+Streaming climatologies and anomalies from many netCDF files.
+
+science_data.py works with ncep2_climatology_ann.nc, a climatology that
+was computed beforehand.  Building one from decades of daily files with
+xray.open_mfdataset(files).groupby('time.month').mean('time') needs all
+the files open at once and, without dask, all their data in memory.
+This module streams through the files instead:
+
+- Each file is read a few time steps at a time, and its values are
+  added to per-calendar-month (or per-day-of-year) sums and counts of
+  non-NaN values, so memory stays bounded by the accumulators, whatever
+  the number of files
+- Files are processed in parallel in a pool of worker processes, each
+  returning partial accumulators for its file, which are merged by
+  adding them.  Accumulators can also be merged with ones from other
+  runs, e.g. to add a new year to a climatology.
+- A second pass subtracts the climatology from every file, writing one
+  anomaly file per input file with to_netcdf
+- Counts of non-NaN values are kept per point, so missing data and
+  incomplete years are averaged correctly
+
+Example
+-------
+>>> import glob, climatology
+>>> files = sorted(glob.glob('data/ncep2_daily_*.nc'))
+>>> clim = climatology.build(files, ['T', 'u', 'v'], freq='month',
+...                          outfile='data/ncep2_climatology_mon.nc')
+>>> anom_files = climatology.anomalies(files, clim, 'data/anom')
+
+Run this module as a script for a benchmark against open_mfdataset and
+groupby:
+python climatology.py
+"""
+
+from __future__ import division
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import xray
+
+import pipeline
+
+# Number of groups for each frequency
+FREQS = {'month': 12, 'dayofyear': 366}
+
+# Number of time steps read from a file at a time
+TIME_CHUNK = 32
+
+
+def group_index(times, freq='month'):
+    """
+    Return the 0-based calendar group of each datetime64 in `times`:
+    months 0..11, or days of the year 0..365 (day 365 is December 31 in
+    leap years).
+    """
+    if freq not in FREQS:
+        raise ValueError('freq must be one of %s' % sorted(FREQS))
+    times = np.asarray(times, dtype='M8[ns]')
+    years = times.astype('M8[Y]')
+    if freq == 'month':
+        return (times.astype('M8[M]') - years.astype('M8[M]')).view(
+            np.int64)
+    return (times.astype('M8[D]') - years.astype('M8[D]')).view(np.int64)
+
+
+class Accumulator(object):
+    """Sums and counts of non-NaN values of a variable, by group."""
+
+    def __init__(self, ngroups, dims, coords):
+        """
+        Parameters
+        ----------
+        ngroups : int
+            Number of calendar groups, e.g. 12 for months.
+        dims : tuple of str
+            Dimensions of the variable other than time.
+        coords : dict
+            Dimension name -> coordinate values, for the dims.
+        """
+        self.dims = tuple(dims)
+        self.coords = coords
+        shape = (ngroups,) + tuple(len(coords[d]) for d in self.dims)
+        self.sum = np.zeros(shape, dtype=np.float64)
+        self.count = np.zeros(shape, dtype=np.int32)
+
+    def add(self, groups, values):
+        """Add values (time first) in the given groups (one per time)."""
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0)
+        for g in np.unique(groups):
+            sel = groups == g
+            self.sum[g] += values[sel].sum(axis=0)
+            self.count[g] += valid[sel].sum(axis=0, dtype=np.int32)
+
+    def merge(self, other):
+        """Add the sums and counts of another accumulator to this one."""
+        if other.sum.shape != self.sum.shape:
+            raise ValueError('cannot merge accumulators of shapes %s and %s'
+                             % (self.sum.shape, other.sum.shape))
+        self.sum += other.sum
+        self.count += other.count
+        return self
+
+    def mean(self):
+        """Return the mean of each group, NaN where there are no values."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.sum / self.count, np.nan)
+
+
+def _variables(ds, variables, time_dim):
+    """Return the names of the numeric variables with a time dimension."""
+    if variables is None:
+        return [name for name, var in ds.data_vars.items()
+                if time_dim in var.dims and var.dtype.kind in 'biuf']
+    if isinstance(variables, str):
+        return [variables]
+    return list(variables)
+
+
+def _accumulate_file(task):
+    """Return the accumulators of the variables in one file."""
+    filename, variables, freq, time_dim, time_chunk, open_kwargs = task
+    accs = {}
+    with xray.open_dataset(filename, **open_kwargs) as ds:
+        groups = group_index(ds[time_dim].values, freq)
+        for name in _variables(ds, variables, time_dim):
+            var = ds[name]
+            dims = tuple(d for d in var.dims if d != time_dim)
+            var = var.transpose(*((time_dim,) + dims))
+            coords = dict((d, ds[d].values) for d in dims)
+            acc = Accumulator(FREQS[freq], dims, coords)
+            for start in range(0, len(groups), time_chunk):
+                stop = start + time_chunk
+                acc.add(groups[start:stop],
+                        var.isel(**{time_dim: slice(start, stop)}).values)
+            accs[name] = acc
+    return accs
+
+
+def accumulate(files, variables=None, freq='month', time_dim='time',
+               processes=None, time_chunk=TIME_CHUNK, open_kwargs=None):
+    """
+    Return a dict of variable name -> Accumulator over all the files.
+
+    Parameters
+    ----------
+    files : list of str
+        netCDF files to read, e.g. sorted(glob.glob(pattern)).
+    variables : str or list of str, optional
+        Variables to accumulate.  Default is every numeric variable with
+        a time dimension.
+    freq : {'month', 'dayofyear'}, optional
+        Calendar groups.
+    time_dim : str, optional
+        Name of the time dimension, which must decode to datetime64.
+    processes : int, optional
+        Number of worker processes.  Default is the number of CPUs, and
+        with 1 the files are read in this process.
+    time_chunk : int, optional
+        Number of time steps read from a file at a time.
+    open_kwargs : dict, optional
+        Arguments for xray.open_dataset.
+    """
+    if freq not in FREQS:
+        raise ValueError('freq must be one of %s' % sorted(FREQS))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    tasks = [(f, variables, freq, time_dim, time_chunk, open_kwargs or {})
+             for f in files]
+    p = pipeline.Pipeline(tasks)
+    if processes > 1 and len(tasks) > 1:
+        p = p.parallel_map(_accumulate_file, 'process', processes,
+                           ordered=False)
+    else:
+        p = p.map(_accumulate_file)
+    total = {}
+    for accs in p:
+        for name, acc in accs.items():
+            if name in total:
+                total[name].merge(acc)
+            else:
+                total[name] = acc
+    return total
+
+
+def to_dataset(accs, freq='month'):
+    """Return the means of a dict of accumulators as an xray.Dataset."""
+    data_vars, coords = {}, {freq: np.arange(1, FREQS[freq] + 1)}
+    for name, acc in accs.items():
+        data_vars[name] = ((freq,) + acc.dims, acc.mean())
+        coords.update(acc.coords)
+    return xray.Dataset(data_vars, coords=coords)
+
+
+def build(files, variables=None, freq='month', outfile=None, **kwargs):
+    """
+    Return the climatology of the variables in `files`, as a dataset with
+    a `freq` dimension numbered from 1 (month or day of the year), and
+    write it to `outfile` with to_netcdf if given.
+
+    Other keyword arguments are passed to accumulate().
+    """
+    clim = to_dataset(accumulate(files, variables, freq, **kwargs), freq)
+    if outfile is not None:
+        clim.to_netcdf(outfile, mode='w')
+    return clim
+
+
+def _anomaly_file(task):
+    """Write the anomalies of the variables in one file."""
+    (filename, outfile, clim, freq, time_dim, time_chunk,
+     open_kwargs) = task
+    with xray.open_dataset(filename, **open_kwargs) as ds:
+        groups = group_index(ds[time_dim].values, freq)
+        data_vars = {}
+        for name, (dims, means) in clim.items():
+            var = ds[name].transpose(*((time_dim,) + dims))
+            out = np.empty(var.shape, dtype=np.result_type(var.dtype,
+                                                           np.float32))
+            for start in range(0, len(groups), time_chunk):
+                stop = start + time_chunk
+                values = var.isel(**{time_dim: slice(start, stop)}).values
+                np.subtract(values, means[groups[start:stop]],
+                            out=out[start:stop], casting='unsafe')
+            data_vars[name] = (var.dims, out, var.attrs)
+        anom = xray.Dataset(data_vars, coords=ds.coords, attrs=ds.attrs)
+        anom.to_netcdf(outfile, mode='w')
+    return outfile
+
+
+def anomalies(files, clim, outdir, variables=None, freq='month',
+              time_dim='time', processes=None, time_chunk=TIME_CHUNK,
+              suffix='_anom', open_kwargs=None):
+    """
+    Subtract a climatology from every file, writing one anomaly file per
+    input file into `outdir`.
+
+    Parameters
+    ----------
+    files : list of str
+        netCDF files, as for accumulate().
+    clim : xray.Dataset
+        Climatology from build(), with a `freq` dimension.
+    outdir : str
+        Directory for the anomaly files, named like the input files with
+        `suffix` added before the extension.
+    variables : str or list of str, optional
+        Variables to write.  Default is every variable in the
+        climatology.
+    freq, time_dim, processes, time_chunk, open_kwargs
+        As in accumulate().
+
+    Returns
+    -------
+    outfiles : list of str
+        Names of the anomaly files, in the order of `files`.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if variables is None:
+        variables = list(clim.data_vars)
+    elif isinstance(variables, str):
+        variables = [variables]
+    # Plain arrays, which are cheaper to send to the workers
+    means = {}
+    for name in variables:
+        dims = tuple(d for d in clim[name].dims if d != freq)
+        means[name] = (dims, clim[name].transpose(freq, *dims).values)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    tasks = []
+    for filename in files:
+        base, ext = os.path.splitext(os.path.basename(filename))
+        outfile = os.path.join(outdir, base + suffix + ext)
+        tasks.append((filename, outfile, means, freq, time_dim, time_chunk,
+                      open_kwargs or {}))
+    p = pipeline.Pipeline(tasks)
+    if processes > 1 and len(tasks) > 1:
+        p = p.parallel_map(_anomaly_file, 'process', processes)
+    else:
+        p = p.map(_anomaly_file)
+    return list(p)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(nyears=10, shape=(73, 144), dirname=None):
+    """
+    Build a monthly climatology of daily files, one per year, of random
+    temperatures on the NCEP2 grid, and compare with open_mfdataset and
+    groupby('time.month').mean('time').
+    """
+    dirname = tempfile.mkdtemp(dir=dirname)
+    try:
+        rng = np.random.RandomState(0)
+        lat = np.linspace(90, -90, shape[0])
+        lon = np.linspace(0, 360, shape[1], endpoint=False)
+        files = []
+        for year in range(2000, 2000 + nyears):
+            times = np.arange('%d-01-01' % year, '%d-01-01' % (year + 1),
+                              dtype='M8[D]').astype('M8[ns]')
+            T = 280 + 10 * rng.randn(len(times), *shape).astype(np.float32)
+            T[rng.rand(*T.shape) < 0.01] = np.nan
+            ds = xray.Dataset({'T': (('time', 'lat', 'lon'), T)},
+                              coords={'time': times, 'lat': lat,
+                                      'lon': lon})
+            files.append(os.path.join(dirname, 'T_%d.nc' % year))
+            ds.to_netcdf(files[-1])
+        print('%d daily files of %s, %.0f MB'
+              % (nyears, shape, sum(os.path.getsize(f)
+                                    for f in files) / 1e6))
+
+        def timed(label, func):
+            t0 = time.time()
+            result = func()
+            print('%-44s %8.2f s' % (label, time.time() - t0))
+            return result
+
+        def mfdataset():
+            with xray.open_mfdataset(files) as ds:
+                return ds.groupby('time.month').mean('time').load()
+
+        ref = timed('open_mfdataset + groupby mean', mfdataset)
+        ncpu = multiprocessing.cpu_count()
+        for processes in sorted(set([1, 2, ncpu])):
+            clim = timed('climatology.build, %d processes' % processes,
+                         lambda: build(files, 'T', processes=processes))
+            assert np.allclose(clim['T'].values, ref['T'].values,
+                               equal_nan=True)
+        timed('climatology.anomalies', lambda: anomalies(
+            files, clim, os.path.join(dirname, 'anom')))
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,202 @@
+"""
+Process-wide cache of datasets loaded from netCDF files.
+
+science_data.py and science_plots.py each call
+xray.open_dataset('data/ncep2_climatology_ann.nc') and load the same
+variables, and a notebook that reruns its cells reads the same files
+from disk over and over.  A DatasetCache keeps loaded datasets in
+memory:
+
+- Entries are keyed by absolute path, modification time and size of
+  the file, plus the decoding options passed to xray.open_dataset, so
+  a file that changes on disk is reloaded automatically
+- The least recently used datasets are evicted to stay within a budget
+  of bytes
+- Callers get shallow copies of a cached dataset, which share its
+  arrays.  The arrays are read-only, so one caller can't change another
+  caller's data by accident; use ds.copy(deep=True) to get a writable
+  copy.
+- Hit, miss, eviction and byte counters show how well the cache works
+
+Example
+-------
+>>> import dscache
+>>> ds = dscache.open_dataset('data/ncep2_climatology_ann.nc')
+>>> u = ds['u'].values                  # Read-only, shared
+>>> ds = dscache.open_dataset('data/ncep2_climatology_ann.nc')  # Hit
+>>> dscache.stats()                       # hits, misses, bytes, ...
+>>> cache = dscache.DatasetCache(max_bytes=4 * 2**30)  # Separate cache
+
+Run this module as a script for a benchmark against reopening the file:
+python dscache.py
+"""
+
+from __future__ import division
+
+import collections
+import os
+import threading
+import time
+
+import xray
+
+# Default budget for the process-wide cache, in bytes
+MAX_BYTES = 2**30
+
+
+def _hashable(value):
+    """Return `value` (e.g. a list of variable names) in hashable form."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(x) for x in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_hashable(x) for x in value)
+    if isinstance(value, dict):
+        return frozenset((k, _hashable(v)) for k, v in value.items())
+    return value
+
+
+def _nbytes(ds):
+    return sum(var.nbytes for var in ds.variables.values())
+
+
+class DatasetCache(object):
+    """LRU cache of loaded xray datasets with a budget in bytes."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()   # key -> (ds, nbytes)
+        self._keys = {}                             # path -> set of keys
+        self._lock = threading.RLock()
+        self.hits = self.misses = self.evictions = 0
+        self.nbytes = 0
+        self.bytes_loaded = 0
+
+    def _key(self, filename, kwargs):
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        return (path, st.st_mtime, st.st_size, _hashable(kwargs))
+
+    def open_dataset(self, filename, **kwargs):
+        """
+        Return the dataset in `filename`, loaded into memory.
+
+        Keyword arguments are passed to xray.open_dataset (e.g.
+        decode_times=False), and are part of the cache key.  The result
+        is a shallow copy of the cached dataset: variables can be added
+        or removed freely, but the arrays are shared and read-only.
+        """
+        key = self._key(filename, kwargs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0].copy(deep=False)
+            self.misses += 1
+            # Entries for older versions of the file can't be hit again
+            for old in [k for k in self._keys.get(key[0], ())
+                        if k[1:3] != key[1:3]]:
+                self._remove(old)
+        # The file is read without holding the lock, so other threads
+        # can use the cache meanwhile (two threads missing on the same
+        # file both read it)
+        with xray.open_dataset(filename, **kwargs) as ds:
+            ds.load()
+        for var in ds.variables.values():
+            var.values.flags.writeable = False
+        nbytes = _nbytes(ds)
+        with self._lock:
+            self.bytes_loaded += nbytes
+            if nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (ds, nbytes)
+                self._keys.setdefault(key[0], set()).add(key)
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes:
+                    self._evict()
+        return ds.copy(deep=False)
+
+    def _remove(self, key):
+        """Drop the entry for `key` from the entries and the path index."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+
+    def _evict(self):
+        key = next(iter(self._entries))
+        self._remove(key)
+        self.evictions += 1
+
+    def invalidate(self, filename=None):
+        """Drop the entries for `filename`, or all entries if None."""
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+                self._keys.clear()
+                self.nbytes = 0
+            else:
+                path = os.path.abspath(filename)
+                for key in list(self._keys.get(path, ())):
+                    self._remove(key)
+
+    def stats(self):
+        """Return a dict of the cache's counters."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.nbytes,
+                    'bytes_loaded': self.bytes_loaded}
+
+
+# Process-wide cache used by the functions below
+cache = DatasetCache()
+
+
+def open_dataset(filename, **kwargs):
+    """Open and load `filename` through the process-wide cache."""
+    return cache.open_dataset(filename, **kwargs)
+
+
+def stats():
+    """Return the process-wide cache's counters."""
+    return cache.stats()
+
+
+def invalidate(filename=None):
+    """Drop `filename` (or everything) from the process-wide cache."""
+    cache.invalidate(filename)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(filename='data/ncep2_climatology_ann.nc', repeat=20):
+    """Open and load a file `repeat` times, with and without the cache."""
+    def timed(label, func):
+        t0 = time.time()
+        for _ in range(repeat):
+            ds = func()
+            ds['u'].values.sum()
+        elapsed = time.time() - t0
+        print('%-40s %8.4f s per open' % (label, elapsed / repeat))
+        return elapsed
+
+    def reopen():
+        with xray.open_dataset(filename) as ds:
+            return ds.load()
+
+    print('%s, %d opens' % (filename, repeat))
+    t_open = timed('xray.open_dataset + load', reopen)
+    local = DatasetCache()
+    t_cache = timed('DatasetCache.open_dataset',
+                    lambda: local.open_dataset(filename))
+    print('  %.0fx faster; %s' % (t_open / t_cache, local.stats()))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,467 @@
+"""
+Boolean and fancy indexing into preallocated output buffers.
+
+As the Boolean and fancy indexing sections of science_numpy.py point
+out, data[cats == 'calico'] and a[[1, 5, 7, 2]][:, [0, 2]] always make a
+new array, and the second one makes two (the rows, then the columns of
+those rows).  In an inner loop that runs thousands of times, allocating
+and freeing those arrays can take longer than copying the data.  The
+functions here do the same selections, but:
+
+- Write into an `out` buffer supplied by the caller, which can be
+  allocated once and reused.  The buffer may have more rows than needed
+  (e.g. as many as the input), and the filled part is returned as a view
+- Select rows and columns together in one pass, without making the
+  intermediate array of whole rows
+- Work in blocks of rows, with a small fixed-size scratch array of
+  offsets, so no temporary as large as the output is ever made
+- Check the indices once and then call np.take with mode='wrap', which
+  writes directly into `out` (with the default mode='raise', np.take
+  copies through a temporary buffer when `out` is given)
+
+When the same a[np.ix_(rows, cols)] selection is applied over and over
+to arrays of the same shape, numpy broadcasts the index arrays and works
+out the offset of every element each time.  An IndexPlan does that
+once, for a given shape, selection and memory layout (C order, Fortran
+order or strided view), and then applies to any array with that shape
+and layout, or to a whole stack of them, with a single np.take.
+index_plan() keeps the most recently used plans in a cache, keyed by
+shape, layout and selection, so take_ix() can replace a[np.ix_(...)]
+without keeping track of plans.
+
+Example
+-------
+>>> import indexing
+>>> buf = np.empty_like(data)
+>>> subset = indexing.compress(cats == 'calico', data, out=buf)
+>>> sub = indexing.gather(a, [1, 5, 7, 2], cols=[0, 2], out=buf2)
+>>> sub = indexing.take_ix(a, [1, 3], [2, 0])     # a[np.ix_([1,3], [2,0])]
+>>> plan = indexing.index_plan(a.shape, [1, 3], [2, 0])
+>>> for arr in arrays:
+...     sub = plan.apply(arr, out=sub)
+
+Run this module as a script for benchmarks (using tracemalloc to count
+the bytes that are no longer allocated):
+python indexing.py
+"""
+
+from __future__ import division
+
+import collections
+import time
+import tracemalloc
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# Size in elements of the scratch array of offsets used per block
+BLOCK = 2**16
+
+
+def _flat_view(a):
+    """
+    Return (buf, strides): a 1-D view of the memory spanned by `a`, and
+    the strides of `a` in elements, so that a[i, j, ...] is
+    buf[i * strides[0] + j * strides[1] + ...].
+
+    Returns None if `a` has negative strides or strides that aren't a
+    whole number of elements.
+    """
+    item = a.itemsize
+    if any(s < 0 or s % item for s in a.strides):
+        return None
+    strides = tuple(s // item for s in a.strides)
+    span = 1 + sum((n - 1) * s for n, s in zip(a.shape, strides))
+    buf = as_strided(a, shape=(span,), strides=(item,), writeable=False)
+    return buf, strides
+
+
+def _check_index(index, n, name):
+    """Return `index` as an intp array of non-negative indices < n."""
+    index = np.asarray(index)
+    if index.dtype == bool:
+        if index.shape != (n,):
+            raise IndexError('%s mask has shape %s, expected (%d,)'
+                             % (name, index.shape, n))
+        return np.flatnonzero(index)
+    index = index.astype(np.intp, copy=False).ravel()
+    if index.size:
+        lo, hi = index.min(), index.max()
+        if lo < -n or hi >= n:
+            raise IndexError('%s index %d is out of bounds for size %d'
+                             % (name, lo if lo < -n else hi, n))
+        if lo < 0:
+            index = np.where(index < 0, index + n, index)
+    return index
+
+
+def _inner_offsets(shape, strides, cols):
+    """Return the flat offsets of the elements of one row, after `cols`."""
+    if cols is not None:
+        shape = (len(cols),) + shape[1:]
+    offsets = np.zeros(shape, dtype=np.intp)
+    for axis, stride in enumerate(strides):
+        pos = cols if (axis == 0 and cols is not None) else \
+            np.arange(shape[axis])
+        view = [1] * len(shape)
+        view[axis] = shape[axis]
+        offsets += (pos * stride).reshape(view)
+    return offsets.ravel()
+
+
+def _output(out, shape, dtype):
+    """Return a buffer for a result of `shape`, checking `out` if given."""
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.dtype != dtype:
+        raise ValueError('out has dtype %s, expected %s' % (out.dtype, dtype))
+    if out.shape[1:] != shape[1:] or out.shape[0] < shape[0]:
+        raise ValueError('out has shape %s, need at least %s'
+                         % (out.shape, shape))
+    if not out.flags.c_contiguous:
+        raise ValueError('out must be C-contiguous')
+    return out[:shape[0]]
+
+
+def _gather_rows(a, rows, cols, out):
+    """Copy a[rows] (and then [:, cols]) into `out`; indices are valid."""
+    if cols is None and a.flags.c_contiguous:
+        np.take(a, rows, axis=0, out=out, mode='wrap')
+        return out
+    flat = _flat_view(a)
+    if flat is None:
+        a = np.ascontiguousarray(a)
+        flat = _flat_view(a)
+    buf, strides = flat
+    inner = _inner_offsets(a.shape[1:], strides[1:], cols)
+    out_flat = out.reshape(len(rows), -1)
+    step = max(1, BLOCK // max(1, len(inner)))
+    scratch = np.empty(min(step, len(rows)) * len(inner), dtype=np.intp)
+    for lo in range(0, len(rows), step):
+        block = rows[lo:lo + step]
+        offsets = scratch[:len(block) * len(inner)].reshape(len(block), -1)
+        np.multiply(block[:, None], strides[0], out=offsets)
+        offsets += inner
+        np.take(buf, offsets, out=out_flat[lo:lo + len(block)], mode='wrap')
+    return out
+
+
+def gather(a, rows, cols=None, out=None):
+    """
+    Select rows (and optionally columns) of `a` into a buffer.
+
+    Same as a[rows] or a[rows][:, cols], without intermediate arrays.
+
+    Parameters
+    ----------
+    a : ndarray
+        Array to select from, with at least 1 (2 if `cols` is given)
+        dimensions.
+    rows : sequence of int or bool
+        Row indices (negative indices count from the end) or a Boolean
+        mask over the rows.
+    cols : sequence of int or bool, optional
+        Column indices or mask, applied after the rows.
+    out : ndarray, optional
+        C-contiguous buffer with the dtype of `a`, the right shape after
+        the first axis, and at least as many rows as are selected.
+
+    Returns
+    -------
+    result : ndarray
+        The selection.  A view of the first rows of `out`, if given.
+    """
+    a = np.asarray(a)
+    rows = _check_index(rows, a.shape[0], 'Row')
+    if cols is not None:
+        if a.ndim < 2:
+            raise IndexError('cols given for a 1-D array')
+        cols = _check_index(cols, a.shape[1], 'Column')
+        shape = (len(rows), len(cols)) + a.shape[2:]
+    else:
+        shape = (len(rows),) + a.shape[1:]
+    out = _output(out, shape, a.dtype)
+    if out.size:
+        _gather_rows(a, rows, cols, out)
+    return out
+
+
+def compress(condition, a, cols=None, out=None):
+    """
+    Select the rows of `a` where `condition` is True into a buffer.
+
+    Same as a[condition] or a[condition][:, cols] (np.compress along
+    axis 0), without intermediate arrays: the row indices are found
+    block by block.  See gather() for the parameters.
+    """
+    a = np.asarray(a)
+    condition = np.asarray(condition, dtype=bool).ravel()
+    if condition.shape != a.shape[:1]:
+        raise IndexError('condition has shape %s, expected %s'
+                         % (condition.shape, a.shape[:1]))
+    if cols is not None:
+        if a.ndim < 2:
+            raise IndexError('cols given for a 1-D array')
+        cols = _check_index(cols, a.shape[1], 'Column')
+        row_shape = (len(cols),) + a.shape[2:]
+    else:
+        row_shape = a.shape[1:]
+    out = _output(out, (np.count_nonzero(condition),) + row_shape, a.dtype)
+    filled = 0
+    for lo in range(0, len(condition), BLOCK):
+        rows = np.flatnonzero(condition[lo:lo + BLOCK])
+        if len(rows):
+            rows += lo
+            _gather_rows(a, rows, cols, out[filled:filled + len(rows)])
+            filled += len(rows)
+    return out
+
+
+# ----------------------------------------------------------------------
+# Index plans
+# ----------------------------------------------------------------------
+
+# Maximum number of plans kept by index_plan()
+MAX_PLANS = 64
+
+_plans = collections.OrderedDict()
+
+
+class IndexPlan(object):
+    """
+    Precomputed flat offsets for a[np.ix_(rows, cols)].
+
+    A plan is made for one shape of the last two axes, one selection and
+    one memory layout.  It can then be applied to any array with that
+    shape and layout, or to a stack of them, with a single np.take.
+    """
+
+    def __init__(self, shape, rows=None, cols=None, strides=None):
+        """
+        Parameters
+        ----------
+        shape : tuple of 2 ints
+            Shape (m, n) of the arrays the plan is for.
+        rows, cols : sequence of int or bool, optional
+            Row and column indices or masks.  None selects all of them.
+        strides : tuple of 2 ints, optional
+            Strides of the last two axes in elements, e.g. (1, m) for a
+            Fortran-ordered array.  Default is C order, (n, 1).
+        """
+        m, n = self.shape = tuple(shape)
+        self.strides = (n, 1) if strides is None else tuple(strides)
+        self.rows = np.arange(m) if rows is None else \
+            _check_index(rows, m, 'Row')
+        self.cols = np.arange(n) if cols is None else \
+            _check_index(cols, n, 'Column')
+        s0, s1 = self.strides
+        self.offsets = self.rows[:, None] * s0 + self.cols * s1
+        self.span = 1 + (m - 1) * s0 + (n - 1) * s1 if m and n else 0
+
+    def __repr__(self):
+        return 'IndexPlan(shape=%s, %d rows, %d cols, strides=%s)' % (
+            self.shape, len(self.rows), len(self.cols), self.strides)
+
+    def apply(self, a, out=None):
+        """
+        Return a[..., rows, :][..., cols] for `a` of shape (..., m, n).
+
+        Raises ValueError if `a` doesn't have the plan's shape and layout.
+        """
+        a = np.asarray(a)
+        if a.shape[-2:] != self.shape:
+            raise ValueError('Plan is for shape %s, not %s'
+                             % (self.shape, a.shape[-2:]))
+        lead = a.shape[:-2]
+        shape = lead + self.offsets.shape
+        if out is None:
+            out = np.empty(shape, dtype=a.dtype)
+        elif out.shape != shape or out.dtype != a.dtype:
+            raise ValueError('out must have shape %s and dtype %s'
+                             % (shape, a.dtype))
+        if not out.size:
+            return out
+        # Stack of arrays as (k, m, n), then as a (k, span) view of each
+        # array's memory, so the offsets apply along axis 1
+        stack = a.reshape((-1,) + self.shape)
+        if a.flags.c_contiguous and self.strides == (self.shape[1], 1):
+            buf = stack.reshape(len(stack), -1)
+        else:
+            item = a.itemsize
+            if (stack.strides[0] < 0 or stack.strides[0] % item
+                    or _layout(stack) != self.strides):
+                raise ValueError('Plan is for strides %s, array has %s'
+                                 % (self.strides, _layout(stack)))
+            buf = as_strided(stack, shape=(len(stack), self.span),
+                             strides=(stack.strides[0], item),
+                             writeable=False)
+        if len(buf) == 1:
+            np.take(buf[0], self.offsets, out=out.reshape(self.offsets.shape),
+                    mode='wrap')
+        else:
+            np.take(buf, self.offsets, axis=1,
+                    out=out.reshape((len(buf),) + self.offsets.shape),
+                    mode='wrap')
+        return out
+
+
+def _selection_key(index):
+    if index is None:
+        return None
+    index = np.asarray(index)
+    return index.dtype.str, index.shape, index.tobytes()
+
+
+def _layout(a):
+    """Return the element strides of the last two axes of `a`, or None."""
+    item = a.itemsize
+    strides = a.strides[-2:]
+    if any(s < 0 or s % item for s in strides):
+        return None
+    return tuple(s // item for s in strides)
+
+
+def index_plan(shape, rows=None, cols=None, strides=None):
+    """
+    Return an IndexPlan, reusing a cached one if possible.
+
+    The last MAX_PLANS plans are kept, keyed by shape, layout and
+    selection, and the least recently used one is dropped first.
+    """
+    key = (tuple(shape), strides and tuple(strides), _selection_key(rows),
+           _selection_key(cols))
+    plan = _plans.pop(key, None)
+    if plan is None:
+        plan = IndexPlan(shape, rows, cols, strides)
+        if len(_plans) >= MAX_PLANS:
+            _plans.popitem(last=False)
+    _plans[key] = plan
+    return plan
+
+
+def take_ix(a, rows=None, cols=None, out=None):
+    """
+    Same as a[np.ix_(rows, cols)], or a[..., rows, :][..., cols] for a
+    stack of arrays, using a cached IndexPlan.
+    """
+    a = np.asarray(a)
+    if a.ndim < 2:
+        raise ValueError('Expected an array of at least 2 dimensions, got '
+                         'shape %s' % (a.shape,))
+    strides = _layout(a)
+    if strides is None:
+        a = np.ascontiguousarray(a)
+        strides = _layout(a)
+    try:
+        return index_plan(a.shape[-2:], rows, cols, strides).apply(a, out)
+    except ValueError:
+        if out is not None or a.flags.c_contiguous:
+            raise
+        # Merging the leading axes of the stack made a C-ordered copy
+        return take_ix(np.ascontiguousarray(a), rows, cols)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _allocated(func):
+    """Return the peak memory in bytes allocated while running func()."""
+    func()      # Warm up
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(nrow=10**6, ncol=8, repeat=200):
+    """Time and count allocations of indexing with and without buffers."""
+    rng = np.random.RandomState(0)
+    data = rng.randn(nrow, ncol)
+    cats = rng.randint(0, 3, size=nrow)
+    mask = cats == 1
+    rows = rng.randint(0, nrow, size=nrow // 10)
+    cols = [0, 2, 5]
+    buf_rows = np.empty_like(data)
+    buf_cols = np.empty((nrow, len(cols)))
+    buf_inner = np.empty((nrow, ncol - 1))
+
+    cases = [
+        ('data[mask]',
+         lambda: data[mask],
+         lambda: compress(mask, data, out=buf_rows)),
+        ('data[mask][:, cols]',
+         lambda: data[mask][:, cols],
+         lambda: compress(mask, data, cols=cols, out=buf_cols)),
+        ('data[rows]',
+         lambda: data[rows],
+         lambda: gather(data, rows, out=buf_rows)),
+        ('data[rows][:, cols]',
+         lambda: data[rows][:, cols],
+         lambda: gather(data, rows, cols=cols, out=buf_cols)),
+        ('data[:, 1:][rows]  (non-contiguous)',
+         lambda: data[:, 1:][rows],
+         lambda: gather(data[:, 1:], rows, out=buf_inner)),
+    ]
+
+    print('%d x %d array, %d iterations' % (nrow, ncol, repeat))
+    print('%-38s %11s %11s %14s' % ('', 'ms / iter', 'MB / iter',
+                                    'MB avoided'))
+    for label, numpy_func, buffered_func in cases:
+        assert np.array_equal(numpy_func(), buffered_func())
+        print(label)
+        mb = {}
+        for name, func in (('numpy', numpy_func),
+                           ('out= buffer', buffered_func)):
+            mb[name] = _allocated(func) / 1e6
+            t0 = time.time()
+            for _ in range(repeat):
+                func()
+            elapsed = (time.time() - t0) / repeat
+            print('  %-36s %11.3f %11.2f' % (name, 1e3 * elapsed, mb[name]))
+        print('  %-36s %11s %11s %14.0f' % (
+            'allocations avoided', '', '',
+            repeat * (mb['numpy'] - mb['out= buffer'])))
+
+
+def benchmark_plans(shape=(500, 400), nsel=(100, 50), stack=16,
+                    repeat=2000):
+    """Time repeated np.ix_ selections against cached index plans."""
+    rng = np.random.RandomState(0)
+    a = rng.randn(*shape)
+    st = rng.randn(stack, *shape)
+    rows = rng.randint(0, shape[0], size=nsel[0])
+    cols = rng.randint(0, shape[1], size=nsel[1])
+    plan = index_plan(shape, rows, cols)
+    buf = np.empty(nsel)
+    buf_st = np.empty((stack,) + nsel)
+
+    cases = [
+        ('a[np.ix_(rows, cols)]', lambda: a[np.ix_(rows, cols)]),
+        ('take_ix(a, rows, cols)', lambda: take_ix(a, rows, cols)),
+        ('plan.apply(a, out=buf)', lambda: plan.apply(a, out=buf)),
+        ('stack[:, rows[:, None], cols]',
+         lambda: st[:, rows[:, None], cols]),
+        ('plan.apply(stack, out=buf)', lambda: plan.apply(st, out=buf_st)),
+    ]
+    print('%s array (and stack of %d), %d x %d selection, %d iterations'
+          % (shape, stack, nsel[0], nsel[1], repeat))
+    ref = a[np.ix_(rows, cols)]
+    ref_st = st[:, rows[:, None], cols]
+    for label, func in cases:
+        result = func()
+        assert np.array_equal(result, ref_st if result.ndim == 3 else ref)
+        t0 = time.time()
+        for _ in range(repeat):
+            func()
+        print('%-36s %10.1f us' % (label,
+                                   1e6 * (time.time() - t0) / repeat))
+
+
+if __name__ == '__main__':
+    benchmark()
+    print()
+    benchmark_plans()
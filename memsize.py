@@ -0,0 +1,310 @@
+"""
+Deep memory sizes of Python objects.
+
+sys.getsizeof(word_counts), for the defaultdict or Counter in the
+collections section of advanced.py, gives the size of the dict's hash
+table but not of the strings and ints it refers to, and for a list of
+Vector objects it gives only the array of pointers.  This module walks
+the whole graph of objects reachable from a root and adds them up:
+
+- Every object is counted once, however many times it is referred to,
+  so cycles and shared objects (e.g. interned strings) are handled
+- Instances are counted with their attribute values (and __dict__, if
+  they have one).  Modules, classes, functions and code are shared
+  program structure, so they are neither counted nor followed.
+- numpy arrays are counted as a header plus their data buffer.  A
+  buffer shared by views and slices is counted once, with the array
+  that owns it, and the views as their headers only.  (A buffer whose
+  owner is reachable only through views is counted with the first
+  view found.)
+- The bytes are attributed by type and by owner: the path from the root
+  to each object, cut off at a given depth (e.g. "['word_counts']"),
+  and reported ranked from largest to smallest
+
+Example
+-------
+>>> import memsize
+>>> memsize.deep_size(word_counts)
+>>> report = memsize.profile({'word_counts': word_counts,
+...                           'vectors': vectors})
+>>> print(report)
+>>> report.by_type['str']
+>>> print(memsize.profile(globals(), depth=1).format(top=5))
+
+Run this module as a script to compare with sys.getsizeof and the
+allocations seen by tracemalloc:
+python memsize.py
+"""
+
+from __future__ import division
+
+import collections
+import gc
+import sys
+import time
+import tracemalloc
+import types
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Types that are part of the program rather than its data
+SKIP_TYPES = (types.ModuleType, type, types.FunctionType,
+              types.BuiltinFunctionType, types.MethodType, types.CodeType,
+              types.FrameType, types.GetSetDescriptorType,
+              types.MemberDescriptorType)
+
+# Types with no references to other objects worth following
+_LEAF_TYPES = (str, bytes, bytearray, int, float, complex, bool,
+               type(None), range)
+
+
+def _format_bytes(n):
+    """Format a number of bytes as e.g. '12.3 MB'."""
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(n) < 1000 or unit == 'GB':
+            return ('%d %s' if unit == 'B' else '%.1f %s') % (n, unit)
+        n /= 1000
+
+
+def _slot_names(cls):
+    """Return the names in the __slots__ of `cls` and its bases."""
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(s for s in slots if s not in ('__dict__',
+                                                   '__weakref__'))
+    return names
+
+
+class Report(object):
+    """Deep size of an object graph, broken down by type and by owner."""
+
+    def __init__(self, total, count, by_type, by_owner):
+        self.total = total
+        self.count = count
+        # Type name -> [bytes, number of objects]
+        self.by_type = by_type
+        # Owner path -> bytes
+        self.by_owner = by_owner
+
+    def __repr__(self):
+        return '<Report: %s in %d objects>' % (_format_bytes(self.total),
+                                               self.count)
+
+    def __str__(self):
+        return self.format()
+
+    def format(self, top=10):
+        """Return the report as text, with the `top` types and owners."""
+        total = max(self.total, 1)
+        lines = ['Total %s in %d objects' % (_format_bytes(self.total),
+                                             self.count),
+                 '', 'By type:']
+        ranked = sorted(self.by_type.items(), key=lambda x: -x[1][0])
+        for name, (nbytes, count) in ranked[:top]:
+            lines.append('  %10s %5.1f%% %10d  %s'
+                         % (_format_bytes(nbytes), 100 * nbytes / total,
+                            count, name))
+        lines.extend(['', 'By owner:'])
+        ranked = sorted(self.by_owner.items(), key=lambda x: -x[1])
+        for owner, nbytes in ranked[:top]:
+            lines.append('  %10s %5.1f%%  %s'
+                         % (_format_bytes(nbytes), 100 * nbytes / total,
+                            owner))
+        return '\n'.join(lines)
+
+
+def _children(obj, path, depth):
+    """
+    Return (child, path) pairs for the objects referred to by `obj`.
+    Paths are only extended down to `depth` levels below the root.
+    """
+    extend = path.count('\0') < depth
+
+    def label(suffix):
+        return path + '\0' + suffix if extend else path
+
+    if isinstance(obj, dict):
+        if not extend:
+            return [(x, path) for item in obj.items() for x in item]
+        items = []
+        for key, value in obj.items():
+            lab = label('[%r]' % (key,))
+            items.append((key, lab))
+            items.append((value, lab))
+        return items
+    if isinstance(obj, (list, tuple, collections.deque)):
+        if not extend:
+            return [(x, path) for x in obj]
+        return [(x, label('[%d]' % i)) for i, x in enumerate(obj)]
+    if isinstance(obj, (set, frozenset)):
+        return [(x, label('{}')) for x in obj]
+    if not extend:
+        # Instances' attribute values and slots, or the contents of other
+        # containers.  On Python 3.11+, reading an instance's __dict__
+        # would create a dict that it doesn't otherwise have, while
+        # gc.get_referents returns the attribute values directly.
+        return [(x, path) for x in gc.get_referents(obj)
+                if not isinstance(x, SKIP_TYPES)]
+    # Near the root, get attribute names for the owner paths
+    children = []
+    attrs = getattr(obj, '__dict__', None)
+    if isinstance(attrs, dict):
+        # Pushed first, so that the values are visited first, with their
+        # attribute names
+        children.append((attrs, path))
+        children.extend((value, label('.' + name))
+                        for name, value in attrs.items())
+    slots = _slot_names(type(obj))
+    for name in slots:
+        try:
+            children.append((getattr(obj, name), label('.' + name)))
+        except AttributeError:
+            pass
+    if attrs is None and not slots:
+        children.extend((x, path) for x in gc.get_referents(obj)
+                        if not isinstance(x, SKIP_TYPES))
+    return children
+
+
+def _array_sizes(arr):
+    """
+    Return (bytes, owner) for a numpy array.  An array that owns its
+    data buffer is counted with it, and owner is None.  A view is
+    counted as its header only, and owner is the object at the end of
+    its .base chain, which owns the buffer.
+    """
+    size = sys.getsizeof(arr)
+    if arr.base is None:
+        return size, None
+    owner = arr.base
+    while isinstance(owner, np.ndarray) and owner.base is not None:
+        owner = owner.base
+    return size, owner
+
+
+def profile(obj, depth=1, root='root'):
+    """
+    Walk the objects reachable from `obj`, returning a Report.
+
+    Parameters
+    ----------
+    obj : object
+        Root of the object graph, e.g. a container or globals().
+    depth : int, optional
+        Number of levels of container keys, indices and attributes
+        below the root that owners are broken down to.
+    root : str, optional
+        Name of the root in owner paths.
+    """
+    by_type = collections.defaultdict(lambda: [0, 0])
+    by_owner = collections.defaultdict(int)
+    seen = set()
+    # Keep the objects alive, so their ids aren't reused during the walk
+    alive = []
+    # (buffer owner, path) for each view of an array
+    owners = []
+    total = count = 0
+    stack = [(obj, root)]
+    while stack:
+        x, path = stack.pop()
+        if id(x) in seen or isinstance(x, SKIP_TYPES):
+            continue
+        seen.add(id(x))
+        alive.append(x)
+        if np is not None and isinstance(x, np.ndarray):
+            size, owner = _array_sizes(x)
+            if owner is not None:
+                owners.append((owner, path))
+            if x.dtype.hasobject:
+                stack.extend((v, path) for v in x.ravel().tolist())
+        else:
+            size = sys.getsizeof(x)
+            if not isinstance(x, _LEAF_TYPES):
+                stack.extend(_children(x, path, depth))
+        total += size
+        count += 1
+        entry = by_type[type(x).__name__]
+        entry[0] += size
+        entry[1] += 1
+        by_owner[path] += size
+        if not stack:
+            # Buffers of views whose owners aren't reachable otherwise
+            # are counted with the first view found
+            stack = [(o, p) for o, p in reversed(owners)
+                     if id(o) not in seen]
+            owners = []
+    by_owner = dict((path.replace('\0', ''), nbytes)
+                    for path, nbytes in by_owner.items())
+    return Report(total, count, dict(by_type), by_owner)
+
+
+def deep_size(obj):
+    """Return the total bytes of `obj` and everything it refers to."""
+    return profile(obj, depth=0).total
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+class _Vector(object):
+    """Like the Vector class in advanced.py."""
+
+    def __init__(self, x, y):
+        self.x = float(x)
+        self.y = float(y)
+
+
+def benchmark(nwords=10**6, nvectors=10**5):
+    """
+    Compare sys.getsizeof and deep_size with the memory allocated to
+    build some typical objects, as measured by tracemalloc.
+
+    deep_size can only be as accurate as each type's __sizeof__.  For
+    example, on Python 3.11+, instances keep their attribute values in
+    a separate block that sys.getsizeof(instance) leaves out.
+    """
+    rng = np.random.RandomState(0) if np is not None else None
+
+    def build_counts():
+        words = ['word%d' % i for i in rng.zipf(1.5, nwords) % 50000]
+        return collections.Counter(words)
+
+    def build_vectors():
+        return [_Vector(i, 2 * i) for i in range(nvectors)]
+
+    def build_arrays():
+        base = np.arange(10**6, dtype=float)
+        return {'base': base, 'views': [base[i::10] for i in range(10)],
+                'copy': base[:1000].copy()}
+
+    print('%-32s %14s %14s %14s %10s'
+          % ('', 'sys.getsizeof', 'deep_size', 'tracemalloc', 'walk'))
+    for label, build in (('Counter of %d words' % nwords, build_counts),
+                         ('list of %d Vectors' % nvectors, build_vectors),
+                         ('array, 10 views and a copy', build_arrays)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        obj = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        t0 = time.time()
+        size = deep_size(obj)
+        elapsed = time.time() - t0
+        print('%-32s %14s %14s %14s %8.3f s'
+              % (label, _format_bytes(sys.getsizeof(obj)),
+                 _format_bytes(size), _format_bytes(allocated), elapsed))
+    print('')
+    print(profile({'word_counts': build_counts(),
+                   'vectors': build_vectors(),
+                   'arrays': build_arrays()}, depth=1).format(top=6))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,636 @@
+"""
+Out-of-core computations on arrays stored in .npy files.
+
+x.dot(y) in the linear algebra section of science_numpy.py needs both
+matrices in memory, and so does np.load('some_array.npy') from the file
+I/O section.  With np.load(filename, mmap_mode='r'), an array stays on
+disk and is read on demand, but calling x.dot(y) on memory-mapped
+matrices still reads everything into memory (and for matrices larger
+than memory, thrashes the page cache).  The functions here work on
+memory-mapped arrays in tiles that fit a memory budget:
+
+- matmul:   Blocked matrix multiply.  Tiles of the inputs are read by a
+            thread pool while the previous tiles are multiplied (numpy's
+            BLAS releases the GIL), and finished tiles of the product are
+            written to a memory-mapped output .npy file in the background.
+- Chunked:  Reductions (sum, mean, var, std, any, all) and cumsum along
+            any axis, streaming over chunks of leading-axis rows of a
+            memory-mapped array, or over generated chunks.  Partial
+            results are combined pairwise, and mean / variance use
+            per-chunk moments merged with Chan et al.'s update of
+            Welford's algorithm, so rounding errors grow with log(number
+            of chunks).  cumsum carries its running total from chunk to
+            chunk, and any / all stop reading as soon as the answer is
+            known.  Chunks can be read and reduced in a thread pool.
+
+Example
+-------
+>>> import outofcore
+>>> x = np.load('x.npy', mmap_mode='r')
+>>> y = np.load('y.npy', mmap_mode='r')
+>>> stats = {}
+>>> z = outofcore.matmul(x, y, out='z.npy', memory=2**30, stats=stats)
+>>> chunked = outofcore.Chunked(x, threads=4)
+>>> chunked.mean(axis=0)
+>>> chunked.cumsum(axis=0, out='xcumsum.npy')
+>>> outofcore.Chunked(lambda: (np.random.randn(10**6) for _ in range(1000))
+...                   ).std()
+
+Run this module as a script for benchmarks:
+python outofcore.py
+"""
+
+from __future__ import division
+
+import collections
+import itertools
+import operator
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent import futures
+
+import numpy as np
+
+# Default memory budget in bytes
+MEMORY = 256 * 2**20
+
+
+def _open_output(out, shape, dtype):
+    """Return an array for a result: `out` if an array, else a new one."""
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if isinstance(out, str):
+        return np.lib.format.open_memmap(out, mode='w+', dtype=dtype,
+                                         shape=shape)
+    if out.shape != shape:
+        raise ValueError('out has shape %s, expected %s' % (out.shape, shape))
+    return out
+
+
+# ----------------------------------------------------------------------
+# Matrix multiply
+# ----------------------------------------------------------------------
+
+def _tile_sizes(memory, itemsize, dims):
+    """
+    Return tile sizes along each of `dims` that fit the memory budget.
+
+    The working set is two sets of input tiles (the ones being multiplied
+    and the ones being read), the accumulated product tile, a temporary
+    product and the tile being written: 7 tiles in all.  Each dimension
+    is split into equal tiles, so there are no thin tiles at the edges.
+    """
+    t = max(1, int(np.sqrt(memory / (7 * itemsize))))
+    sizes = []
+    for dim in dims:
+        if dim == 0:
+            # Nothing to split, but range(0, 0, size) needs size > 0
+            sizes.append(1)
+            continue
+        ntiles = -(-dim // t)
+        sizes.append(-(-dim // ntiles))
+    return sizes
+
+
+def matmul(a, b, out=None, memory=MEMORY, io_threads=2, stats=None):
+    """
+    Matrix product of 2-D arrays too large for memory.
+
+    Parameters
+    ----------
+    a, b : ndarray, usually np.memmap
+        Matrices of shapes (m, k) and (k, n), e.g. from
+        np.load(filename, mmap_mode='r').
+    out : str or ndarray, optional
+        Filename of a .npy file to create for the (m, n) product, or an
+        array (e.g. a np.memmap) to write it into.  Default is a new
+        in-memory array.
+    memory : int, optional
+        Approximate memory budget in bytes for the tiles.
+    io_threads : int, optional
+        Number of threads reading and writing tiles.
+    stats : dict, optional
+        If given, filled in with timings in seconds: 'total', 'stall'
+        (waiting for tiles to be read), 'read', 'compute' and 'write',
+        plus 'gflops' and 'bytes_read'.
+
+    Returns
+    -------
+    out : ndarray or np.memmap
+        The product.
+    """
+    if a.ndim != 2 or b.ndim != 2 or a.shape[1] != b.shape[0]:
+        raise ValueError('Shapes %s and %s are not aligned'
+                         % (a.shape, b.shape))
+    t_start = time.time()
+    m, k = a.shape
+    n = b.shape[1]
+    dtype = np.result_type(a.dtype, b.dtype)
+    out = _open_output(out, (m, n), dtype)
+    tm, tn, tk = _tile_sizes(memory, dtype.itemsize, (m, n, k))
+    if k == 0:
+        # Sums of no products, as np.matmul gives
+        out[...] = 0
+
+    timings = collections.Counter()
+
+    def read(a_key, b_key):
+        t0 = time.time()
+        a_tile = b_tile = None
+        if a_key is not None:
+            i, kk = a_key
+            a_tile = np.array(a[i:i + tm, kk:kk + tk], dtype=dtype)
+        if b_key is not None:
+            kk, j = b_key
+            b_tile = np.array(b[kk:kk + tk, j:j + tn], dtype=dtype)
+        return a_tile, b_tile, time.time() - t0
+
+    def write(i, j, tile):
+        t0 = time.time()
+        out[i:i + tile.shape[0], j:j + tile.shape[1]] = tile
+        return time.time() - t0
+
+    # Tiles are multiplied in this order, so consecutive steps often
+    # share a tile of a (when k fits in one tile) or of b
+    steps = [(i, j, kk) for i in range(0, m, tm) for j in range(0, n, tn)
+             for kk in range(0, k, tk)]
+
+    with futures.ThreadPoolExecutor(max(1, io_threads)) as pool:
+        # Submit reads one step ahead; a tile that is the same as in the
+        # previous step isn't read again
+        reads = collections.deque()
+        keys = [None, None]
+
+        def submit(step):
+            i, j, kk = step
+            a_key = (i, kk) if (i, kk) != keys[0] else None
+            b_key = (kk, j) if (kk, j) != keys[1] else None
+            keys[:] = [(i, kk), (kk, j)]
+            reads.append(pool.submit(read, a_key, b_key))
+
+        writing = None
+        a_tile = b_tile = acc = None
+        for s, (i, j, kk) in enumerate(steps):
+            if s == 0:
+                submit(steps[0])
+            if s + 1 < len(steps):
+                submit(steps[s + 1])
+            t0 = time.time()
+            new_a, new_b, elapsed = reads.popleft().result()
+            timings['stall'] += time.time() - t0
+            timings['read'] += elapsed
+            if new_a is not None:
+                a_tile = new_a
+                timings['bytes_read'] += new_a.nbytes
+            if new_b is not None:
+                b_tile = new_b
+                timings['bytes_read'] += new_b.nbytes
+
+            t0 = time.time()
+            if kk == 0:
+                acc = a_tile.dot(b_tile)
+            else:
+                acc += a_tile.dot(b_tile)
+            timings['compute'] += time.time() - t0
+
+            if kk + tk >= k:
+                # Finished tile: write it while the next ones are computed
+                if writing is not None:
+                    timings['write'] += writing.result()
+                writing = pool.submit(write, i, j, acc)
+                acc = None
+        if writing is not None:
+            timings['write'] += writing.result()
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    if stats is not None:
+        stats.update(timings)
+        stats['total'] = time.time() - t_start
+        stats['gflops'] = 2 * m * n * k / stats['total'] / 1e9
+        stats['tile'] = (tm, tn, tk)
+    return out
+
+
+# ----------------------------------------------------------------------
+# Chunked reductions
+# ----------------------------------------------------------------------
+
+# Default chunk size in bytes
+CHUNK_BYTES = 16 * 2**20
+
+
+def _map(func, items, threads):
+    """
+    Like map(func, items), in a pool of `threads` threads.
+
+    Results come out in order, and at most 2 * threads tasks are in
+    flight at a time, as in pipeline.parallel_map.  Tasks not yet started
+    are cancelled if the caller stops iterating.
+    """
+    if threads <= 1:
+        for x in items:
+            yield func(x)
+        return
+    with futures.ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        try:
+            for x in items:
+                pending.append(pool.submit(func, x))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class _Pairwise(object):
+    """
+    Combine a sequence of partial results pairwise, like a binary counter.
+
+    Partial results are combined in pairs, then pairs of pairs, and so
+    on, so each one goes through O(log n) combinations instead of O(n)
+    when added one at a time.  Only O(log n) partial results are kept.
+    """
+
+    def __init__(self, combine=operator.add):
+        self.combine = combine
+        self.stack = []     # (number of partial results, combined value)
+
+    def add(self, value):
+        count = 1
+        while self.stack and self.stack[-1][0] == count:
+            n, previous = self.stack.pop()
+            value = self.combine(previous, value)
+            count += n
+        self.stack.append((count, value))
+
+    def total(self):
+        """Return the combination of all partial results so far."""
+        value = self.stack[0][1]
+        for _, v in self.stack[1:]:
+            value = self.combine(value, v)
+        return value
+
+
+def _chunk_moments(chunk, axis):
+    """Return (count, mean, sum of squared deviations) of a chunk."""
+    count = chunk.size if axis is None else chunk.shape[0]
+    mean = chunk.mean(axis=axis, dtype=np.float64)
+    dev = np.subtract(chunk, mean, dtype=np.float64)
+    np.square(dev, out=dev)
+    return count, mean, dev.sum(axis=axis)
+
+
+def _combine_moments(a, b):
+    """Combine (count, mean, M2) of two sets of values (Chan et al.)."""
+    na, mean_a, m2_a = a
+    nb, mean_b, m2_b = b
+    if na == 0:
+        return b
+    if nb == 0:
+        return a
+    n = na + nb
+    delta = mean_b - mean_a
+    return (n, mean_a + delta * (nb / n),
+            m2_a + m2_b + delta**2 * (na * nb / n))
+
+
+class Chunked(object):
+    """
+    Reductions over an array, or a sequence of arrays, one chunk at a
+    time.
+
+    Chunks are split along the leading axis (axis 0), so results along
+    axis 0 or over all axes (axis=None) are combined across chunks, and
+    results along other axes are concatenated.
+    """
+
+    def __init__(self, source, chunk_bytes=CHUNK_BYTES, threads=1):
+        """
+        Parameters
+        ----------
+        source : ndarray, callable or iterable
+            An array, usually a np.memmap from np.load(filename,
+            mmap_mode='r').  Or chunks of an array along axis 0: a
+            function returning an iterable of chunks (e.g. a generator
+            function), which is called for each reduction, or an
+            iterable of chunks, which can only be used once.
+        chunk_bytes : int, optional
+            Approximate size of the chunks read from an array.
+        threads : int, optional
+            Number of threads reading and reducing chunks.  numpy
+            releases the GIL in reductions, so chunks are read and
+            reduced in parallel.
+        """
+        if isinstance(source, np.ndarray):
+            self.array = source
+            self.shape = source.shape
+            self.dtype = source.dtype
+        else:
+            self.array = None
+            self.source = source
+        self.chunk_bytes = chunk_bytes
+        self.threads = threads
+
+    def chunks(self):
+        """Iterate over the chunks, as views for an array source."""
+        if self.array is None:
+            source = self.source() if callable(self.source) else self.source
+            for chunk in source:
+                yield np.asarray(chunk)
+            return
+        a = self.array
+        if a.ndim == 0:
+            yield a
+            return
+        row_bytes = a.itemsize * (a.size // len(a) if len(a) else 0)
+        rows = max(1, self.chunk_bytes // max(row_bytes, 1))
+        for start in range(0, max(len(a), 1), rows):
+            yield a[start:start + rows]
+
+    def _start(self, axis):
+        """Return (`axis` made non-negative, iterator over the chunks)."""
+        chunks = self.chunks()
+        try:
+            first = next(chunks)
+        except StopIteration:
+            raise ValueError('No chunks to reduce')
+        if axis is not None:
+            ndim = first.ndim
+            if not -ndim <= axis < ndim:
+                raise ValueError('axis %d is out of bounds for array of '
+                                 'dimension %d' % (axis, ndim))
+            axis = axis % ndim
+        return axis, itertools.chain([first], chunks)
+
+    def _reduce(self, func, axis, combine=operator.add, finish=None):
+        """
+        Apply func(chunk, axis) to each chunk, and combine the results
+        pairwise (axis 0 or None) or concatenate them (other axes).
+        """
+        axis, chunks = self._start(axis)
+        if axis not in (None, 0):
+            return np.concatenate(list(_map(lambda c: func(c, axis), chunks,
+                                            self.threads)))
+        total = _Pairwise(combine)
+        for partial in _map(lambda c: func(c, axis), chunks, self.threads):
+            total.add(partial)
+        total = total.total()
+        return total if finish is None else finish(total)
+
+    def sum(self, axis=None, dtype=None):
+        """Sum along `axis`, or of all the elements if axis is None."""
+        return self._reduce(lambda c, axis: c.sum(axis=axis, dtype=dtype),
+                            axis)
+
+    def mean(self, axis=None):
+        """Mean along `axis`, in float64."""
+        def func(chunk, axis):
+            if axis not in (None, 0):
+                return chunk.mean(axis=axis, dtype=np.float64)
+            count = chunk.size if axis is None else chunk.shape[0]
+            return count, chunk.sum(axis=axis, dtype=np.float64)
+
+        def combine(a, b):
+            return a[0] + b[0], a[1] + b[1]
+        return self._reduce(func, axis, combine, lambda t: t[1] / t[0])
+
+    def var(self, axis=None, ddof=0):
+        """
+        Variance along `axis`, in float64.
+
+        Each chunk's mean and sum of squared deviations are computed in
+        two passes over the chunk (which is in memory by then), and the
+        chunks are combined with Chan et al.'s pairwise update.  Unlike
+        sum(x**2) / n - mean**2, this doesn't lose precision when the
+        mean is large compared to the standard deviation.
+        """
+        def func(chunk, axis):
+            if axis not in (None, 0):
+                return chunk.var(axis=axis, dtype=np.float64, ddof=ddof)
+            return _chunk_moments(chunk, axis)
+        return self._reduce(func, axis, _combine_moments,
+                            lambda t: t[2] / np.float64(t[0] - ddof))
+
+    def std(self, axis=None, ddof=0):
+        """Standard deviation along `axis`, in float64.  See var."""
+        return np.sqrt(self.var(axis, ddof))
+
+    def _any_all(self, axis, test):
+        """
+        Compute any (test=np.any) or all (test=np.all) along `axis`,
+        stopping as soon as the result can't change.
+        """
+        # The result is settled when every element of it equals `done`
+        done = test is np.any
+        axis, chunks = self._start(axis)
+        results = []
+        settled = None
+        chunk_results = _map(lambda c: test(c, axis=axis), chunks,
+                             self.threads)
+        for result in chunk_results:
+            if axis not in (None, 0):
+                results.append(result)
+                continue
+            if settled is None:
+                settled = np.array(result)
+            elif done:
+                settled |= result
+            else:
+                settled &= result
+            if (settled == done).all():
+                chunk_results.close()
+                break
+        if axis not in (None, 0):
+            return np.concatenate(results)
+        return settled[()] if settled.ndim == 0 else settled
+
+    def any(self, axis=None):
+        """Test whether any element along `axis` is True."""
+        return self._any_all(axis, np.any)
+
+    def all(self, axis=None):
+        """Test whether all elements along `axis` are True."""
+        return self._any_all(axis, np.all)
+
+    def cumsum(self, axis=None, dtype=None, out=None):
+        """
+        Cumulative sum along `axis` (of the flattened array if axis is
+        None), the same size as the source.
+
+        Chunks are summed in parallel, straight into their part of `out`,
+        and the running total at the end of each chunk is then added to
+        the next one.
+
+        Parameters
+        ----------
+        out : str or ndarray, optional
+            Filename of a .npy file to create for the result (only for
+            array sources, whose size is known), or an array (e.g. a
+            np.memmap) to write it into.  Default is a new in-memory
+            array.
+        """
+        axis, chunks = self._start(axis)
+        if self.array is not None:
+            shape = (self.array.size,) if axis is None else self.shape
+            out = _open_output(out, shape, np.cumsum(
+                np.zeros(1, self.dtype), dtype=dtype).dtype)
+        elif isinstance(out, str):
+            raise ValueError('A .npy output file needs an array source')
+
+        def positions():
+            pos = 0
+            for chunk in chunks:
+                yield pos, chunk
+                pos += chunk.size if axis is None else len(chunk)
+
+        def cumsum(item):
+            pos, chunk = item
+            if out is None:
+                return np.cumsum(chunk, axis=axis, dtype=dtype)
+            n = chunk.size if axis is None else len(chunk)
+            return np.cumsum(chunk, axis=axis, dtype=dtype,
+                             out=out[pos:pos + n])
+
+        parts = []
+        carry = None
+        for part in _map(cumsum, positions(), self.threads):
+            if axis in (None, 0):
+                if carry is not None:
+                    part += carry
+                if len(part):
+                    carry = part[-1].copy()
+            if out is None:
+                parts.append(part)
+        if out is None:
+            return np.concatenate(parts)
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark_matmul(n=4096, memory=32 * 2**20, dirname=None):
+    """
+    Multiply two n x n matrices stored in .npy files, in memory and out
+    of core with a small memory budget.
+
+    Note that unless the files are larger than memory, the reads mostly
+    come from the operating system's page cache, not the disk.
+    """
+    dirname = tempfile.mkdtemp(dir=dirname)
+    try:
+        rng = np.random.RandomState(0)
+        for name in ('a', 'b'):
+            np.save(os.path.join(dirname, name), rng.randn(n, n))
+        a = np.load(os.path.join(dirname, 'a.npy'), mmap_mode='r')
+        b = np.load(os.path.join(dirname, 'b.npy'), mmap_mode='r')
+        flops = 2 * n**3
+        print('%d x %d float64 matrices (%.0f MB each)'
+              % (n, n, a.nbytes / 1e6))
+
+        t0 = time.time()
+        ref = np.load(os.path.join(dirname, 'a.npy')).dot(
+            np.load(os.path.join(dirname, 'b.npy')))
+        elapsed = time.time() - t0
+        print('%-36s %8.3f s  %6.1f GFLOP/s'
+              % ('np.load + dot (in memory)', elapsed, flops / elapsed / 1e9))
+
+        stats = {}
+        out = matmul(a, b, out=os.path.join(dirname, 'c.npy'),
+                     memory=memory, stats=stats)
+        print('%-36s %8.3f s  %6.1f GFLOP/s'
+              % ('matmul, %d MB budget' % (memory // 2**20), stats['total'],
+                 stats['gflops']))
+        print('  tiles %s, read %.0f MB: read %.3f s, I/O stall %.3f s, '
+              'compute %.3f s, write %.3f s'
+              % ('x'.join(map(str, stats['tile'])), stats['bytes_read'] / 1e6,
+                 stats['read'], stats['stall'], stats['compute'],
+                 stats['write']))
+        assert np.allclose(out, ref)
+        del out, a, b
+    finally:
+        shutil.rmtree(dirname)
+
+
+def benchmark_reductions(shape=(2 * 10**6, 25), threads=2, dirname=None):
+    """
+    Reduce a memory-mapped float64 array with numpy methods and with
+    Chunked, comparing times and peak memory allocated by numpy.
+    """
+    dirname = tempfile.mkdtemp(dir=dirname)
+    try:
+        filename = os.path.join(dirname, 'x.npy')
+        rng = np.random.RandomState(0)
+        x = np.lib.format.open_memmap(filename, mode='w+', shape=shape)
+        for start in range(0, shape[0], 10**5):
+            chunk = x[start:start + 10**5]
+            chunk[...] = 1e6 + rng.randn(*chunk.shape)
+        x.flush()
+        del x
+        x = np.load(filename, mmap_mode='r')
+        chunked = Chunked(x, threads=threads)
+        print('%s float64 memmap (%.0f MB), %d threads'
+              % (shape, x.nbytes / 1e6, threads))
+
+        def measure(func):
+            tracemalloc.start()
+            t0 = time.time()
+            result = func()
+            elapsed = time.time() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return result, elapsed, peak
+
+        def np_cumsum():
+            np.save(os.path.join(dirname, 'np_cumsum.npy'), x.cumsum(axis=0))
+            return np.load(os.path.join(dirname, 'np_cumsum.npy'),
+                           mmap_mode='r')[-1]
+
+        def chunked_cumsum():
+            out = chunked.cumsum(axis=0, out=os.path.join(dirname,
+                                                          'cumsum.npy'))
+            return out[-1]
+
+        # Values above 1e6 + 3 are rare enough that the first is in the
+        # second chunk, and any() can stop there
+        threshold = 1e6 + 3
+        masks = Chunked(lambda: (c > threshold for c in chunked.chunks()),
+                        threads=threads)
+        rows = [
+            ('sum(axis=0)', lambda: x.sum(axis=0),
+             lambda: chunked.sum(axis=0)),
+            ('mean()', lambda: x.mean(), lambda: chunked.mean()),
+            ('var(axis=0)', lambda: x.var(axis=0),
+             lambda: chunked.var(axis=0)),
+            ('std(axis=1)', lambda: x.std(axis=1),
+             lambda: chunked.std(axis=1)),
+            ('cumsum(axis=0) to .npy', np_cumsum, chunked_cumsum),
+            ('(x > 1e6 + 3).any()', lambda: (x > threshold).any(),
+             masks.any),
+        ]
+        print('%-24s %19s %21s' % ('', 'numpy', 'Chunked'))
+        for label, numpy_func, chunked_func in rows:
+            ref, t_np, m_np = measure(numpy_func)
+            res, t_ch, m_ch = measure(chunked_func)
+            assert np.allclose(ref, res)
+            print('%-24s %8.3f s %7.0f MB %8.3f s %7.0f MB'
+                  % (label, t_np, m_np / 1e6, t_ch, m_ch / 1e6))
+        del x, chunked
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    benchmark_matmul()
+    print('')
+    benchmark_reductions()
@@ -0,0 +1,314 @@
+"""
+Lazy map / filter pipelines built from generators.
+
+In Python 2, map(cube, seq) and filter(f, seq) from the functions section
+of basics.py build complete lists in memory.  A Pipeline chains the same
+kinds of operations as generators, so each item flows through all the
+stages before the next one is read and memory use stays constant no
+matter how long the input is.  Nothing runs until the pipeline is
+iterated or a terminal method such as sum() or collect() is called.
+
+Items can be regrouped into fixed-size chunks (numpy arrays by default),
+so that stages run vectorized numpy kernels on a whole chunk at a time,
+or farm chunks out to a thread or process pool.
+
+Example
+-------
+>>> import pipeline
+>>> p = pipeline.Pipeline(range(2, 25)).filter(f).map(cube)
+>>> p.collect()
+>>> chunks = pipeline.arange_chunks(10**9, chunksize=10**6)
+>>> p = (pipeline.Pipeline(chunks)
+...      .map(lambda x: x[(x % 3 == 0) | (x % 5 == 0)])
+...      .map(lambda x: (x.astype(float) ** 3).sum()))
+>>> p.sum()
+
+Run this module as a script for a benchmark over a 10**9 element stream:
+python pipeline.py
+"""
+
+from __future__ import division
+
+import collections
+import itertools
+import time
+from concurrent import futures
+
+import numpy as np
+
+
+class Pipeline(object):
+    """Lazy chain of generator stages over an iterable source."""
+
+    def __init__(self, source, stages=()):
+        """Initialize with a call like p = Pipeline(iterable)."""
+        self.source = source
+        self.stages = tuple(stages)
+
+    def _then(self, stage):
+        """Return a new pipeline with `stage` appended."""
+        return Pipeline(self.source, self.stages + (stage,))
+
+    def __iter__(self):
+        items = iter(self.source)
+        for stage in self.stages:
+            items = stage(items)
+        return items
+
+    # ------------------------------------------------------------------
+    # Item stages
+
+    def map(self, func):
+        """Apply func(item) to each item."""
+        return self._then(lambda items: (func(x) for x in items))
+
+    def filter(self, func):
+        """Keep only the items for which func(item) is True."""
+        return self._then(lambda items: (x for x in items if func(x)))
+
+    def flat_map(self, func):
+        """Apply func(item), which returns an iterable, and flatten."""
+        return self._then(
+            lambda items: (y for x in items for y in func(x)))
+
+    def window(self, size, step=1):
+        """
+        Group items into sliding windows.
+
+        Yields tuples of `size` consecutive items, starting a new window
+        every `step` items.  A trailing partial window is dropped.
+        """
+        if size < 1 or step < 1:
+            raise ValueError('size and step must be positive')
+
+        def stage(items):
+            win = collections.deque(maxlen=size)
+            skip = 0
+            for x in items:
+                win.append(x)
+                if len(win) < size:
+                    continue
+                if skip == 0:
+                    yield tuple(win)
+                    skip = step
+                skip -= 1
+        return self._then(stage)
+
+    # ------------------------------------------------------------------
+    # Chunking
+
+    def chunk(self, size, dtype=None, as_array=True):
+        """
+        Regroup items into chunks of `size` items.
+
+        Each chunk is a 1-D numpy array (of type `dtype`, if given), or a
+        list if `as_array` is False.  The last chunk may be shorter.
+        """
+        if size < 1:
+            raise ValueError('size must be positive')
+
+        def stage(items):
+            while True:
+                block = list(itertools.islice(items, size))
+                if not block:
+                    return
+                if as_array:
+                    block = np.array(block, dtype=dtype)
+                yield block
+        return self._then(stage)
+
+    def rechunk(self, size):
+        """Regroup array chunks of any length into chunks of `size`."""
+        if size < 1:
+            raise ValueError('size must be positive')
+
+        def stage(chunks):
+            pending, npending = [], 0
+            for c in chunks:
+                c = np.asarray(c)
+                while npending + len(c) >= size:
+                    take = size - npending
+                    pending.append(c[:take])
+                    yield np.concatenate(pending)
+                    c = c[take:]
+                    pending, npending = [], 0
+                if len(c):
+                    pending.append(c)
+                    npending += len(c)
+            if npending:
+                yield np.concatenate(pending)
+        return self._then(stage)
+
+    def unchunk(self):
+        """Flatten chunks back into a stream of individual items."""
+        return self._then(
+            lambda chunks: (x for c in chunks for x in c))
+
+    def mask(self, func):
+        """Keep elements of each array chunk where func(chunk) is True."""
+        return self._then(
+            lambda chunks: (c[func(c)] for c in chunks))
+
+    # ------------------------------------------------------------------
+    # Parallel stages
+
+    def parallel_map(self, func, executor='thread', max_workers=None,
+                     ordered=True):
+        """
+        Apply func(item) to each item in a thread or process pool.
+
+        This is meant for chunks, so that each task does enough work to
+        pay for the dispatch.  At most 2 * max_workers tasks are in
+        flight at a time, so memory stays bounded for unbounded inputs.
+
+        Parameters
+        ----------
+        func : callable
+            Function to apply.  With executor='process', it must be
+            picklable (e.g. a module-level function, not a lambda).
+        executor : {'thread', 'process'} or concurrent.futures.Executor
+            Pool type to create, or an existing executor to reuse.
+        max_workers : int, optional
+            Number of workers when creating a pool.
+        ordered : bool, optional
+            If True, results come out in input order.  Otherwise they come
+            out as soon as they are finished.
+        """
+        def stage(items):
+            if executor == 'thread':
+                pool = futures.ThreadPoolExecutor(max_workers or 4)
+            elif executor == 'process':
+                pool = futures.ProcessPoolExecutor(max_workers)
+            else:
+                pool = executor
+            nflight = 2 * (max_workers or getattr(pool, '_max_workers', 4))
+            try:
+                pending = collections.deque()
+                for x in items:
+                    pending.append(pool.submit(func, x))
+                    if len(pending) >= nflight:
+                        if ordered:
+                            yield pending.popleft().result()
+                        else:
+                            for result in _drain_done(pending):
+                                yield result
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                if pool is not executor:
+                    pool.shutdown(wait=True)
+        return self._then(stage)
+
+    # ------------------------------------------------------------------
+    # Terminal operations
+
+    def collect(self):
+        """Run the pipeline and return the results as a list."""
+        return list(self)
+
+    def take(self, n):
+        """Run the pipeline and return the first n results as a list."""
+        return list(itertools.islice(self, n))
+
+    def reduce(self, func, initial):
+        """Fold the results with func(accumulated, item)."""
+        acc = initial
+        for x in self:
+            acc = func(acc, x)
+        return acc
+
+    def sum(self, initial=0):
+        """Return the sum of the results."""
+        return self.reduce(lambda acc, x: acc + x, initial)
+
+    def count(self):
+        """Return the number of results."""
+        n = 0
+        for _ in self:
+            n += 1
+        return n
+
+
+def _drain_done(pending):
+    """Pop and return results of the finished futures in `pending`."""
+    futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+    done = [fut for fut in pending if fut.done()]
+    for fut in done:
+        pending.remove(fut)
+    return [fut.result() for fut in done]
+
+
+def arange_chunks(start, stop=None, chunksize=10**6, dtype=np.int64):
+    """
+    Generate np.arange(start, stop) lazily in chunks of `chunksize`.
+
+    Like range(), a single argument is the stop value.
+    """
+    if stop is None:
+        start, stop = 0, start
+    for lo in range(start, stop, chunksize):
+        yield np.arange(lo, min(lo + chunksize, stop), dtype=dtype)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def _cube(x):
+    return x ** 3
+
+
+def _div3or5(x):
+    return x % 3 == 0 or x % 5 == 0
+
+
+def _sum_cubes_div3or5(chunk):
+    """Vectorized kernel: sum of cubes of chunk values divisible by 3 or 5."""
+    x = chunk[(chunk % 3 == 0) | (chunk % 5 == 0)].astype(np.float64)
+    return (x * x * x).sum()
+
+
+def benchmark(n=10**9, chunksize=10**6, n_items=10**6, max_workers=4):
+    """
+    Sum the cubes of integers below n which are divisible by 3 or 5.
+
+    The per-item generator pipeline is timed on the first `n_items`
+    integers and scaled up (without tracemalloc, which would swamp the
+    per-item overhead).  The chunked pipelines run over the whole
+    stream, and their peak traced memory depends only on the chunk size
+    and number of workers, not on n.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    def run(label, p, count, trace=True):
+        trace = trace and tracemalloc is not None
+        if trace:
+            tracemalloc.start()
+        t0 = time.time()
+        total = p.sum()
+        elapsed = time.time() - t0
+        peak = 'n/a'
+        if trace:
+            peak = '%.1f MB' % (tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.stop()
+        print('%-28s %10.2f s  %8.1f Melem/s  peak %9s  (%.6g)'
+              % (label, elapsed * n / count, count / elapsed / 1e6,
+                 peak, total))
+
+    print('Stream of %d integers, chunks of %d' % (n, chunksize))
+    run('per-item generators (est.)',
+        Pipeline(range(n_items)).filter(_div3or5).map(_cube)
+        .map(float), n_items, trace=False)
+    run('chunked numpy',
+        Pipeline(arange_chunks(n, chunksize=chunksize))
+        .map(_sum_cubes_div3or5), n)
+    run('chunked numpy, %d threads' % max_workers,
+        Pipeline(arange_chunks(n, chunksize=chunksize))
+        .parallel_map(_sum_cubes_div3or5, 'thread', max_workers), n)
+
+
+if __name__ == '__main__':
+    benchmark()
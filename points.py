@@ -0,0 +1,300 @@
+"""
+Batched extraction of values at stations or other points from gridded
+fields.
+
+Pulling ds['T'] at many stations means a ds['T'].sel(lat=..., lon=...,
+method='nearest') call per point, and each call searches the
+coordinates and builds a new DataArray.  A Points object holds the
+locations of thousands to millions of points and extracts them all at
+once:
+
+- Grid indices are found in one vectorized binary search
+  (np.searchsorted) per coordinate, for the nearest grid point or for
+  bilinear interpolation (linear in the vertical too, when the points
+  have levels)
+- Longitudes are periodic: points at -75 or 285 are the same, and
+  points between the last and first grid longitudes interpolate across
+  the wrap.  Latitudes and levels can run either way, and points
+  outside them are clamped to the edge of the grid.
+- The indices and weights are computed once per grid and cached, so
+  extracting from further variables, times or files on the same grid is
+  only a gather
+- extract() gathers every variable in a dataset with the same indices,
+  into a dataset with a 'point' dimension
+
+Example
+-------
+>>> import points
+>>> stations = points.Points(lats, lons)              # Arrays of points
+>>> T = stations.sample(ds['T'].values, ds['lat'], ds['lon'])
+>>> T.shape                                           # (nlev, npoints)
+>>> stations = points.Points(lats, lons, levs, method='bilinear')
+>>> ds_points = stations.extract(ds)                  # All variables
+
+Run this module as a script for a throughput benchmark against
+extracting one point at a time:
+python points.py
+"""
+
+from __future__ import division
+
+import hashlib
+import itertools
+import time
+
+import numpy as np
+
+try:
+    import xray
+except ImportError:
+    xray = None
+
+METHODS = ('nearest', 'bilinear')
+
+
+def _bracket(coord, x, periodic):
+    """
+    Return (i0, i1, w), the grid indices on either side of each point in
+    `x` and the weight of i1 for linear interpolation.
+    """
+    coord = np.asarray(coord, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    if periodic:
+        coord, x = coord % 360, x % 360
+    order = np.argsort(coord, kind='stable')
+    s = coord[order]
+    if periodic:
+        # Extend by one point at each end, across the wrap
+        s = np.concatenate([[s[-1] - 360], s, [s[0] + 360]])
+        order = np.concatenate([[order[-1]], order, [order[0]]])
+    if len(s) == 1:
+        zeros = np.zeros(x.shape, dtype=np.intp)
+        return zeros, zeros, np.zeros(x.shape)
+    pos = np.clip(np.searchsorted(s, x, side='right'), 1, len(s) - 1)
+    lo, hi = pos - 1, pos
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(s[hi] > s[lo], (x - s[lo]) / (s[hi] - s[lo]), 0)
+    return order[lo], order[hi], np.clip(w, 0, 1)
+
+
+class _Plan(object):
+    """Flat grid indices and weights of the points on one grid."""
+
+    def __init__(self, corners, grid_shape):
+        # List of (flat indices, weights or None) to sum over
+        self.corners = corners
+        self.grid_shape = grid_shape
+
+    def gather(self, values):
+        """Return the points from an array with the grid as last axes."""
+        ndim = len(self.grid_shape)
+        if values.shape[-ndim:] != self.grid_shape:
+            raise ValueError('last axes must have shape %s, not %s'
+                             % (self.grid_shape, values.shape[-ndim:]))
+        flat = values.reshape(values.shape[:-ndim] + (-1,))
+        index, weight = self.corners[0]
+        if weight is None:
+            return flat[..., index]
+        dtype = np.result_type(values.dtype, np.float32)
+        out = flat[..., index] * weight.astype(dtype)
+        for index, weight in self.corners[1:]:
+            out += flat[..., index] * weight.astype(dtype)
+        return out
+
+
+class Points(object):
+    """Locations of points to extract from gridded fields."""
+
+    def __init__(self, lat, lon, lev=None, method='nearest'):
+        """
+        Parameters
+        ----------
+        lat, lon : array_like
+            Latitudes and longitudes of the points, in degrees.
+        lev : array_like, optional
+            Vertical levels of the points, in the units of the grid's
+            levels.  If None, all the levels are extracted.
+        method : {'nearest', 'bilinear'}, optional
+            Take the nearest grid point, or interpolate linearly along
+            each coordinate.
+        """
+        if method not in METHODS:
+            raise ValueError('method must be one of %s' % (METHODS,))
+        self.lat = np.asarray(lat, dtype=np.float64).ravel()
+        self.lon = np.asarray(lon, dtype=np.float64).ravel()
+        self.lev = (None if lev is None
+                    else np.asarray(lev, dtype=np.float64).ravel())
+        if len(self.lon) != len(self.lat) or (
+                self.lev is not None and len(self.lev) != len(self.lat)):
+            raise ValueError('lat, lon and lev must have the same length')
+        self.method = method
+        self._plans = {}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _plan(self, lat, lon, lev=None):
+        """Return the cached _Plan for a grid, computing it if needed."""
+        coords = [np.asarray(c, dtype=np.float64) for c in (lat, lon)]
+        if self.lev is not None:
+            if lev is None:
+                raise ValueError('points have levels, so the grid needs '
+                                 'levels too')
+            coords.insert(0, np.asarray(lev, dtype=np.float64))
+        h = hashlib.sha1()
+        for coord in coords:
+            h.update(str(coord.shape).encode())
+            h.update(coord.tobytes())
+        key = h.hexdigest()
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        targets = [self.lat, self.lon]
+        if self.lev is not None:
+            targets.insert(0, self.lev)
+        periodic = [False] * (len(coords) - 1) + [True]
+        brackets = [_bracket(c, x, p)
+                    for c, x, p in zip(coords, targets, periodic)]
+        shape = tuple(len(c) for c in coords)
+        strides = np.cumprod((shape + (1,))[:0:-1])[::-1]
+        corners = []
+        if self.method == 'nearest':
+            index = sum(np.where(w < 0.5, i0, i1) * stride
+                        for (i0, i1, w), stride in zip(brackets, strides))
+            corners.append((index, None))
+        else:
+            # Every combination of the lower and upper neighbours
+            for sides in itertools.product((0, 1), repeat=len(coords)):
+                index, weight = 0, 1
+                for side, (i0, i1, w), stride in zip(sides, brackets,
+                                                     strides):
+                    index = index + (i1 if side else i0) * stride
+                    weight = weight * (w if side else 1 - w)
+                corners.append((index, weight))
+        plan = _Plan(corners, shape)
+        self._plans[key] = plan
+        return plan
+
+    def sample(self, values, lat, lon, lev=None):
+        """
+        Return the values at the points from a gridded array.
+
+        Parameters
+        ----------
+        values : ndarray
+            Array whose last axes are (lat, lon), or (lev, lat, lon) if
+            the points have levels.  Other leading axes (e.g. time, or
+            levels when the points have none) are kept.
+        lat, lon, lev : array_like
+            1-D coordinates of the grid.
+
+        Returns
+        -------
+        samples : ndarray
+            Array of shape values.shape[:-2] (or [:-3]) + (npoints,).
+        """
+        return self._plan(lat, lon, lev).gather(np.asarray(values))
+
+    def extract(self, ds, variables=None, lat='lat', lon='lon', lev='lev'):
+        """
+        Return the values at the points of all the variables on the grid
+        of an xray dataset, as a dataset with a 'point' dimension.
+
+        Variables are transposed so that the grid dimensions come last.
+        Variables without both of the lat and lon dimensions (and lev,
+        if the points have levels) are left out.
+        """
+        grid = [lat, lon] if self.lev is None else [lev, lat, lon]
+        plan = self._plan(ds[lat].values, ds[lon].values,
+                          None if self.lev is None else ds[lev].values)
+        if variables is None:
+            variables = list(ds.data_vars)
+        data_vars = {}
+        for name in variables:
+            var = ds[name].variable
+            if not set(grid) <= set(var.dims):
+                continue
+            other = [d for d in var.dims if d not in grid]
+            var = var.transpose(*(other + grid))
+            data_vars[name] = (tuple(other) + ('point',),
+                               plan.gather(var.values), var.attrs)
+        coords = dict((name, coord) for name, coord in ds.coords.items()
+                      if not set(grid) & set(coord.dims))
+        coords[lat] = ('point', self.lat)
+        coords[lon] = ('point', self.lon)
+        if self.lev is not None:
+            coords[lev] = ('point', self.lev)
+        return xray.Dataset(data_vars, coords=coords, attrs=ds.attrs)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(npoints=10**6, nloop=2000, nvars=4):
+    """
+    Extract `npoints` random points from `nvars` (lev, lat, lon) fields on
+    the NCEP2 grid, and compare the values extracted per second with one
+    point at a time (a coordinate search per point, and with xray,
+    DataArray.sel).
+    """
+    lat = np.linspace(90, -90, 73)
+    lon = np.arange(0, 360, 2.5)
+    lev = np.array([1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150,
+                    100, 70, 50, 30, 20, 10], dtype=float)
+    rng = np.random.RandomState(0)
+    fields = [rng.randn(len(lev), len(lat), len(lon)).astype(np.float32)
+              for _ in range(nvars)]
+    plat = rng.uniform(-90, 90, npoints)
+    plon = rng.uniform(-180, 180, npoints)
+    print('%d variables on a %s grid' % (nvars, fields[0].shape))
+
+    def timed(label, func):
+        t0 = time.time()
+        result = func()
+        elapsed = time.time() - t0
+        nvalues = sum(np.size(r) for r in result)
+        print('%-44s %10.0f values/s' % (label, nvalues / elapsed))
+        return result
+
+    def one_at_a_time(n):
+        out = np.empty((nvars, len(lev), n), dtype=np.float32)
+        for k in range(n):
+            i = np.abs(lat - plat[k]).argmin()
+            dist = np.abs(lon - plon[k] % 360)
+            j = np.minimum(dist, 360 - dist).argmin()
+            for v, field in enumerate(fields):
+                out[v, :, k] = field[:, i, j]
+        return out
+
+    loop = timed('one point at a time (numpy)',
+                 lambda: one_at_a_time(nloop))
+    for method in METHODS:
+        p = Points(plat, plon, method=method)
+        batch = timed('Points(%s), first grid' % method,
+                      lambda: [p.sample(f, lat, lon) for f in fields])
+        timed('Points(%s), cached indices' % method,
+              lambda: [p.sample(f, lat, lon) for f in fields])
+        if method == 'nearest':
+            assert np.array_equal(np.array(batch)[..., :nloop], loop)
+    p = Points(plat, plon, rng.uniform(10, 1000, npoints), 'bilinear')
+    timed('Points(bilinear) with levels, first grid',
+          lambda: [p.sample(f, lat, lon, lev) for f in fields])
+
+    if xray is None:
+        return
+    dims = ('lev', 'lat', 'lon')
+    ds = xray.Dataset(dict(('var%d' % v, (dims, f))
+                           for v, f in enumerate(fields)),
+                      coords={'lev': lev, 'lat': lat, 'lon': lon})
+    timed('DataArray.sel per point', lambda: [
+        ds['var%d' % v].sel(lat=plat[k], lon=plon[k] % 360,
+                            method='nearest').values
+        for k in range(nloop // 10) for v in range(nvars)])
+    p = Points(plat, plon)
+    timed('Points.extract(ds)', lambda: [
+        var.values for var in p.extract(ds).data_vars.values()])
+
+
+if __name__ == '__main__':
+    benchmark()
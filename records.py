@@ -0,0 +1,392 @@
+"""
+Binary files of fixed-layout records.
+
+Telemetry written as text (one line per record, as in the file I/O
+sections of basics.py and science_numpy.py) has to be formatted on the
+way out and parsed on the way in, and pickle rebuilds every record as
+Python objects.  A record file instead stores the records' raw bytes
+after a small header describing their layout:
+
+- Schema:        Field names and struct format codes, e.g.
+                 Schema([('time', 'd'), ('temp', 'f'), ('id', '8s')]).
+                 It converts between struct, for single records, and the
+                 equivalent packed numpy structured dtype.
+- write():       Write a numpy structured array (or a list of tuples) in
+                 bulk, straight from its memory buffer
+- RecordWriter:  Append records one at a time or as arrays, packing them
+                 with struct.pack_into into a reusable buffer
+- read():        Memory-map a file and wrap it with np.frombuffer: no
+                 copies, and only the pages that are used get read
+- iter_chunks(), iter_records():
+                 Read files larger than memory lazily, as arrays of up to
+                 chunk_records records, or as tuples
+
+Example
+-------
+>>> import records
+>>> schema = records.Schema([('time', 'd'), ('station', 'i'),
+...                          ('temp', 'f'), ('id', '8s')])
+>>> with records.RecordWriter('data/telemetry.rec', schema) as w:
+...     w.write(1.4e9, 72, 21.5, b'KSEA')
+...     w.write_array(more_records)
+>>> recs = records.read('data/telemetry.rec')
+>>> recs['temp'].mean()
+>>> for chunk in records.iter_chunks('data/telemetry.rec'):
+...     total += chunk['temp'].sum()
+
+Run this module as a script for a benchmark against text and pickle:
+python records.py
+"""
+
+from __future__ import division
+
+import json
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+# Magic bytes at the start of every record file
+MAGIC = b'RECORDS\x01'
+
+# The data starts at a multiple of this many bytes from the start of the
+# file, so that memory-mapped arrays are aligned
+ALIGN = 64
+
+# Default number of records per chunk for iter_chunks()
+CHUNK_RECORDS = 2**16
+
+# struct format codes and the equivalent numpy types
+_NUMPY_TYPES = {'?': 'b1', 'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2',
+                'i': 'i4', 'I': 'u4', 'q': 'i8', 'Q': 'u8', 'e': 'f2',
+                'f': 'f4', 'd': 'f8', 's': 'S'}
+_STRUCT_CODES = dict((np.dtype(v).str[1:], k)
+                     for k, v in _NUMPY_TYPES.items() if k != 's')
+
+
+class Schema(object):
+    """Layout of a record: field names and struct format codes."""
+
+    def __init__(self, fields, byteorder='<'):
+        """
+        Parameters
+        ----------
+        fields : list of (name, format) pairs
+            struct format codes of the fields, one value each: one of
+            ?bBhHiIqQefd, or e.g. '8s' for 8 bytes.  Fields are packed
+            without padding.
+        byteorder : {'<', '>'}, optional
+            Little or big endian.
+        """
+        if byteorder not in '<>' or len(byteorder) != 1:
+            raise ValueError("byteorder must be '<' or '>'")
+        self.fields = [(str(name), str(fmt)) for name, fmt in fields]
+        self.byteorder = byteorder
+        dtypes = []
+        for name, fmt in self.fields:
+            count, code = fmt[:-1], fmt[-1:]
+            if code not in _NUMPY_TYPES or (count and code != 's'):
+                raise ValueError('Unsupported format %r for field %r'
+                                 % (fmt, name))
+            dtypes.append((name, byteorder + _NUMPY_TYPES[code] + count))
+        self.dtype = np.dtype(dtypes)
+        self.struct = struct.Struct(
+            byteorder + ''.join(fmt for _, fmt in self.fields))
+        self.size = self.struct.size
+
+    @classmethod
+    def from_dtype(cls, dtype):
+        """Make a Schema from a numpy structured dtype of scalar fields."""
+        dtype = np.dtype(dtype)
+        if dtype.names is None:
+            raise ValueError('Expected a structured dtype, got %s' % dtype)
+        fields = []
+        byteorder = '<'
+        for name in dtype.names:
+            field = dtype.fields[name][0]
+            if field.kind == 'S':
+                fields.append((name, '%ds' % field.itemsize))
+                continue
+            if field.str[1:] not in _STRUCT_CODES or field.shape:
+                raise ValueError('Unsupported type %s for field %r'
+                                 % (field, name))
+            if field.byteorder == '>' or (field.byteorder == '='
+                                          and not np.little_endian):
+                byteorder = '>'
+            fields.append((name, _STRUCT_CODES[field.str[1:]]))
+        return cls(fields, byteorder)
+
+    def __eq__(self, other):
+        return (isinstance(other, Schema) and self.fields == other.fields
+                and self.byteorder == other.byteorder)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Schema(%r, byteorder=%r)' % (self.fields, self.byteorder)
+
+    def pack(self, *values):
+        """Return the bytes of one record."""
+        return self.struct.pack(*values)
+
+    def unpack(self, data):
+        """Return one record's values as a tuple."""
+        return self.struct.unpack(data)
+
+    def header(self):
+        """Return the file header for this schema, padded to ALIGN."""
+        info = json.dumps({'fields': self.fields,
+                           'byteorder': self.byteorder}).encode()
+        header = MAGIC + struct.pack('<I', len(info)) + info
+        return header + b' ' * (-len(header) % ALIGN)
+
+
+def _read_header(f):
+    """Read a file header, returning (schema, offset of the data)."""
+    start = f.read(len(MAGIC) + 4)
+    if start[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a record file' % getattr(f, 'name', f))
+    length, = struct.unpack('<I', start[len(MAGIC):])
+    info = json.loads(f.read(length).decode())
+    schema = Schema(info['fields'], info['byteorder'])
+    offset = len(MAGIC) + 4 + length
+    return schema, offset + (-offset % ALIGN)
+
+
+def read_schema(filename):
+    """Return the Schema of a record file."""
+    with open(filename, 'rb') as f:
+        return _read_header(f)[0]
+
+
+# ----------------------------------------------------------------------
+# Writing
+# ----------------------------------------------------------------------
+
+class RecordWriter(object):
+    """Write records to a file, buffering them in a bytearray."""
+
+    def __init__(self, filename, schema, append=False, buffer_records=4096):
+        """
+        Open `filename` for writing records with `schema`.
+
+        With append=True, records are added to an existing file (whose
+        schema must match), or a new file is created.
+        """
+        self.schema = schema
+        if append and os.path.exists(filename):
+            if read_schema(filename) != schema:
+                raise ValueError('%s has a different schema' % filename)
+            self.file = open(filename, 'ab')
+        else:
+            self.file = open(filename, 'wb')
+            self.file.write(schema.header())
+        self._buf = bytearray(schema.size * buffer_records)
+        self._pos = 0
+
+    def write(self, *values):
+        """Write one record."""
+        if self._pos + self.schema.size > len(self._buf):
+            self.flush()
+        self.schema.struct.pack_into(self._buf, self._pos, *values)
+        self._pos += self.schema.size
+
+    def write_array(self, arr):
+        """Write a structured array, or an iterable of tuples, in bulk."""
+        if not isinstance(arr, np.ndarray):
+            arr = np.array(list(arr), dtype=self.schema.dtype)
+        arr = np.ascontiguousarray(arr, dtype=self.schema.dtype)
+        self.flush()
+        # The array's buffer is written as is, without a copy
+        self.file.write(memoryview(arr).cast('B'))
+
+    def flush(self):
+        if self._pos:
+            self.file.write(memoryview(self._buf)[:self._pos])
+            self._pos = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write(filename, records, schema=None, append=False):
+    """
+    Write `records` to a record file.
+
+    Parameters
+    ----------
+    filename : str
+        File to create, or to append to with append=True.
+    records : ndarray or iterable of tuples
+        A structured array, or tuples of field values.
+    schema : Schema, optional
+        Default is Schema.from_dtype(records.dtype).
+    """
+    if schema is None:
+        if not isinstance(records, np.ndarray):
+            raise ValueError('A schema is needed for records that are not '
+                             'a structured array')
+        schema = Schema.from_dtype(records.dtype)
+    with RecordWriter(filename, schema, append) as w:
+        w.write_array(records)
+
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+
+def read(filename):
+    """
+    Return all the records of a file as a read-only structured array.
+
+    The file is memory-mapped and wrapped without copying, so this is
+    fast for any file size, and the data is read from disk as it is
+    used.  The array keeps the memory map open.
+    """
+    with open(filename, 'rb') as f:
+        schema, offset = _read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        count = (size - offset) // schema.size
+        if count == 0:
+            return np.empty(0, dtype=schema.dtype)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mm, dtype=schema.dtype, count=count, offset=offset)
+
+
+def iter_chunks(filename, chunk_records=CHUNK_RECORDS):
+    """
+    Yield the records of a file as structured arrays of up to
+    `chunk_records` records, reading one chunk at a time.
+
+    Each chunk is read into the same buffer, so the arrays are only
+    valid until the next one is yielded; copy them to keep them.
+    """
+    with open(filename, 'rb') as f:
+        schema, offset = _read_header(f)
+        f.seek(offset)
+        buf = np.empty(chunk_records, dtype=schema.dtype)
+        view = memoryview(buf).cast('B')
+        while True:
+            nbytes = f.readinto(view)
+            count = nbytes // schema.size
+            if not count:
+                break
+            yield buf[:count]
+
+
+def iter_records(filename, chunk_records=CHUNK_RECORDS):
+    """
+    Yield the records of a file one at a time, as tuples.
+
+    As with struct.unpack, bytes fields keep any NUL padding (numpy
+    strips it).
+    """
+    schema = read_schema(filename)
+    for chunk in iter_chunks(filename, chunk_records):
+        for values in schema.struct.iter_unpack(memoryview(chunk)
+                                                .cast('B')):
+            yield values
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(n=10**6, dirname=None):
+    """
+    Round-trip n telemetry records through text, pickle and a record
+    file.
+    """
+    schema = Schema([('time', 'd'), ('station', 'i'), ('temp', 'f'),
+                     ('pressure', 'f'), ('flags', 'H'), ('id', '8s')])
+    rng = np.random.RandomState(0)
+    arr = np.empty(n, dtype=schema.dtype)
+    arr['time'] = 1.4e9 + np.arange(n) * 60.0
+    arr['station'] = rng.randint(0, 1000, n)
+    arr['temp'] = (20 + 10 * rng.randn(n)).round(2)
+    arr['pressure'] = (1013 + 5 * rng.randn(n)).round(1)
+    arr['flags'] = rng.randint(0, 16, n)
+    arr['id'] = np.char.add(b'ST', arr['station'].astype('S6'))
+    tuples = arr.tolist()
+    dirname = tempfile.mkdtemp(dir=dirname)
+
+    def timed(label, func):
+        t0 = time.time()
+        result = func()
+        elapsed = time.time() - t0
+        print('  %-44s %8.3f s' % (label, elapsed))
+        return result
+
+    def size(filename):
+        print('  %-44s %8.1f MB' % ('size on disk',
+                                    os.path.getsize(filename) / 1e6))
+
+    try:
+        print('%d records of %d bytes' % (n, schema.size))
+        txt = os.path.join(dirname, 'telemetry.txt')
+        print('Text (np.savetxt / np.loadtxt)')
+        text_dtype = [(name, 'U8' if name == 'id' else arr.dtype[name])
+                      for name in arr.dtype.names]
+        timed('write', lambda: np.savetxt(
+            txt, arr.astype(text_dtype), fmt='%.1f %d %.2f %.1f %d %s'))
+        size(txt)
+        timed('read', lambda: np.loadtxt(txt, dtype=text_dtype))
+
+        pkl = os.path.join(dirname, 'telemetry.pkl')
+        for label, obj in (('list of tuples', tuples),
+                           ('structured array', arr)):
+            print('pickle, %s' % label)
+
+            def dump():
+                with open(pkl, 'wb') as f:
+                    pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            def load():
+                with open(pkl, 'rb') as f:
+                    return pickle.load(f)
+            timed('write', dump)
+            size(pkl)
+            timed('read', load)
+
+        rec = os.path.join(dirname, 'telemetry.rec')
+        print('Record file')
+        timed('write(structured array)', lambda: write(rec, arr))
+        size(rec)
+
+        def write_tuples():
+            with RecordWriter(rec, schema) as w:
+                for values in tuples:
+                    w.write(*values)
+        timed('RecordWriter.write, one tuple at a time', write_tuples)
+        res = timed('read (mmap, zero copy)', lambda: read(rec))
+        timed("read(...)['temp'].mean()", lambda: read(rec)['temp'].mean())
+        total = timed("iter_chunks, sum of 'temp'", lambda: sum(
+            chunk['temp'].sum(dtype=float) for chunk in iter_chunks(rec)))
+        count = timed('iter_records (tuples)', lambda: sum(
+            1 for _ in iter_records(rec)))
+        assert np.array_equal(res, arr) and count == n
+        assert np.isclose(total, arr['temp'].sum(dtype=float))
+        del res
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,418 @@
+"""
+Regridding between lat-lon grids with precomputed sparse weights.
+
+The u, v and T in science_data.py share a grid, but output from models
+at different resolutions has to be regridded before it can be compared,
+and interpolating each variable and level separately recomputes the
+same interpolation weights every time.  Here the weights for a pair of
+grids are computed once, as a sparse matrix from source points to
+target points, and every regridding is a sparse matrix product:
+
+- 'bilinear' interpolation, found by binary search in the source
+  coordinates, or first-order 'conservative' remapping, where each
+  target cell is the area-weighted average of the source cells it
+  overlaps (areas are exact on the sphere: width in longitude times
+  width in sin(latitude))
+- Longitudes are periodic, and latitudes can run either way (e.g.
+  90..-90 as in the NCEP files)
+- Weights are kept in memory and cached to disk, keyed by a hash of the
+  method and both grids, so later sessions load them instead of
+  computing them
+- All the levels (and times, ...) of a variable are regridded in one
+  product, and regrid_dataset() regrids every variable in a dataset
+
+Weights are stored in compressed sparse row (CSR) form and applied with
+numpy, so scipy isn't needed.
+
+Example
+-------
+>>> import regrid
+>>> r = regrid.Regridder(ds['lat'], ds['lon'], lat_out, lon_out)
+>>> T_out = r(ds['T'].values)           # (lev, lat, lon) -> new grid
+>>> ds_out = r.regrid_dataset(ds)       # Every variable on lat, lon
+>>> r = regrid.Regridder(lat, lon, lat_out, lon_out, 'conservative')
+
+Run this module as a script for a benchmark of reusing the weights
+against recomputing them on every call:
+python regrid.py
+"""
+
+from __future__ import division
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import xray
+except ImportError:
+    xray = None
+
+# Directory for weights cached on disk
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'regrid')
+
+# Approximate size in bytes of the temporary products in Weights.apply
+CHUNK_BYTES = 32 * 2**20
+
+METHODS = ('bilinear', 'conservative')
+
+# Weights computed in this session, by key
+_weights = {}
+
+
+class Weights(object):
+    """Sparse matrix of weights from a source grid to a target grid."""
+
+    def __init__(self, indptr, indices, data, src_shape, dst_shape):
+        """
+        Parameters
+        ----------
+        indptr, indices, data : ndarray
+            Weight matrix in CSR form: the weights of target point t are
+            data[indptr[t]:indptr[t+1]], for the source points (as flat
+            indices) indices[indptr[t]:indptr[t+1]].
+        src_shape, dst_shape : tuple of int
+            (nlat, nlon) of the source and target grids.
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        # Plain ints, also when loaded from the arrays in a .npz file
+        self.src_shape = tuple(int(n) for n in src_shape)
+        self.dst_shape = tuple(int(n) for n in dst_shape)
+
+    def __repr__(self):
+        return '<Weights %s -> %s, %d nonzero>' % (
+            self.src_shape, self.dst_shape, len(self.data))
+
+    @classmethod
+    def from_coo(cls, rows, cols, vals, src_shape, dst_shape):
+        """Build weights from (target, source, weight) triplets."""
+        keep = vals != 0
+        rows, cols, vals = rows[keep], cols[keep], vals[keep]
+        order = np.argsort(rows, kind='stable')
+        ntarget = dst_shape[0] * dst_shape[1]
+        indptr = np.zeros(ntarget + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=ntarget), out=indptr[1:])
+        return cls(indptr, cols[order].astype(np.int64), vals[order],
+                   src_shape, dst_shape)
+
+    def save(self, filename):
+        """Save to a .npz file, atomically."""
+        tmp = filename + '.tmp.npz'
+        np.savez(tmp, indptr=self.indptr, indices=self.indices,
+                 data=self.data, src_shape=self.src_shape,
+                 dst_shape=self.dst_shape)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Load weights saved with save()."""
+        with np.load(filename) as f:
+            return cls(f['indptr'], f['indices'], f['data'],
+                       f['src_shape'], f['dst_shape'])
+
+    def apply(self, values, skipna=False):
+        """
+        Regrid an array whose last two axes are the source (lat, lon).
+
+        All the leading axes (e.g. levels and times) are regridded in one
+        sparse product.  Target points with no weights (outside the
+        source grid, for conservative weights) are NaN.
+        With skipna=True, NaNs in the source are left out and the weights
+        of the rest are renormalized, instead of spreading the NaNs.
+        """
+        values = np.asarray(values)
+        if values.shape[-2:] != self.src_shape:
+            raise ValueError('last two axes must have shape %s, not %s'
+                             % (self.src_shape, values.shape[-2:]))
+        dtype = np.result_type(values.dtype, np.float32)
+        lead = values.shape[:-2]
+        x = values.reshape((-1, self.src_shape[0] * self.src_shape[1]))
+        if skipna:
+            valid = ~np.isnan(x)
+            num = self._product(np.where(valid, x, 0), dtype)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                num /= self._product(valid, dtype)
+            return num.reshape(lead + self.dst_shape)
+        return self._product(x, dtype).reshape(lead + self.dst_shape)
+
+    def _product(self, x, dtype):
+        """Return x @ W.T for a 2-D array x of flattened source grids."""
+        x = np.asarray(x, dtype=dtype)
+        data = self.data.astype(dtype)
+        starts = self.indptr[:-1]
+        nonempty = starts < self.indptr[1:]
+        out = np.empty((x.shape[0], len(starts)), dtype=dtype)
+        out[:, ~nonempty] = np.nan
+        # reduceat sums each row's weighted values, from its start up to
+        # the next nonempty row's start
+        starts = starts[nonempty]
+        if not len(starts):
+            return out
+        step = max(1, CHUNK_BYTES // max(len(data) * data.itemsize, 1))
+        for i in range(0, x.shape[0], step):
+            prod = x[i:i + step, self.indices]
+            prod *= data
+            out[i:i + step, nonempty] = np.add.reduceat(prod, starts,
+                                                        axis=1)
+        return out
+
+
+# ----------------------------------------------------------------------
+# Computing weights
+# ----------------------------------------------------------------------
+
+def _interp_1d(src, dst, periodic):
+    """
+    Return (i0, i1, w) with dst interpolated as (1 - w) * src[i0] +
+    w * src[i1].  Points outside a non-periodic source are clamped to its
+    end points.
+    """
+    if periodic:
+        src, dst = src % 360, dst % 360
+    order = np.argsort(src, kind='stable')
+    s = src[order]
+    if periodic:
+        # Extend by one point at each end, across the wrap
+        s = np.concatenate([[s[-1] - 360], s, [s[0] + 360]])
+        order = np.concatenate([[order[-1]], order, [order[0]]])
+    pos = np.clip(np.searchsorted(s, dst, side='right'), 1, len(s) - 1)
+    lo, hi = pos - 1, pos
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(s[hi] > s[lo], (dst - s[lo]) / (s[hi] - s[lo]), 0)
+    return order[lo], order[hi], np.clip(w, 0, 1)
+
+
+def _bilinear(lat_in, lon_in, lat_out, lon_out):
+    """Return COO triplets for bilinear interpolation."""
+    y0, y1, wy = _interp_1d(lat_in, lat_out, periodic=False)
+    x0, x1, wx = _interp_1d(lon_in, lon_out, periodic=True)
+    nlon_in, nlon_out = len(lon_in), len(lon_out)
+    rows, cols, vals = [], [], []
+    for yi, fy in ((y0, 1 - wy), (y1, wy)):
+        for xi, fx in ((x0, 1 - wx), (x1, wx)):
+            rows.append(np.arange(len(lat_out))[:, None] * nlon_out
+                        + np.arange(nlon_out))
+            cols.append(yi[:, None] * nlon_in + xi)
+            vals.append(fy[:, None] * fx)
+    return [np.concatenate([a.ravel() for a in x])
+            for x in (rows, cols, vals)]
+
+
+def _edges(centers, lo=None, hi=None):
+    """Return the lower and upper edges of cells around sorted centers."""
+    mid = (centers[1:] + centers[:-1]) / 2
+    first = 2 * centers[0] - mid[0] if len(mid) else centers[0] - 0.5
+    last = 2 * centers[-1] - mid[-1] if len(mid) else centers[-1] + 0.5
+    edges = np.concatenate([[first], mid, [last]])
+    if lo is not None:
+        edges = np.clip(edges, lo, hi)
+    return edges[:-1], edges[1:]
+
+
+def _overlaps(src, dst, periodic):
+    """
+    Return the matrix of overlaps between target cells (rows) and source
+    cells (columns), as fractions of each target cell's covered width.
+    """
+    def cells(centers):
+        order = np.argsort(centers, kind='stable')
+        if periodic:
+            lo, hi = _edges(centers[order])
+        else:
+            # Widths in sin(latitude) are proportional to areas
+            lo, hi = _edges(centers[order], -90, 90)
+            lo, hi = np.sin(np.radians(lo)), np.sin(np.radians(hi))
+        cell_lo, cell_hi = np.empty_like(lo), np.empty_like(hi)
+        cell_lo[order], cell_hi[order] = lo, hi
+        return cell_lo, cell_hi
+
+    if periodic:
+        src, dst = np.asarray(src) % 360, np.asarray(dst) % 360
+    src_lo, src_hi = cells(np.asarray(src, dtype=float))
+    dst_lo, dst_hi = cells(np.asarray(dst, dtype=float))
+    overlap = 0
+    for shift in ((-360, 0, 360) if periodic else (0,)):
+        overlap = overlap + np.maximum(
+            0, np.minimum(dst_hi[:, None], src_hi + shift)
+            - np.maximum(dst_lo[:, None], src_lo + shift))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return overlap / overlap.sum(axis=1, keepdims=True)
+
+
+def _conservative(lat_in, lon_in, lat_out, lon_out):
+    """Return COO triplets for first-order conservative remapping."""
+    wy = _overlaps(lat_in, lat_out, periodic=False)
+    wx = _overlaps(lon_in, lon_out, periodic=True)
+    # The 2-D weights are the products of the 1-D ones (a Kronecker
+    # product), taking only the nonzero ones
+    ry, cy = np.nonzero(wy)
+    rx, cx = np.nonzero(wx)
+    nlon_in, nlon_out = len(lon_in), len(lon_out)
+    rows = ry[:, None] * nlon_out + rx
+    cols = cy[:, None] * nlon_in + cx
+    vals = wy[ry, cy][:, None] * wx[rx, cx]
+    return rows.ravel(), cols.ravel(), vals.ravel()
+
+
+def _key(method, lat_in, lon_in, lat_out, lon_out):
+    """Return a hash of a method and a pair of grids."""
+    h = hashlib.sha1(method.encode())
+    for coord in (lat_in, lon_in, lat_out, lon_out):
+        coord = np.ascontiguousarray(coord, dtype=np.float64)
+        h.update(str(coord.shape).encode())
+        h.update(coord.tobytes())
+    return h.hexdigest()
+
+
+def compute_weights(lat_in, lon_in, lat_out, lon_out, method='bilinear'):
+    """Compute the weights from one grid to another, without caching."""
+    if method not in METHODS:
+        raise ValueError('method must be one of %s' % (METHODS,))
+    coords = [np.asarray(c, dtype=np.float64)
+              for c in (lat_in, lon_in, lat_out, lon_out)]
+    build = _bilinear if method == 'bilinear' else _conservative
+    rows, cols, vals = build(*coords)
+    return Weights.from_coo(rows, cols, vals,
+                            (len(coords[0]), len(coords[1])),
+                            (len(coords[2]), len(coords[3])))
+
+
+def weights(lat_in, lon_in, lat_out, lon_out, method='bilinear',
+            cache_dir=CACHE_DIR):
+    """
+    Return the weights from one grid to another, computing them only if
+    they aren't cached in memory or in `cache_dir` (None for no disk
+    cache).
+    """
+    key = _key(method, lat_in, lon_in, lat_out, lon_out)
+    if key in _weights:
+        return _weights[key]
+    filename = None
+    if cache_dir is not None:
+        filename = os.path.join(cache_dir, '%s_%s.npz' % (method, key))
+    if filename is not None and os.path.exists(filename):
+        w = Weights.load(filename)
+    else:
+        w = compute_weights(lat_in, lon_in, lat_out, lon_out, method)
+        if filename is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            w.save(filename)
+    _weights[key] = w
+    return w
+
+
+class Regridder(object):
+    """Regrid arrays and datasets from one lat-lon grid to another."""
+
+    def __init__(self, lat_in, lon_in, lat_out, lon_out,
+                 method='bilinear', cache_dir=CACHE_DIR):
+        """
+        Parameters
+        ----------
+        lat_in, lon_in : array_like
+            1-D latitudes and longitudes of the source grid, in degrees.
+        lat_out, lon_out : array_like
+            1-D latitudes and longitudes of the target grid.
+        method : {'bilinear', 'conservative'}, optional
+            Regridding method.
+        cache_dir : str, optional
+            Directory for weights cached on disk, or None.
+        """
+        self.lat_out = np.asarray(lat_out)
+        self.lon_out = np.asarray(lon_out)
+        self.weights = weights(lat_in, lon_in, lat_out, lon_out, method,
+                               cache_dir)
+
+    def __call__(self, values, skipna=False):
+        """Regrid an array whose last two axes are (lat, lon)."""
+        return self.weights.apply(values, skipna)
+
+    def regrid_dataset(self, ds, lat='lat', lon='lon', skipna=False):
+        """
+        Regrid the variables of an xray dataset whose last two dimensions
+        are (lat, lon).  Variables without these dimensions are kept, and
+        others with only one of them are dropped.
+        """
+        data_vars = {}
+        for name, var in ds.data_vars.items():
+            if var.dims[-2:] == (lat, lon):
+                values = self(var.values, skipna)
+                data_vars[name] = (var.dims, values, var.attrs)
+            elif lat not in var.dims and lon not in var.dims:
+                data_vars[name] = var
+        coords = dict((name, coord) for name, coord in ds.coords.items()
+                      if lat not in coord.dims and lon not in coord.dims)
+        coords[lat] = (lat, self.lat_out, ds[lat].attrs)
+        coords[lon] = (lon, self.lon_out, ds[lon].attrs)
+        return xray.Dataset(data_vars, coords=coords, attrs=ds.attrs)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(nvars=8, nlev=17, dirname=None):
+    """
+    Regrid `nvars` variables with `nlev` levels from the 2.5 degree
+    NCEP2 grid to a 1 degree grid, computing the weights on every call
+    (per variable and level) or once.
+    """
+    lat_in = np.linspace(90, -90, 73)
+    lon_in = np.arange(0, 360, 2.5)
+    lat_out = np.arange(-89.5, 90, 1.0)
+    lon_out = np.arange(0.5, 360, 1.0)
+    rng = np.random.RandomState(0)
+    fields = [rng.randn(nlev, len(lat_in), len(lon_in)).astype(np.float32)
+              for _ in range(nvars)]
+    print('%d variables x %d levels, %s -> %s'
+          % (nvars, nlev, (len(lat_in), len(lon_in)),
+             (len(lat_out), len(lon_out))))
+
+    def timed(label, func):
+        t0 = time.time()
+        result = func()
+        elapsed = time.time() - t0
+        print('  %-38s %8.3f s' % (label, elapsed))
+        return result, elapsed
+
+    for method in METHODS:
+        print(method)
+        w, t_weights = timed('compute weights once', lambda: compute_weights(
+            lat_in, lon_in, lat_out, lon_out, method))
+        ref, t_call = timed('recompute weights per level', lambda: [
+            np.array([compute_weights(lat_in, lon_in, lat_out, lon_out,
+                                      method).apply(level)
+                      for level in field]) for field in fields])
+        out, t_reuse = timed('reuse weights, batched levels', lambda: [
+            w.apply(field) for field in fields])
+        assert all(np.allclose(a, b) for a, b in zip(ref, out))
+        print('  %.0fx faster' % (t_call / t_reuse))
+        cache_dir = tempfile.mkdtemp(dir=dirname)
+        try:
+            _weights.clear()
+            weights(lat_in, lon_in, lat_out, lon_out, method, cache_dir)
+            _weights.clear()
+            timed('load cached weights from disk', lambda: weights(
+                lat_in, lon_in, lat_out, lon_out, method, cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+        # Conservation: area-weighted global means agree
+        field = fields[0][0].astype(np.float64)
+        area_in = np.abs(np.diff(np.sin(np.radians(np.clip(np.concatenate(
+            [[90], (lat_in[1:] + lat_in[:-1]) / 2, [-90]]), -90, 90)))))
+        area_out = np.cos(np.radians(lat_out))
+        mean_in = np.average(field.mean(axis=1), weights=area_in)
+        mean_out = np.average(w.apply(field).mean(axis=1),
+                              weights=area_out)
+        print('  global mean %.6f -> %.6f' % (mean_in, mean_out))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,265 @@
+"""
+Dependency-aware reloading of edited modules in an interactive session.
+
+As noted in the modules section of basics.py, reload(zoo) only reloads
+zoo.py itself, not the modules it imports, and dreload() doesn't always
+work.  Restarting IPython means paying for the numpy / matplotlib / xray
+imports all over again.  A Reloader instead:
+
+- Tracks the user modules that are loaded from the project directories
+  (never third-party or standard library modules)
+- Builds the import dependency graph of those modules by parsing their
+  import statements
+- Watches the modification times of their source files, and reloads only
+  the modules that changed plus the modules that depend on them, with
+  dependencies reloaded before their dependents
+- Records how long each reload takes
+
+Example
+-------
+>>> import reloader
+>>> r = reloader.Reloader()     # Watch modules under the current directory
+>>> r.reload_changed()          # Call after editing source files
+>>> r.enable_ipython()          # Or check automatically before each cell
+>>> print(r.report())
+
+Note: names already bound in the interactive namespace, e.g. by
+`from zoo import visit`, still refer to the old objects.  Re-run the
+import (or use zoo.visit) to pick up the new versions.
+"""
+
+from __future__ import division, print_function
+
+import ast
+import os
+import sys
+import time
+
+try:
+    from importlib import reload
+except ImportError:
+    pass    # Python 2: reload is a built-in
+
+
+def _source_file(module):
+    """Return the .py source file for `module`, or None."""
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    base, ext = os.path.splitext(filename)
+    if ext in ('.pyc', '.pyo'):
+        filename = base + '.py'
+    elif ext != '.py':
+        return None
+    if not os.path.exists(filename):
+        return None
+    return os.path.abspath(filename)
+
+
+def _imported_names(source, modname, is_package):
+    """Return the set of absolute module names imported by `source`."""
+    tree = ast.parse(source)
+    package = modname if is_package else modname.rpartition('.')[0]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                names.add(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                parts = package.split('.') if package else []
+                if node.level > 1:
+                    parts = parts[:-(node.level - 1)]
+                base = '.'.join(parts + ([node.module] if node.module
+                                         else []))
+            else:
+                base = node.module
+            if not base:
+                continue
+            names.add(base)
+            # `from pkg import sub` may import submodule pkg.sub
+            for alias in node.names:
+                names.add(base + '.' + alias.name)
+    return names
+
+
+class Reloader(object):
+    """Reload edited user modules and their dependents."""
+
+    def __init__(self, roots=None):
+        """
+        Watch modules whose source files are under directories `roots`.
+
+        Parameters
+        ----------
+        roots : list of str, optional
+            Project directories.  Default is the current directory.
+            Modules installed in site-packages or dist-packages are never
+            watched, even if they are under one of these directories.
+        """
+        if roots is None:
+            roots = [os.getcwd()]
+        self.roots = [os.path.join(os.path.abspath(r), '') for r in roots]
+        self.mtimes = {}        # Module name -> mtime when last loaded
+        self.deps = {}          # Module name -> set of user module deps
+        self.history = []       # List of (time, [(name, seconds)], total)
+        self._parsed = {}       # (filename, mtime) -> imported names
+        self.scan()
+
+    def _is_user_file(self, filename):
+        if 'site-packages' in filename or 'dist-packages' in filename:
+            return False
+        return any(filename.startswith(root) for root in self.roots)
+
+    def user_modules(self):
+        """Return a dict of watched module name -> source filename."""
+        modules = {}
+        for name, module in list(sys.modules.items()):
+            if module is None or name == '__main__':
+                continue
+            filename = _source_file(module)
+            if filename and self._is_user_file(filename):
+                modules[name] = filename
+        return modules
+
+    def _dependencies(self, name, filename, mtime, modules):
+        """Return the user modules imported by module `name`."""
+        key = (filename, mtime)
+        if key not in self._parsed:
+            with open(filename) as f:
+                source = f.read()
+            is_package = os.path.basename(filename) == '__init__.py'
+            try:
+                self._parsed[key] = _imported_names(source, name,
+                                                    is_package)
+            except SyntaxError:
+                self._parsed[key] = set()
+        return set(n for n in self._parsed[key]
+                   if n in modules and n != name)
+
+    def scan(self):
+        """
+        Record the dependency graph, and the mtimes of modules not seen
+        before.  Modules already watched keep the mtime they were last
+        loaded at (None if their last reload failed).
+        """
+        modules = self.user_modules()
+        mtimes = {}
+        self.deps = {}
+        for name, filename in modules.items():
+            mtime = os.path.getmtime(filename)
+            mtimes[name] = self.mtimes.get(name, mtime)
+            self.deps[name] = self._dependencies(name, filename, mtime,
+                                                 modules)
+        self.mtimes = mtimes
+
+    def changed(self):
+        """Return the set of watched modules whose source has changed."""
+        modules = self.user_modules()
+        changed = set()
+        for name, filename in modules.items():
+            try:
+                mtime = os.path.getmtime(filename)
+            except OSError:
+                continue
+            if name not in self.mtimes:
+                # Imported since the last scan, so loaded from its
+                # current source: watch it from now on
+                self.mtimes[name] = mtime
+            elif self.mtimes[name] != mtime:
+                changed.add(name)
+        return changed
+
+    def dependents(self, names):
+        """Return `names` plus every module that depends on them."""
+        rdeps = {}
+        for name, deps in self.deps.items():
+            for dep in deps:
+                rdeps.setdefault(dep, set()).add(name)
+        affected = set(names)
+        stack = list(names)
+        while stack:
+            for parent in rdeps.get(stack.pop(), ()):
+                if parent not in affected:
+                    affected.add(parent)
+                    stack.append(parent)
+        return affected
+
+    def reload_order(self, names):
+        """Sort `names` so that dependencies come before dependents."""
+        names = set(names)
+        remaining = dict((n, self.deps.get(n, set()) & names) for n in names)
+        order = []
+        while remaining:
+            ready = sorted(n for n, deps in remaining.items() if not deps)
+            if not ready:
+                # Import cycle: reload the rest in name order
+                ready = sorted(remaining)
+            for n in ready:
+                del remaining[n]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+            order.extend(ready)
+        return order
+
+    def reload_changed(self, verbose=True):
+        """
+        Reload changed modules and their dependents.
+
+        Returns the list of (module name, seconds) for each reload.  A
+        module that fails to reload is reported and skipped, and will be
+        tried again on the next call.
+        """
+        t0 = time.time()
+        changed = self.changed()
+        if not changed:
+            return []
+        # The changed files may have new imports
+        self.scan()
+        timings = []
+        for name in self.reload_order(self.dependents(changed)):
+            module = sys.modules.get(name)
+            if module is None:
+                continue
+            # Stays None, and so changed, unless the reload succeeds
+            self.mtimes[name] = None
+            t1 = time.time()
+            try:
+                reload(module)
+            except Exception as err:
+                print('Reloading %s failed: %s: %s'
+                      % (name, type(err).__name__, err))
+                continue
+            timings.append((name, time.time() - t1))
+            filename = _source_file(module)
+            if filename:
+                self.mtimes[name] = os.path.getmtime(filename)
+        total = time.time() - t0
+        self.history.append((t0, timings, total))
+        if verbose:
+            print('Reloaded %s in %.3f s'
+                  % (', '.join(n for n, _ in timings) or 'nothing', total))
+        return timings
+
+    def report(self, last=10):
+        """Return a string summary of the last few reloads."""
+        lines = ['Reload latency (last %d)' % last]
+        for t0, timings, total in self.history[-last:]:
+            stamp = time.strftime('%H:%M:%S', time.localtime(t0))
+            lines.append('%s  %8.3f s  %s' % (
+                stamp, total,
+                ', '.join('%s %.3f' % (n, s) for n, s in timings)))
+        return '\n'.join(lines)
+
+    def enable_ipython(self):
+        """Check for changed modules before each IPython cell runs."""
+        ip = get_ipython()     # NOQA: defined in IPython sessions
+        ip.events.register('pre_run_cell', self._pre_run_cell)
+
+    def disable_ipython(self):
+        """Stop checking for changed modules before each cell."""
+        ip = get_ipython()     # NOQA
+        ip.events.unregister('pre_run_cell', self._pre_run_cell)
+
+    def _pre_run_cell(self, *args):
+        self.reload_changed()
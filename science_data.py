@@ -32,6 +32,9 @@ import pandas as pd
 from mpl_toolkits.basemap import Basemap
 import xray
 
+# Grid helpers from blockeval.py in this repo
+import blockeval
+
 # ----------------------------------------------------------------------
 print("\nWelcome to Jennifer's cheatsheet for scientific computing in Python!")
 
@@ -89,6 +92,13 @@ heading('xray:  N-D labeled datasets and netCDF I/O')
 
 filename = 'data/ncep2_climatology_ann.nc'
 
+# This file is a precomputed annual climatology.  To build monthly (or
+# day-of-year) climatologies and anomalies from many daily files, streaming
+# through them in parallel, see climatology.py:
+# import climatology
+# clim = climatology.build(files, ['T', 'u', 'v'], freq='month')
+# anom_files = climatology.anomalies(files, clim, 'data/anom')
+
 # Open a netCDF file
 ds = xray.open_dataset(filename) 
 
@@ -136,8 +146,18 @@ with xray.open_dataset(filename) as ds:
     # This is a small dataset so we'll load the entire contents into memory:
     ds.load()
 
+# For big files, subset.py reads only the variables, levels and lat/lon
+# box that we need, instead of the entire contents:
+# import subset
+# ds850 = subset.open_subset(filename, ['u', 'v', 'T'], lev=850)
+
 print(ds)
 
+# To reuse loaded datasets across scripts and notebook reruns, dscache.py
+# keeps them in a process-wide LRU cache, reloading a file if it changes:
+# import dscache
+# ds = dscache.open_dataset(filename)      # Arrays are shared, read-only
+
 # We can unpack data from an xray object into numpy arrays with .values:
 lat = ds['lat'].values
 lon = ds['lon'].values
@@ -150,7 +170,9 @@ def plotmap(data, lat=None, lon=None, cmap='jet'):
     if isinstance(data, xray.DataArray):
         lat, lon = data['lat'], data['lon']
 
-    xi, yi = np.meshgrid(lon, lat)
+    # Read-only views of lon and lat, instead of the two new arrays that
+    # np.meshgrid(lon, lat) would make on every call
+    xi, yi = blockeval.mesh(lon, lat)
     plt.figure()
     m = Basemap()
     m.drawcoastlines()
@@ -178,6 +200,20 @@ plotmap(u[k], cmap='RdBu_r')
 plotmap(v[k], cmap='RdBu_r')
 plotmap(T[k])
 
+# To put fields from different models on a common grid, regrid.py computes
+# bilinear or conservative weights once per pair of grids (cached on disk)
+# and applies them to every level of every variable:
+# import regrid
+# r = regrid.Regridder(lat, lon, lat_out, lon_out, method='conservative')
+# ds_out = r.regrid_dataset(ds)
+
+# To get the values at many stations, instead of one T.sel(lat=..., lon=...,
+# method='nearest') per station, points.py finds all the grid indices at
+# once and gathers every variable with them:
+# import points
+# stations = points.Points(station_lats, station_lons, method='bilinear')
+# ds_stations = stations.extract(ds)       # Dimensions (lev, point)
+
 # Calculate the mean along a named dimension (don't need to know which
 # axis it is in the array)
 ubar = u[k].mean(dim='lon')
@@ -190,6 +226,11 @@ print('Zonal mean')
 dsbar = ds.mean(dim='lon')
 print(dsbar)
 print('Boom!')
+
+# dsreduce.py computes the same thing with the variables split into chunks
+# that are reduced in parallel on all the cores:
+# import dsreduce
+# dsbar = dsreduce.reduce(ds, 'mean', dim='lon')
 ubar2 = dsbar['u'][k]
 plt.figure()
 plt.plot(ubar2.lat, ubar2)
@@ -244,6 +244,14 @@ mask = (cats == 'tabby') | (cats == 'siamese')
 print(mask)
 print(data[mask])
 
+# For millions of rows, comparing strings is slow.  categorical.py stores
+# the labels as small integer codes, so masks compare integers and
+# repeated filtering reuses cached row indices:
+# from categorical import Categorical
+# cat = Categorical(cats)
+# mask = cat.isin(['tabby', 'siamese'])
+# print(cat.select(data, 'tabby', 'siamese'))     # Same as data[mask]
+
 # Change parts of the ndarray selected by Boolean indexing
 data[data < 0] = 0
 print(data)
@@ -258,6 +266,13 @@ subset[0] = 10                      # Changes subset but not data
 print(subset)
 print(data)                         # Same as before
 
+# To avoid allocating a new array every time in an inner loop, see
+# indexing.py, which writes the selection into a buffer that is
+# allocated once (and selects rows and columns in one pass):
+# import indexing
+# buf = np.empty_like(data)
+# subset = indexing.compress(cats == 'calico', data, out=buf)
+
 # ----------------------------------------------------------------------
 # Fancy indexing
 # ----------------------------------------------------------------------
@@ -268,10 +283,17 @@ print(a[[4, 0, 2]])     # Rows 4, 0, 2
 print(a[[-1, -3]])      # Rows -1 (last) and -3 (3rd last)
 print(a[[1, 5, 7, 2], [0, 3, 1, 2]])    # Elements [1,0], [5,3], [7,1], [2,2]
 print(a[[1, 5, 7, 2]][:, [0, 2]])       # Columns 0 and 2 of rows 1, 5, 7, 2
+# Same without the intermediate array of rows 1, 5, 7, 2 (buf optional):
+# indexing.gather(a, [1, 5, 7, 2], cols=[0, 2], out=buf)
 
 # The np.ix_ function returns an open mesh from multiple sequences
 print(a[np.ix_([1,3], [2,0])])  # [[a[1,2] a[1,0]], [a[3,2] a[3,0]]]
 
+# To apply the same selection to many arrays of the same shape, an index
+# plan from indexing.py works out the element offsets only once:
+# plan = indexing.index_plan(a.shape, [1, 3], [2, 0])
+# print(plan.apply(a))            # Same as a[np.ix_([1,3], [2,0])]
+
 # ----------------------------------------------------------------------
 # Conditional logic and array operations
 # ----------------------------------------------------------------------
@@ -288,6 +310,9 @@ arr = np.random.randn(4, 4).round(1)
 print(arr)
 print(np.where(arr > 0, 2, -2))
 print(np.where(arr > 0, 2, arr))    # Set only positive values to 2
+# For very large arrays, the same without the temporary arr > 0 mask
+# (see blockeval.py):
+# result = blockeval.evaluate('where(arr > 0, 2, arr)')
 
 # ----------------------------------------------------------------------
 # Transposing arrays and swapping axes
@@ -310,6 +335,10 @@ x = np.array([[1., 2., 3.], [4., 5., 6.]])
 y = np.array([[6., 23.], [-1, 7], [8, 9]])
 print(x.dot(y))     # Dot product using .dot() method
 print(np.dot(x,y))  # Dot product using np.dot()
+# For matrices in .npy files too large for memory, see outofcore.py:
+# import outofcore
+# z = outofcore.matmul(np.load('x.npy', mmap_mode='r'),
+#                      np.load('y.npy', mmap_mode='r'), out='z.npy')
 
 X = np.random.randn(5, 5).round(1)
 mat = X.T.dot(X)
@@ -318,6 +347,13 @@ print(mat.round(2))
 print(inv.round(2))
 print(mat.dot(inv).round(2))
 
+# To solve mat.dot(x) = b, it's faster and more accurate to use
+# np.linalg.solve(mat, b) than inv(mat).dot(b).  For thousands of small
+# systems or regressions at once, see batchsolve.py:
+# import batchsolve
+# x = batchsolve.solve_spd(mat, b)        # Cholesky factorization
+# beta = batchsolve.lstsq(Xs, ys)         # Stack of regressions y ~ X beta
+
 # ----------------------------------------------------------------------
 # Mathematical and statistical methods
 # ----------------------------------------------------------------------
@@ -343,6 +379,13 @@ bools = np.array([False, False, True, False])
 bools.any()     # True if any element in bools is True
 bools.all()     # True if all elements in bools are True
 
+# For arrays too large for memory, outofcore.py reduces memory-mapped
+# arrays (or generated chunks) chunk by chunk, optionally in threads:
+# import outofcore
+# chunked = outofcore.Chunked(np.load('x.npy', mmap_mode='r'), threads=4)
+# chunked.mean(axis=0), chunked.std(axis=0), chunked.any()
+# chunked.cumsum(axis=0, out='xcumsum.npy')
+
 # ----------------------------------------------------------------------
 # Sorting
 # ----------------------------------------------------------------------
@@ -362,6 +405,13 @@ large_arr.sort()
 quant5 = large_arr[int(0.05 * len(large_arr))]  # 5% quantile
 print(quant5)
 
+# Sorting the whole array just to find a few quantiles is overkill. See
+# quantiles.py for exact quantiles by selection (np.partition), which
+# leave the input unchanged, and for streaming approximate quantiles of
+# data that doesn't fit in memory:
+# import quantiles
+# quant5, quant95 = quantiles.quantiles(large_arr, [0.05, 0.95])
+
 # ----------------------------------------------------------------------
 # Uniqueness and set logic
 # ----------------------------------------------------------------------
@@ -378,6 +428,14 @@ print(np.unique(ints))
 values = np.array([6, 0, 0, 3, 2, 5, 6])
 in_val = np.in1d(values, [2, 3, 6])  # in_val[i]=True if values[i] is 2, 3 or 6
 
+# np.unique and np.in1d sort their input.  For very large label arrays,
+# setops.py does the same with a hash table in O(n), and can also give
+# the unique values in order of first appearance or most common first:
+# import setops
+# uniq, counts = setops.unique(names, return_counts=True)
+# in_val = setops.isin(values, [2, 3, 6])
+# top_names, top_counts = setops.value_counts(names)
+
 # ----------------------------------------------------------------------
 # File input and output with arrays
 # ----------------------------------------------------------------------
@@ -387,5 +445,19 @@ arr = np.arange(10)
 np.save('some_array', arr)
 np.load('some_array.npy')
 
+# For arrays written a piece at a time, or read a slice at a time, see
+# arrayio.py (a directory of chunks, optionally compressed):
+# import arrayio
+# store = arrayio.save('some_store', arr, compression='zlib')
+# store.append(more_rows)
+# arrayio.load('some_store')[2:5]     # Reads only the chunks needed
+
 # Loading text files
 # arr = np.loadtxt('array_ex.txt', delimiter=',')
+
+# For large files, textload.py parses line-aligned byte ranges in
+# parallel processes, or streams them as chunks of rows:
+# import textload
+# arr = textload.loadtxt('array_ex.txt', delimiter=',', processes=4)
+# for chunk in textload.iter_chunks('array_ex.txt', delimiter=','):
+#     print(chunk.sum(axis=0))
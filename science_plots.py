@@ -348,6 +348,17 @@ xs, ys = np.meshgrid(points, points)
 # Simple functions for plotting
 z = np.sqrt(xs ** 2 + ys ** 2)
 z2 = np.sqrt(((xs-2)/2)**2 + (ys-2)**2)
+
+# Each operation above makes a full-size temporary array.  For very large
+# grids, blockeval.py evaluates the whole expression block by block into
+# one output array, using less memory and staying in the CPU cache:
+# import blockeval
+# z = blockeval.evaluate('sqrt(xs ** 2 + ys ** 2)')
+# Or skip the meshgrid arrays xs, ys altogether (the grid is evaluated
+# in tiles, so this scales to grids of 20000 x 20000 and more):
+# z = blockeval.grid('sqrt(x ** 2 + y ** 2)', x=points, y=points)
+# z2 = blockeval.grid(lambda x, y: np.sqrt(((x-2)/2)**2 + (y-2)**2),
+#                     x=points, y=points)
 plt.figure(figsize=(10,8))
 plt.suptitle('$\sqrt{x^2 + y^2}$ for a grid of values')
 
@@ -390,6 +401,11 @@ with xray.open_dataset('data/ncep2_climatology_ann.nc') as ds:
     u = ds['u'].values
     v = ds['v'].values
 
+# Or read just the 200 mb winds from the file with subset.py:
+# import subset
+# ds200 = subset.open_subset('data/ncep2_climatology_ann.nc', ['u', 'v'],
+#                            lev=200)
+
 # Extract 200mb winds and subsample so vectors aren't too crowded
 k = 9   # 200 mb vertical level
 nx, ny = 6, 3
@@ -0,0 +1,480 @@
+"""
+Hash-based uniqueness and set logic for large arrays.
+
+np.unique() and np.in1d() from the uniqueness section of science_numpy.py
+work by sorting, which is O(n log n) and slow for 10**8 element label
+arrays.  The functions here use a hash table instead, so they run in
+O(n) time (plus sorting only the unique values, if requested):
+
+- unique:         Unique values, with first-occurrence indices, inverse
+                  codes and counts, like np.unique
+- factorize:      Integer codes and unique values in order of appearance
+- isin:           Membership testing, like np.isin / np.in1d
+- index_of:       Position of each value in an array of keys
+- value_counts:   Unique values and their counts, most common first
+
+They work on integer, float, bool and fixed-width string ('S' and 'U')
+arrays.  The hash table is built with vectorized numpy operations: all
+keys are hashed at once, and collisions are resolved for all of them
+together in a few rounds of linear probing.
+
+Example
+-------
+>>> import setops
+>>> setops.unique(names)
+>>> uniq, counts = setops.unique(names, return_counts=True)
+>>> in_val = setops.isin(values, [2, 3, 6])
+
+Run this module as a script for benchmarks against the numpy versions
+over a range of sizes and cardinalities:
+python setops.py
+"""
+
+from __future__ import division
+
+import time
+
+import numpy as np
+
+# Number of keys hashed and inserted at a time
+CHUNKSIZE = 2**20
+
+# isin() compares against each test value when there are at most this many
+_FEW = 8
+
+_M1 = np.uint64(0xff51afd7ed558ccd)
+_M2 = np.uint64(0xc4ceb9fe1a85ec53)
+_PRIME = np.uint64(0x100000001b3)
+_S33 = np.uint64(33)
+
+
+# ----------------------------------------------------------------------
+# Keys and hashes
+# ----------------------------------------------------------------------
+
+def _common_dtype(a, b):
+    """Return a dtype both `a` and `b` can be cast to, or None."""
+    ka, kb = a.dtype.kind, b.dtype.kind
+    if ka in 'SU' or kb in 'SU':
+        if ka != kb:
+            return None
+        return np.dtype('%s%d' % (ka, max(a.dtype.itemsize, b.dtype.itemsize)
+                                  // (4 if ka == 'U' else 1)))
+    if ka not in 'biuf' or kb not in 'biuf':
+        raise TypeError('Unsupported dtypes %s, %s' % (a.dtype, b.dtype))
+    return np.result_type(a.dtype, b.dtype)
+
+
+def _words(values):
+    """
+    Return a (n, w) uint64 array of hashable words for 1-D `values`.
+
+    Equal values have equal words.  Floats are canonicalized so that
+    0.0 == -0.0 and all NaNs are equal.
+    """
+    kind = values.dtype.kind
+    if kind in 'biu':
+        return values.astype(np.int64).view(np.uint64).reshape(-1, 1)
+    if kind == 'f':
+        x = values.astype(np.float64) + 0.0     # -0.0 -> 0.0
+        x[np.isnan(x)] = np.nan
+        return x.view(np.uint64).reshape(-1, 1)
+    if kind in 'SU':
+        n, size = values.size, values.dtype.itemsize
+        raw = np.ascontiguousarray(values).view(np.uint8).reshape(n, size)
+        if size % 8:
+            pad = np.zeros((n, 8 - size % 8), dtype=np.uint8)
+            raw = np.hstack([raw, pad])
+        return raw.view(np.uint64)
+    raise TypeError('Unsupported dtype %s' % values.dtype)
+
+
+def _hash(words):
+    """Hash each row of a (n, w) uint64 word array (murmur3 fmix64)."""
+    h = words[:, 0].copy()
+    for j in range(1, words.shape[1]):
+        h *= _PRIME
+        h ^= words[:, j]
+    h ^= h >> _S33
+    h *= _M1
+    h ^= h >> _S33
+    h *= _M2
+    h ^= h >> _S33
+    return h
+
+
+def _rows_equal(a, b):
+    if a.shape[1] == 1:
+        return a[:, 0] == b[:, 0]
+    return (a == b).all(axis=1)
+
+
+# ----------------------------------------------------------------------
+# Hash table
+# ----------------------------------------------------------------------
+
+class HashTable(object):
+    """
+    Open-addressing hash table of distinct keys, built in bulk.
+
+    Keys get integer codes 0, 1, 2, ... in order of first appearance.
+    """
+
+    def __init__(self, width, capacity=1024):
+        """Initialize an empty table for keys of `width` uint64 words."""
+        size = 1
+        while size < 2 * capacity:
+            size *= 2
+        self.slots = np.full(size, -1, dtype=np.int64)
+        self.keys = np.empty((max(capacity, 16), width), dtype=np.uint64)
+        self.first = np.empty(max(capacity, 16), dtype=np.int64)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, needed):
+        """Make room to store `needed` distinct keys."""
+        if needed > len(self.keys):
+            cap = max(needed, 2 * len(self.keys))
+            keys = np.empty((cap, self.keys.shape[1]), dtype=np.uint64)
+            keys[:self.count] = self.keys[:self.count]
+            first = np.empty(cap, dtype=np.int64)
+            first[:self.count] = self.first[:self.count]
+            self.keys, self.first = keys, first
+
+    def _rehash(self, expected=0):
+        """
+        Grow the slot array if it is more than half full.
+
+        `expected` is an estimate of how many more keys are coming, so
+        the table can grow to its final size in one step.
+        """
+        needed = self.count + expected
+        if 2 * needed <= len(self.slots):
+            return
+        size = len(self.slots)
+        while size < 2 * needed:
+            size *= 2
+        self.slots = np.full(size, -1, dtype=np.int64)
+        keys = self.keys[:self.count]
+        self._probe(keys, _hash(keys), insert=False,
+                    codes=np.arange(self.count))
+
+    def _probe(self, words, hashes, insert, codes=None, index=None):
+        """
+        Look up (and optionally insert) each row of `words`.
+
+        Returns the code of each key, or -1 for missing keys when not
+        inserting.  If `codes` is given, the keys are known to be
+        distinct and not yet in the table, and are placed with those
+        codes (for rehashing).  `index` gives the position of each key in
+        the original array, recorded for first occurrences.
+        """
+        mask = len(self.slots) - 1
+        slot = (hashes & np.uint64(mask)).astype(np.intp)
+        result = np.full(len(words), -1, dtype=np.int64)
+        pending = np.arange(len(words))
+        while pending.size:
+            s = slot[pending]
+            occupant = self.slots[s]
+            empty = occupant < 0
+            advance = ~empty
+            if codes is None:
+                full = np.flatnonzero(advance)
+                hit = _rows_equal(self.keys[occupant[full]],
+                                  words[pending[full]])
+                result[pending[full[hit]]] = occupant[full[hit]]
+                advance[full[hit]] = False
+            stay = np.zeros(len(pending), dtype=bool)
+            if (insert or codes is not None) and empty.any():
+                # Keys competing for the same empty slot: the earliest one
+                # wins (its claim is written last).  The others stay and
+                # compare against the winner in the next round.
+                e = pending[empty]
+                es = s[empty]
+                self.slots[es[::-1]] = -2 - e[::-1]
+                won = self.slots[es] == -2 - e
+                winners = e[won]
+                if codes is None:
+                    new = self.count + np.arange(len(winners))
+                    self.keys[new] = words[winners]
+                    self.first[new] = index[winners]
+                    self.count += len(winners)
+                else:
+                    new = codes[winners]
+                self.slots[es[won]] = new
+                result[winners] = new
+                stay[np.flatnonzero(empty)[~won]] = True
+            moved = pending[advance]
+            slot[moved] = (slot[moved] + 1) & mask
+            pending = pending[advance | stay]
+        return result
+
+    def insert(self, words, index):
+        """
+        Insert keys (with repeats) and return their codes.
+
+        `index` gives the position of each key in the original array.
+        New keys are inserted in batches of at most a quarter of the
+        slots, growing the table in between, so it is never more than
+        3/4 full and stays small when there are few distinct keys.  The
+        growth is based on the fraction of new keys seen so far, so
+        high-cardinality input needs only a couple of rounds.
+        """
+        hashes = _hash(words)
+        codes = self._probe(words, hashes, insert=False)
+        todo = np.flatnonzero(codes < 0)
+        while todo.size:
+            batch = todo[:max(len(self.slots) // 4, 1)]
+            self._reserve(self.count + len(batch))
+            before = self.count
+            codes[batch] = self._probe(words[batch], hashes[batch],
+                                       insert=True, index=index[batch])
+            todo = todo[len(batch):]
+            # Expect the rest to have the same fraction of new keys
+            self._rehash((self.count - before) * len(todo) // len(batch))
+            if todo.size:
+                found = self._probe(words[todo], hashes[todo], insert=False)
+                codes[todo] = found
+                todo = todo[found < 0]
+        return codes
+
+    def lookup(self, words):
+        """Return the code of each key, or -1 if it isn't in the table."""
+        return self._probe(words, _hash(words), insert=False)
+
+
+def _factorize(values, chunksize=CHUNKSIZE):
+    """Return (codes, table) for 1-D array `values`."""
+    table = HashTable(_words(values[:1]).shape[1])
+    codes = np.empty(values.size, dtype=np.int64)
+    for lo in range(0, values.size, chunksize):
+        chunk = values[lo:lo + chunksize]
+        codes[lo:lo + chunksize] = table.insert(
+            _words(chunk), np.arange(lo, lo + chunk.size))
+    return codes, table
+
+
+# ----------------------------------------------------------------------
+# Public functions
+# ----------------------------------------------------------------------
+
+def factorize(values, sort=False):
+    """
+    Encode values as integer codes.
+
+    Parameters
+    ----------
+    values : array_like
+        Values to encode (flattened).
+    sort : bool, optional
+        If True, sort the unique values.  Otherwise they are in order of
+        first appearance.
+
+    Returns
+    -------
+    codes : ndarray of int64
+        Index into `uniques` of each value, so uniques[codes] == values.
+    uniques : ndarray
+        Distinct values.
+    """
+    values = np.asarray(values).ravel()
+    if values.size == 0:
+        return np.empty(0, dtype=np.int64), values.copy()
+    codes, table = _factorize(values)
+    first = table.first[:table.count]
+    uniques = values[first]
+    if sort:
+        order = np.argsort(uniques)   # Distinct, so needn't be stable
+        uniques = uniques[order]
+        remap = np.empty_like(order)
+        remap[order] = np.arange(len(order))
+        codes = remap[codes]
+    return codes, uniques
+
+
+def unique(values, return_index=False, return_inverse=False,
+           return_counts=False, sort=True):
+    """
+    Find the unique elements of an array using a hash table.
+
+    Same interface as np.unique (for flattened arrays), plus `sort`.
+    With sort=False, unique values are in order of first appearance,
+    which skips the only O(u log u) step.
+
+    Returns
+    -------
+    uniques : ndarray
+    index : ndarray, optional
+        Index of the first occurrence of each unique value.
+    inverse : ndarray, optional
+        Codes such that uniques[inverse] == values.
+    counts : ndarray, optional
+        Number of times each unique value occurs.
+    """
+    values = np.asarray(values)
+    shape = values.shape
+    values = values.ravel()
+    if values.size == 0:
+        codes = first = np.empty(0, dtype=np.int64)
+        uniques = values.copy()
+    else:
+        codes, table = _factorize(values)
+        first = table.first[:table.count].copy()
+        uniques = values[first]
+    if sort and len(uniques):
+        order = np.argsort(uniques)   # Distinct, so needn't be stable
+        uniques, first = uniques[order], first[order]
+        if return_inverse or return_counts:
+            remap = np.empty_like(order)
+            remap[order] = np.arange(len(order))
+            codes = remap[codes]
+
+    result = [uniques]
+    if return_index:
+        result.append(first)
+    if return_inverse:
+        result.append(codes.reshape(shape))
+    if return_counts:
+        result.append(np.bincount(codes, minlength=len(uniques)))
+    return result[0] if len(result) == 1 else tuple(result)
+
+
+def isin(values, test_values, invert=False):
+    """
+    Test whether each element of `values` is in `test_values`.
+
+    Same as np.isin, but using a hash table of `test_values`.  A few
+    test values are compared directly, and integers from a small range
+    are looked up in a boolean table.
+    """
+    values = np.asarray(values)
+    test_values = np.asarray(test_values).ravel()
+    dtype = _common_dtype(values, test_values)
+    if dtype is None or test_values.size == 0 or values.size == 0:
+        return np.full(values.shape, invert, dtype=bool)
+    test_values = test_values.astype(dtype, copy=False)
+    flat = values.ravel()
+    if len(test_values) <= _FEW:
+        # Comparing against a handful of values beats hashing
+        out = np.zeros(flat.size, dtype=bool)
+        for x in unique(test_values, sort=False):
+            out |= flat == x
+        return (~out if invert else out).reshape(values.shape)
+    if dtype.kind in 'biu':
+        lo, hi = int(test_values.min()), int(test_values.max())
+        if hi - lo <= 4 * len(test_values) + flat.size:
+            # Small range of integers: a lookup table beats hashing
+            # Offsets in intp, as they can overflow small integer types
+            found = np.zeros(hi - lo + 1, dtype=bool)
+            found[test_values.astype(np.intp) - lo] = True
+            flat = flat.astype(dtype, copy=False)
+            inside = (flat >= lo) & (flat <= hi)
+            out = np.zeros(flat.size, dtype=bool)
+            out[inside] = found[flat[inside].astype(np.intp) - lo]
+            return (~out if invert else out).reshape(values.shape)
+    out = index_of(flat, test_values) >= 0
+    if dtype.kind == 'f':
+        # The hash table treats NaNs as equal, but NaN == NaN is False
+        out &= ~np.isnan(flat.astype(dtype, copy=False))
+    if invert:
+        out = ~out
+    return out.reshape(values.shape)
+
+
+def index_of(values, keys):
+    """
+    Return the position of each element of `values` in `keys`.
+
+    Like [keys.index(x) for x in values], using a hash table of `keys`.
+    Values not in `keys` get -1, and a repeated key gives the position of
+    its first occurrence.
+    """
+    values = np.asarray(values)
+    keys = np.asarray(keys).ravel()
+    dtype = _common_dtype(values, keys)
+    if dtype is None or keys.size == 0 or values.size == 0:
+        return np.full(values.shape, -1, dtype=np.int64)
+    keys = keys.astype(dtype, copy=False)
+    table = HashTable(_words(keys[:1]).shape[1], len(keys))
+    table.insert(_words(keys), np.arange(keys.size))
+    first = table.first[:table.count]
+
+    flat = values.ravel()
+    out = np.empty(flat.size, dtype=np.int64)
+    for lo in range(0, flat.size, CHUNKSIZE):
+        chunk = flat[lo:lo + CHUNKSIZE].astype(dtype, copy=False)
+        codes = table.lookup(_words(chunk))
+        out[lo:lo + CHUNKSIZE] = np.where(codes >= 0, first[codes], -1)
+    return out.reshape(values.shape)
+
+
+def value_counts(values, ascending=False):
+    """
+    Return the unique values and their counts, most common first.
+
+    Ties are in order of first appearance.
+    """
+    uniques, counts = unique(values, return_counts=True, sort=False)
+    order = np.argsort(counts if ascending else -counts, kind='stable')
+    return uniques[order], counts[order]
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(sizes=(10**5, 10**6, 10**7), cardinalities=(10, 10**3, 10**5),
+              kinds=('int', 'str')):
+    """Print a matrix of timings against np.unique and np.isin."""
+    rng = np.random.RandomState(0)
+
+    # Lookup-table offsets that would overflow int8
+    v = np.arange(-128, 128, dtype=np.int8)
+    t = np.array([-100, -90, 0, 5, 100, 120, 126, 127, -1, 3], dtype=np.int8)
+    assert np.array_equal(isin(v, t), np.isin(v, t))
+
+    def timed(func):
+        t0 = time.time()
+        result = func()
+        return result, time.time() - t0
+
+    print('%5s %10s %8s  %-24s %-24s %-24s'
+          % ('kind', 'n', 'card', 'unique+index+counts', 'unique(sort=False)',
+             'isin'))
+    print('%5s %10s %8s  %-24s %-24s %-24s'
+          % ('', '', '', 'numpy / hash (speedup)', 'numpy / hash (speedup)',
+             'numpy / hash (speedup)'))
+    for kind in kinds:
+        for n in sizes:
+            for card in cardinalities:
+                if card > n:
+                    continue
+                labels = rng.randint(0, 10**9, size=card)
+                if kind == 'str':
+                    labels = np.array(['label%d' % x for x in labels])
+                data = labels[rng.randint(0, card, size=n)]
+                test = labels[:max(1, card // 10)]
+
+                ref, t_np = timed(lambda: np.unique(
+                    data, return_index=True, return_counts=True))
+                res, t_hash = timed(lambda: unique(
+                    data, return_index=True, return_counts=True))
+                assert all(np.array_equal(r, s) for r, s in zip(ref, res))
+                _, t_np2 = timed(lambda: np.unique(data))
+                _, t_hash2 = timed(lambda: unique(data, sort=False))
+                ref, t_np3 = timed(lambda: np.isin(data, test))
+                res, t_hash3 = timed(lambda: isin(data, test))
+                assert np.array_equal(ref, res)
+                print('%5s %10d %8d  %-24s %-24s %-24s' % (
+                    kind, n, card,
+                    '%.3f / %.3f (%.1fx)' % (t_np, t_hash, t_np / t_hash),
+                    '%.3f / %.3f (%.1fx)' % (t_np2, t_hash2,
+                                             t_np2 / t_hash2),
+                    '%.3f / %.3f (%.1fx)' % (t_np3, t_hash3,
+                                             t_np3 / t_hash3)))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,257 @@
+"""
+Buffered output sinks for print-heavy reports.
+
+zoo.visit(), the line-counting loop in the text file I/O section of
+basics.py, and the heading() function in each cheatsheet all call print
+once per item.  For big inventories, the console or pipe becomes the
+bottleneck: every print is a separate write (and, on a terminal, a
+separate flush).  A sink collects formatted lines in a buffer and writes
+them out in large blocks instead.
+
+- StreamSink:   Write blocks to any file-like object (default sys.stdout)
+- FileSink:     Open a file and write blocks to it
+- SocketSink:   Send encoded blocks over a connected socket
+- StringSink:   Render the whole report to a string
+- NullSink:     Discard everything, for quiet batch runs
+
+Sinks are file-like, so existing code that uses print can be pointed at
+one with the redirect() context manager.
+
+Example
+-------
+>>> import sinks, zoo
+>>> with sinks.FileSink('data/report.txt') as out:
+...     zoo.visit(zoo.animals, 'Ivy', sink=out)
+>>> out = sinks.StringSink()
+>>> with sinks.redirect(out):
+...     heading('Animals')
+>>> report = out.getvalue()
+
+Run this module as a script to compare against per-line print:
+python sinks.py
+"""
+
+from __future__ import division, print_function
+
+import contextlib
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+# Default number of characters to collect before writing a block
+BUFSIZE = 2**20
+
+
+class Sink(object):
+    """Base class for buffered line sinks."""
+
+    def __init__(self, bufsize=BUFSIZE):
+        """Initialize with a buffer of `bufsize` characters."""
+        self.bufsize = bufsize
+        self._buf = []
+        self._size = 0
+        self.closed = False
+
+    def write(self, s):
+        """Add string `s` to the buffer (file-like interface)."""
+        self._buf.append(s)
+        self._size += len(s)
+        if self._size >= self.bufsize:
+            self.flush()
+
+    def write_line(self, s):
+        """Add string `s` and a newline to the buffer."""
+        self._buf.append(s)
+        self._buf.append('\n')
+        self._size += len(s) + 1
+        if self._size >= self.bufsize:
+            self.flush()
+
+    def write_lines(self, lines):
+        """
+        Add each string in iterable `lines`, followed by a newline.
+
+        Lines are joined in batches, which is faster than calling
+        write_line() for each one.
+        """
+        lines = iter(lines)
+        while True:
+            batch = list(itertools.islice(lines, 4096))
+            if not batch:
+                break
+            batch.append('')
+            self.write('\n'.join(batch))
+
+    def flush(self):
+        """Write out the buffered text as a single block."""
+        if self._buf:
+            block = ''.join(self._buf)
+            self._buf = []
+            self._size = 0
+            self._emit(block)
+
+    def _emit(self, block):
+        """Write a block of text to the destination."""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush the buffer and close the sink."""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StreamSink(Sink):
+    """Sink that writes blocks to a file-like object."""
+
+    def __init__(self, stream=None, bufsize=BUFSIZE):
+        """Write to `stream`, or to sys.stdout when the sink is used."""
+        Sink.__init__(self, bufsize)
+        self.stream = stream
+
+    def _emit(self, block):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(block)
+        stream.flush()
+
+
+class FileSink(StreamSink):
+    """Sink that writes blocks to a file."""
+
+    def __init__(self, filename, mode='w', bufsize=BUFSIZE):
+        """Open `filename` with `mode` ('w' or 'a')."""
+        StreamSink.__init__(self, open(filename, mode), bufsize)
+        self.filename = filename
+
+    def close(self):
+        if not self.closed:
+            StreamSink.close(self)
+            self.stream.close()
+
+
+class SocketSink(Sink):
+    """Sink that sends encoded blocks over a connected socket."""
+
+    def __init__(self, sock, encoding='utf-8', bufsize=BUFSIZE):
+        Sink.__init__(self, bufsize)
+        self.sock = sock
+        self.encoding = encoding
+
+    def _emit(self, block):
+        self.sock.sendall(block.encode(self.encoding))
+
+
+class StringSink(Sink):
+    """Sink that renders everything written to it to a string."""
+
+    def __init__(self):
+        # The buffer is never written out, so it can grow without limit
+        Sink.__init__(self, bufsize=float('inf'))
+
+    def getvalue(self):
+        """Return everything written so far as one string."""
+        value = ''.join(self._buf)
+        self._buf = [value]
+        return value
+
+    def flush(self):
+        pass
+
+
+class NullSink(Sink):
+    """Sink that discards everything written to it."""
+
+    def write(self, s):
+        pass
+
+    def write_line(self, s):
+        pass
+
+    def write_lines(self, lines):
+        pass
+
+    def _emit(self, block):
+        pass
+
+
+@contextlib.contextmanager
+def redirect(sink):
+    """Send print output (sys.stdout) to `sink` within a with block."""
+    stdout = sys.stdout
+    sys.stdout = sink
+    try:
+        yield sink
+    finally:
+        sys.stdout = stdout
+        sink.flush()
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(n=10**6):
+    """Time a report of n entries written with print and with sinks."""
+    animals = dict(('animal%d' % i, i % 100) for i in range(n))
+    fd, filename = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+
+    def run(label, func):
+        t0 = time.time()
+        func()
+        elapsed = time.time() - t0
+        print('%-30s %8.3f s  %10.0f lines/s' % (label, elapsed,
+                                                 n / elapsed))
+
+    def print_lines(buffering=-1):
+        with open(filename, 'w', buffering) as f:
+            for key in animals:
+                print('  %d %s' % (animals[key], key), file=f)
+
+    def sink_lines(sink):
+        with sink:
+            for key in animals:
+                sink.write_line('  %d %s' % (animals[key], key))
+
+    def sink_write_lines(sink):
+        with sink:
+            sink.write_lines('  %d %s' % (animals[key], key)
+                             for key in animals)
+
+    def redirected_print():
+        with FileSink(filename) as sink:
+            with redirect(sink):
+                for key in animals:
+                    print('  %d %s' % (animals[key], key))
+
+    print('Report with %d lines' % n)
+    try:
+        run('print() per line, line-buffered',
+            lambda: print_lines(buffering=1))
+        run('print() per line to file', print_lines)
+        expected = open(filename).read()
+        run('FileSink.write_line', lambda: sink_lines(FileSink(filename)))
+        assert open(filename).read() == expected
+        run('FileSink.write_lines',
+            lambda: sink_write_lines(FileSink(filename)))
+        assert open(filename).read() == expected
+        run('print() redirected to FileSink', redirected_print)
+        assert open(filename).read() == expected
+        string_sink = StringSink()
+        run('StringSink.write_lines', lambda: sink_write_lines(string_sink))
+        assert string_sink.getvalue() == expected
+        run('NullSink.write_line', lambda: sink_lines(NullSink()))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,255 @@
+"""
+Selection-first loading of subsets of netCDF files.
+
+science_data.py calls ds.load() on the whole of
+ncep2_climatology_ann.nc and then uses only u[k], v[k] and T[k] at one
+level, and the quiver plot in science_plots.py reads all of u and v to
+plot level 9.  This module declares the subset first and reads only
+that from the file:
+
+- Selections are given per dimension by coordinate value: a scalar
+  picks the nearest point (and drops the dimension, like u[k]), a list
+  picks the nearest point to each value, and a (lo, hi) tuple picks the
+  range between the bounds, whichever way the coordinate runs
+- Longitudes are compared modulo 360, so (-30, 60) works on a 0..360
+  or a -180..180 grid, and a box with lo > hi, e.g. (300, 30), wraps
+  around (on a 0..360 grid, its longitudes then run 300..357.5,
+  0..30).  A box at least 360 degrees wide, e.g. (-180, 180), is the
+  whole globe.
+- Each variable is read as one or two hyperslabs (two for a box that
+  wraps around the ends of the grid), never as the whole variable
+- Subsets smaller than max_bytes are loaded and the file is closed.
+  Larger ones are returned backed by dask arrays, in chunks of about
+  chunk_bytes, which are read from the open file as they are computed.
+
+Example
+-------
+>>> import subset
+>>> filename = 'data/ncep2_climatology_ann.nc'
+>>> ds = subset.open_subset(filename, ['u', 'v', 'T'], lev=850)
+>>> ds['u']                           # (lat, lon) at 850 mb
+>>> ds = subset.open_subset(filename, ['u', 'v'], lev=[850, 200],
+...                         lat=(15, 75), lon=(-170, -50))
+>>> subset.nbytes(ds)                 # Bytes read from the file
+
+Run this module as a script to compare bytes read and time with loading
+the whole file:
+python subset.py
+"""
+
+from __future__ import division
+
+import time
+
+import numpy as np
+import xray
+
+try:
+    import dask.array
+except ImportError:
+    dask = None
+
+# Subsets larger than this are returned as dask arrays
+MAX_BYTES = 2**30
+
+# Approximate size of each dask chunk of a large subset
+CHUNK_BYTES = 64 * 2**20
+
+# Dimensions whose coordinates are compared modulo 360
+LON_NAMES = ('lon', 'longitude')
+
+
+def nbytes(ds):
+    """Return the total bytes of the variables in a dataset."""
+    return sum(var.nbytes for var in ds.variables.values())
+
+
+def _nearest(coord, value, periodic):
+    dist = np.abs(coord - value)
+    if periodic:
+        dist = np.minimum(dist % 360, -dist % 360)
+    return int(dist.argmin())
+
+
+def _runs(mask, dim):
+    """Return slices of the runs of consecutive positions where `mask`."""
+    mask = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8)))
+    if not len(edges):
+        raise ValueError('no %s coordinates in the selected range' % dim)
+    return [slice(int(start), int(stop))
+            for start, stop in zip(edges[::2], edges[1::2])]
+
+
+def _indexers(coord, dim, value):
+    """
+    Return a list of integer, array or slice indexers along `dim` for a
+    selection by coordinate `value`.  Only a longitude box that wraps
+    around the ends of the grid gives more than one.
+    """
+    coord = np.asarray(coord)
+    periodic = dim in LON_NAMES
+    if isinstance(value, tuple):
+        lo, hi = value
+        if not periodic:
+            lo, hi = min(lo, hi), max(lo, hi)
+            runs = _runs((coord >= lo) & (coord <= hi), dim)
+        elif hi - lo >= 360:
+            return [slice(None)]
+        else:
+            lon, lo, hi = coord % 360, lo % 360, hi % 360
+            if lo <= hi:
+                runs = _runs((lon >= lo) & (lon <= hi), dim)
+            else:
+                runs = _runs((lon >= lo) | (lon <= hi), dim)
+            if (len(runs) == 2 and runs[0].start == 0
+                    and runs[1].stop == len(coord)):
+                # Across the ends of the grid: from lo to the end, then
+                # from the start of the grid to hi
+                return [runs[1], runs[0]]
+        if len(runs) > 1:
+            raise ValueError('%s coordinates in the range %s are not '
+                             'contiguous' % (dim, value))
+        return runs
+    if np.ndim(value) == 0:
+        return [_nearest(coord, value, periodic)]
+    index = np.array([_nearest(coord, x, periodic) for x in value])
+    if len(index) and np.all(np.diff(index) == 1):
+        # Contiguous: one hyperslab rather than a point per value
+        return [slice(int(index[0]), int(index[-1]) + 1)]
+    return [index]
+
+
+def _auto_chunks(ds, chunk_bytes):
+    """Chunk the leading dimension of the largest variable."""
+    if not ds.data_vars:
+        return {}
+    var = max(ds.data_vars.values(), key=lambda v: v.nbytes)
+    if not var.dims:
+        return {}
+    row = var.nbytes // max(var.shape[0], 1)
+    return {var.dims[0]: max(1, chunk_bytes // max(row, 1))}
+
+
+def select(ds, variables=None, **selection):
+    """
+    Return a lazy subset of an open dataset, without reading any data.
+
+    Parameters
+    ----------
+    ds : xray.Dataset
+        Dataset opened with xray.open_dataset.
+    variables : str or list of str, optional
+        Data variables to keep.  Default is all of them.
+    **selection
+        Dimension name -> coordinate value(s): a scalar for the nearest
+        point, a list for the nearest point to each value, or a (lo, hi)
+        tuple for a range.
+    """
+    if variables is not None:
+        if isinstance(variables, str):
+            variables = [variables]
+        ds = ds[list(variables)]
+    pieces = None
+    indexers = {}
+    for dim, value in selection.items():
+        if dim not in ds.dims:
+            raise ValueError('dataset has no dimension %r' % dim)
+        index = _indexers(ds[dim].values, dim, value)
+        if len(index) > 1:
+            pieces = (dim, index)
+        else:
+            indexers[dim] = index[0]
+    if pieces is None:
+        return ds.isel(**indexers)
+    dim, index = pieces
+    parts = [ds.isel(**dict(indexers, **{dim: i})) for i in index]
+    return xray.concat(parts, dim)
+
+
+def open_subset(filename, variables=None, max_bytes=MAX_BYTES,
+                chunks=None, chunk_bytes=CHUNK_BYTES, open_kwargs=None,
+                **selection):
+    """
+    Open a netCDF file and read only a subset of it.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file.
+    variables : str or list of str, optional
+        Data variables to read.  Default is all of them.
+    max_bytes : int, optional
+        Subsets up to this size are loaded into memory and the file is
+        closed.  Larger subsets are returned backed by dask arrays, and
+        the file stays open until the dataset is closed (e.g. with a
+        with statement).  Without dask, they are loaded.
+    chunks : dict, optional
+        Dask chunks for large subsets, dimension name -> size.  Default
+        is to split the leading dimension of the largest variable into
+        chunks of about chunk_bytes.
+    open_kwargs : dict, optional
+        Arguments for xray.open_dataset, e.g. {'decode_times': False}.
+    **selection
+        Selections by coordinate value, as in select().
+    """
+    ds = xray.open_dataset(filename, **(open_kwargs or {}))
+    try:
+        sub = select(ds, variables, **selection)
+        if nbytes(sub) > max_bytes and dask is not None:
+            sub = sub.chunk(chunks or _auto_chunks(sub, chunk_bytes))
+            # Pass the open file on, so that sub.close() closes it
+            if hasattr(sub, 'set_close'):
+                # xarray 0.17 and later
+                sub.set_close(ds.close)
+            else:
+                # xray, and xarray before 0.17, close the private
+                # _file_obj (as their open_mfdataset does)
+                sub._file_obj = ds._file_obj
+            return sub
+        sub.load()
+    except Exception:
+        ds.close()
+        raise
+    ds.close()
+    return sub
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(filename='data/ncep2_climatology_ann.nc', repeat=5):
+    """
+    Compare the bytes read and the time taken by loading the whole file
+    with those for the subsets used in the cheatsheets.
+    """
+    def timed(label, func):
+        t0 = time.time()
+        for _ in range(repeat):
+            ds = func()
+        elapsed = (time.time() - t0) / repeat
+        print('%-44s %10.1f kB %9.4f s' % (label, nbytes(ds) / 1e3, elapsed))
+        return elapsed
+
+    def full():
+        with xray.open_dataset(filename) as ds:
+            return ds.load()
+
+    print(filename)
+    t_full = timed('ds.load()', full)
+    cases = [('u, v, T at 850 mb',
+              dict(variables=['u', 'v', 'T'], lev=850)),
+             ('u, v at 200 mb', dict(variables=['u', 'v'], lev=200)),
+             ('u, v at 850, 200 mb over North America',
+              dict(variables=['u', 'v'], lev=[850, 200], lat=(15, 75),
+                   lon=(-170, -50))),
+             ('T from 1000 to 500 mb, 60S to 60N',
+              dict(variables='T', lev=(1000, 500), lat=(-60, 60)))]
+    for label, kwargs in cases:
+        t = timed(label, lambda: open_subset(filename, **kwargs))
+        print('  %.1fx faster' % (t_full / t))
+
+
+if __name__ == '__main__':
+    benchmark()
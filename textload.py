@@ -0,0 +1,213 @@
+"""
+Parallel, streaming loading of delimited text files into arrays.
+
+np.loadtxt('array_ex.txt', delimiter=',') at the end of
+science_numpy.py parses the whole file in one process and builds the
+whole array before returning, so multi-GB CSV files take minutes and
+need all of the result (plus parser buffers) in memory at once.  This
+module splits a file into byte ranges that start and end on line
+boundaries, and parses the ranges with np.loadtxt in a pool of worker
+processes:
+
+- loadtxt() takes the same common arguments as np.loadtxt (delimiter,
+  dtype, usecols, skiprows, comments), and copies each parsed range
+  once into the result
+- iter_chunks() yields the parsed ranges in order instead, keeping at
+  most 2 ranges per process in flight, so files larger than memory can
+  be reduced chunk by chunk (e.g. with outofcore.Chunked)
+
+Lines are split on b'\\n', so quoted fields must not contain newlines.
+
+Example
+-------
+>>> import textload
+>>> arr = textload.loadtxt('array_ex.txt', delimiter=',')
+>>> arr = textload.loadtxt('big.csv', delimiter=',', skiprows=1,
+...                        usecols=(0, 3), processes=8)
+>>> for chunk in textload.iter_chunks('huge.csv', delimiter=','):
+...     total += chunk.sum(axis=0)
+
+Run this module as a script for a throughput benchmark against
+np.loadtxt and np.genfromtxt:
+python textload.py
+"""
+
+from __future__ import division
+
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+import pipeline
+
+# Default size in bytes of the ranges parsed by each task
+CHUNK_BYTES = 16 * 2**20
+
+
+def _skip_lines(fname, skiprows):
+    """Return the byte offset just after the first `skiprows` lines."""
+    with open(fname, 'rb') as f:
+        for _ in range(skiprows):
+            if not f.readline():
+                break
+        return f.tell()
+
+
+def _ranges(fname, start, chunk_bytes):
+    """Generate (start, stop) byte ranges of whole lines from `start`."""
+    size = os.path.getsize(fname)
+    with open(fname, 'rb') as f:
+        while start < size:
+            # Seek one byte back so that a range ending exactly at the end
+            # of a line doesn't take in the whole next line
+            f.seek(start + max(chunk_bytes, 1) - 1)
+            f.readline()
+            stop = min(f.tell(), size)
+            yield start, stop
+            start = stop
+
+
+def _parse_range(args):
+    """Parse the lines in one byte range with np.loadtxt."""
+    fname, start, stop, kwargs = args
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    # Structured dtypes give 1-D arrays of records
+    ndmin = 1 if np.dtype(kwargs['dtype']).names else 2
+    with warnings.catch_warnings():
+        # Ranges with only comments or blank lines are dropped later
+        warnings.simplefilter('ignore', UserWarning)
+        return np.loadtxt(io.BytesIO(data), ndmin=ndmin, **kwargs)
+
+
+def iter_chunks(fname, delimiter=None, dtype=float, usecols=None,
+                skiprows=0, comments='#', encoding='utf-8', processes=None,
+                chunk_bytes=CHUNK_BYTES, **kwargs):
+    """
+    Parse a delimited text file in parallel, yielding arrays of rows.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the file.
+    delimiter, dtype, usecols, skiprows, comments, encoding
+        As in np.loadtxt.  skiprows lines are skipped once, at the start
+        of the file.
+    processes : int, optional
+        Number of worker processes.  Default is the number of CPUs, and
+        with 1 the file is parsed in this process.
+    chunk_bytes : int, optional
+        Approximate size of the byte range parsed by each task.
+    **kwargs
+        Other arguments for np.loadtxt, e.g. converters or quotechar.
+        They must be picklable to be sent to the workers.
+
+    Yields
+    ------
+    chunk : ndarray
+        Rows parsed from a range of the file, 2-D (1-D for structured
+        dtypes), in file order.  Ranges with no data are skipped.
+    """
+    if 'max_rows' in kwargs:
+        raise TypeError('max_rows is not supported')
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    kwargs.update(delimiter=delimiter, dtype=dtype, usecols=usecols,
+                  comments=comments, encoding=encoding)
+    start = _skip_lines(fname, skiprows)
+    tasks = ((fname, a, b, kwargs)
+             for a, b in _ranges(fname, start, chunk_bytes))
+    p = pipeline.Pipeline(tasks)
+    if processes > 1:
+        p = p.parallel_map(_parse_range, 'process', processes)
+    else:
+        p = p.map(_parse_range)
+    for chunk in p:
+        if len(chunk):
+            yield chunk
+
+
+def loadtxt(fname, delimiter=None, dtype=float, usecols=None, skiprows=0,
+            comments='#', encoding='utf-8', ndmin=0, processes=None,
+            chunk_bytes=CHUNK_BYTES, **kwargs):
+    """
+    Load a delimited text file like np.loadtxt, parsing in parallel.
+
+    See iter_chunks for the parameters.  ndmin is as in np.loadtxt: with
+    the default of 0, single rows or columns are returned as 1-D arrays.
+    """
+    chunks = list(iter_chunks(fname, delimiter, dtype, usecols, skiprows,
+                              comments, encoding, processes, chunk_bytes,
+                              **kwargs))
+    if chunks:
+        arr = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+    else:
+        ncols = 1 if usecols is None else len(np.atleast_1d(usecols))
+        arr = np.empty((0, ncols), dtype=dtype)
+    del chunks
+    if np.dtype(dtype).names:
+        return arr
+    if ndmin < 2:
+        arr = np.squeeze(arr)
+    if arr.ndim < ndmin:
+        arr = arr.reshape(arr.shape + (1,) * (ndmin - arr.ndim))
+    return arr
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(nrows=10**6, ncols=8, dirname=None):
+    """
+    Compare parsing throughput on a CSV file of random floats, with a
+    header line.
+    """
+    dirname = tempfile.mkdtemp(dir=dirname)
+    try:
+        fname = os.path.join(dirname, 'data.csv')
+        rng = np.random.RandomState(0)
+        data = rng.randn(nrows, ncols)
+        np.savetxt(fname, data, delimiter=',', fmt='%.6g',
+                   header=','.join('x%d' % i for i in range(ncols)))
+        size = os.path.getsize(fname)
+        print('%d x %d floats, %.0f MB of CSV, %d CPUs'
+              % (nrows, ncols, size / 1e6, multiprocessing.cpu_count()))
+
+        def timed(label, func):
+            t0 = time.time()
+            result = func()
+            elapsed = time.time() - t0
+            print('%-40s %8.3f s %8.1f MB/s'
+                  % (label, elapsed, size / elapsed / 1e6))
+            return result
+
+        ref = timed('np.loadtxt', lambda: np.loadtxt(
+            fname, delimiter=',', skiprows=1))
+        timed('np.genfromtxt', lambda: np.genfromtxt(
+            fname, delimiter=',', skip_header=1))
+        for processes in sorted(set([1, 2, multiprocessing.cpu_count()])):
+            arr = timed('textload.loadtxt, %d processes' % processes,
+                        lambda: loadtxt(fname, delimiter=',', skiprows=1,
+                                        processes=processes))
+            assert np.array_equal(arr, ref)
+        total = timed('iter_chunks + sum (streaming)', lambda: sum(
+            chunk.sum(axis=0) for chunk in iter_chunks(
+                fname, delimiter=',', skiprows=1)))
+        assert np.allclose(total, ref.sum(axis=0))
+        cols = timed('textload.loadtxt, usecols=(0, 3)', lambda: loadtxt(
+            fname, delimiter=',', skiprows=1, usecols=(0, 3)))
+        assert np.array_equal(cols, ref[:, [0, 3]])
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,438 @@
+"""
+Bulk conversions between epoch times, numpy datetime64 arrays and strings.
+
+The date and time section of basics.py formats a single datetime field
+by field.  That's fine for one timestamp, but formatting or parsing
+millions of log timestamps one at a time with datetime.strftime() and
+datetime.strptime() is painfully slow.  The functions in this module
+work on whole arrays at once:
+
+- from_epoch / to_epoch:          epoch numbers <--> datetime64 arrays
+- format_datetimes:               datetime64 arrays --> strings
+- parse_datetimes:                strings --> datetime64 arrays
+
+Formats use the familiar strftime directives, restricted to the
+fixed-width numeric ones (%Y %y %m %d %H %M %S %f %j %%).  Every
+timestamp in a fixed-width format has the same length, so formatting and
+parsing become arithmetic on a 2-D array of character codes, with no
+Python-level loop over the timestamps.  Compiled format specs are cached,
+and plain ISO-8601 layouts take a fast path through numpy's built-in
+datetime64 <--> string conversions.
+
+Run this module as a script to compare against per-item strftime and
+strptime:
+python timestamps.py
+"""
+
+from __future__ import division
+
+import time
+from datetime import datetime
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+# Format specs
+# ----------------------------------------------------------------------
+
+# Width of each supported strftime directive
+_WIDTHS = {'Y': 4, 'y': 2, 'm': 2, 'd': 2, 'H': 2, 'M': 2, 'S': 2,
+           'f': 6, 'j': 3}
+
+# ISO-8601 layouts which numpy can convert directly, and the datetime64
+# unit that gives exactly that layout from np.datetime_as_string()
+_ISO_UNITS = {
+    '%Y-%m-%d': 'D',
+    '%Y-%m-%dT%H:%M': 'm',
+    '%Y-%m-%dT%H:%M:%S': 's',
+    '%Y-%m-%dT%H:%M:%S.%f': 'us',
+}
+
+_format_cache = {}
+
+# Character codes for '00', '01', ..., '99'
+_DIGIT_PAIRS = np.array([[ord('0') + i // 10, ord('0') + i % 10]
+                         for i in range(100)], dtype=np.uint8)
+
+
+class FormatSpec(object):
+    """Compiled fixed-width timestamp format."""
+
+    def __init__(self, fmt):
+        """Parse the strftime-style format string `fmt`."""
+        self.fmt = fmt
+        self.fields = []        # List of (directive, offset, width)
+        literal = []            # Literal characters, None for digits
+        i = 0
+        while i < len(fmt):
+            c = fmt[i]
+            if c == '%':
+                if i + 1 == len(fmt):
+                    raise ValueError('Incomplete directive in %r' % fmt)
+                d = fmt[i + 1]
+                if d == '%':
+                    literal.append('%')
+                elif d in _WIDTHS:
+                    self.fields.append((d, len(literal), _WIDTHS[d]))
+                    literal.extend([None] * _WIDTHS[d])
+                else:
+                    raise ValueError('Unsupported directive %%%s in %r. '
+                                     'Only fixed-width numeric directives '
+                                     'are supported.' % (d, fmt))
+                i += 2
+            else:
+                if ord(c) > 127:
+                    raise ValueError('Non-ASCII literal %r in %r' % (c, fmt))
+                literal.append(c)
+                i += 1
+        self.width = len(literal)
+        self.literal_pos = np.array([k for k, c in enumerate(literal)
+                                     if c is not None], dtype=np.intp)
+        self.literal_codes = np.array([ord(c) for c in literal
+                                       if c is not None], dtype=np.uint8)
+        self.digit_pos = np.array([k for k, c in enumerate(literal)
+                                   if c is None], dtype=np.intp)
+        self.iso_unit = _ISO_UNITS.get(fmt.replace(' ', 'T', 1))
+        self.iso_sep = ' ' if ' ' in fmt else 'T'
+
+    def __repr__(self):
+        return 'FormatSpec(%r)' % self.fmt
+
+
+def compile_format(fmt):
+    """Return the cached FormatSpec for format string `fmt`."""
+    spec = _format_cache.get(fmt)
+    if spec is None:
+        spec = FormatSpec(fmt)
+        _format_cache[fmt] = spec
+    return spec
+
+
+# ----------------------------------------------------------------------
+# Epoch times
+# ----------------------------------------------------------------------
+
+# Number of each datetime64 unit in one second
+_PER_SECOND = {'s': 1, 'ms': 10**3, 'us': 10**6, 'ns': 10**9}
+
+
+def from_epoch(epoch, unit='s'):
+    """
+    Convert seconds since 1970-01-01 to a datetime64 array.
+
+    Parameters
+    ----------
+    epoch : array_like of ints or floats
+        Seconds since the Unix epoch.  Fractional seconds are kept down
+        to the resolution of `unit`.
+    unit : {'s', 'ms', 'us', 'ns'}, optional
+        Resolution of the returned datetime64 array.
+
+    Returns
+    -------
+    dt : ndarray of datetime64[unit]
+    """
+    epoch = np.asarray(epoch)
+    scale = _PER_SECOND[unit]
+    if epoch.dtype.kind in 'iu':
+        ticks = epoch.astype(np.int64) * scale
+    else:
+        ticks = np.round(epoch * scale).astype(np.int64)
+    return ticks.view('M8[%s]' % unit)
+
+
+def to_epoch(dt, dtype=np.float64):
+    """
+    Convert a datetime64 array to seconds since 1970-01-01.
+
+    With an integer `dtype`, fractional seconds are floored.
+    """
+    dt = np.asarray(dt)
+    if dt.dtype.kind != 'M':
+        dt = dt.astype('M8[us]')
+    unit = np.datetime_data(dt.dtype)[0]
+    if unit not in _PER_SECOND:
+        dt = dt.astype('M8[s]')
+        unit = 's'
+    ticks = dt.view(np.int64)
+    scale = _PER_SECOND[unit]
+    if np.dtype(dtype).kind in 'iu':
+        return (ticks // scale).astype(dtype)
+    return (ticks / scale).astype(dtype)
+
+
+# ----------------------------------------------------------------------
+# Formatting
+# ----------------------------------------------------------------------
+
+def _split_fields(dt):
+    """Return a dict of calendar fields for datetime64 array `dt`."""
+    days = dt.astype('M8[D]')
+    months = dt.astype('M8[M]')
+    years = dt.astype('M8[Y]')
+    year = years.view(np.int64) + 1970
+    usec = (dt - days).astype('m8[us]').view(np.int64)
+    seconds, usec = np.divmod(usec, 10**6)
+    minutes, second = np.divmod(seconds, 60)
+    hour, minute = np.divmod(minutes, 60)
+    return {
+        'Y': year,
+        'y': year % 100,
+        'm': (months - years.astype('M8[M]')).view(np.int64) + 1,
+        'd': (days - months.astype('M8[D]')).view(np.int64) + 1,
+        'j': (days - years.astype('M8[D]')).view(np.int64) + 1,
+        'H': hour,
+        'M': minute,
+        'S': second,
+        'f': usec,
+    }
+
+
+def _format_iso(dt, spec):
+    """Fast path for plain ISO-8601 layouts using numpy's converter."""
+    out = np.datetime_as_string(dt, unit=spec.iso_unit)
+    out = out.astype('U%d' % spec.width)
+    if spec.iso_sep == ' ':
+        out.view(np.uint32).reshape(-1, spec.width)[:, 10] = ord(' ')
+    return out
+
+
+def format_datetimes(dt, fmt='%Y-%m-%d %H:%M:%S', as_bytes=False):
+    """
+    Format an array of datetimes as strings.
+
+    Parameters
+    ----------
+    dt : array_like of datetime64 or datetime objects
+        Timestamps to format.  Use from_epoch() first for epoch times.
+    fmt : str, optional
+        strftime-style format using only fixed-width numeric directives
+        (%Y %y %m %d %H %M %S %f %j %%).
+    as_bytes : bool, optional
+        If True, return a bytes ('S') array, which skips the conversion
+        to unicode and is the cheapest form for writing to files.
+
+    Returns
+    -------
+    out : ndarray of str (or bytes)
+
+    Raises
+    ------
+    ValueError
+        If `fmt` has unsupported directives, or any year falls outside
+        0001-9999 or is NaT.
+    """
+    spec = compile_format(fmt)
+    dt = np.asarray(dt)
+    if dt.dtype.kind != 'M':
+        dt = dt.astype('M8[us]')
+    shape = dt.shape
+    dt = dt.ravel()
+    years = dt.astype('M8[Y]').view(np.int64) + 1970
+    if dt.size and (np.isnat(dt).any() or years.min() < 1
+                    or years.max() > 9999):
+        raise ValueError('Timestamps must be between years 0001 and 9999')
+
+    if spec.iso_unit is not None and not as_bytes:
+        return _format_iso(dt, spec).reshape(shape)
+
+    # Fill a (n, width) array of character codes, two digits at a time
+    fields = _split_fields(dt)
+    buf = np.empty((dt.size, spec.width), dtype=np.uint8)
+    buf[:, spec.literal_pos] = spec.literal_codes
+    for d, offset, width in spec.fields:
+        value = fields[d]
+        end = offset + width
+        while end - offset >= 2:
+            value, pair = np.divmod(value, 100)
+            buf[:, end - 2:end] = _DIGIT_PAIRS[pair]
+            end -= 2
+        if end > offset:
+            buf[:, offset] = value % 10 + ord('0')
+    out = buf.view('S%d' % spec.width).reshape(shape)
+    if not as_bytes:
+        out = out.astype('U%d' % spec.width)
+    return out
+
+
+# ----------------------------------------------------------------------
+# Parsing
+# ----------------------------------------------------------------------
+
+def _as_char_codes(strings, width):
+    """Return a (n, width) array of character codes for `strings`."""
+    arr = np.asarray(strings)
+    if arr.dtype.kind not in 'SU':
+        arr = arr.astype('U')
+    arr = np.ascontiguousarray(arr.ravel())
+    # One code per character: uint8 for bytes, uint32 for unicode
+    code_type = np.uint8 if arr.dtype.kind == 'S' else np.uint32
+    ncode = arr.dtype.itemsize // np.dtype(code_type).itemsize
+    if ncode < width:
+        arr = arr.astype('%s%d' % (arr.dtype.kind, width))
+        ncode = width
+    codes = arr.view(code_type).reshape(-1, ncode)
+    if ncode > width and codes[:, width:].any():
+        bad = codes[:, width:].any(axis=1)
+        raise ValueError('Timestamp %r is longer than format width %d'
+                         % (arr[bad][0], width))
+    return codes[:, :width], arr
+
+
+def _parse_iso(strings, spec, unit):
+    """
+    Fast path for plain ISO-8601 layouts using numpy's parser.
+
+    numpy's parser is lenient (it takes '' and 'NaT', dates without
+    times, and in some versions rolls second 60 over to the next
+    minute), so the layout is checked first.  Raises ValueError for
+    anything the strict parser should look at instead.
+    """
+    codes, arr = _as_char_codes(strings, spec.width)
+    # Strings shorter than the format are padded with NULs, which fail
+    # these checks
+    if (codes[:, spec.literal_pos] != spec.literal_codes).any():
+        raise ValueError('Timestamp does not match format')
+    digits = codes[:, spec.digit_pos] - codes.dtype.type(ord('0'))
+    if (digits > 9).any():
+        raise ValueError('Timestamp does not match format')
+    for d, offset, width in spec.fields:
+        if d == 'S' and (codes[:, offset] >= ord('6')).any():
+            raise ValueError('Second out of range')
+    if spec.iso_sep == ' ':
+        codes = codes.copy()
+        codes[:, 10] = ord('T')
+    strings = np.ascontiguousarray(codes).view(
+        '%s%d' % (arr.dtype.kind, spec.width))
+    return strings.reshape(-1).astype('M8[%s]' % unit)
+
+
+def parse_datetimes(strings, fmt='%Y-%m-%d %H:%M:%S', unit='us'):
+    """
+    Parse an array of timestamp strings into datetime64.
+
+    Parameters
+    ----------
+    strings : array_like of str or bytes
+        Timestamps, all in format `fmt`.
+    fmt : str, optional
+        strftime-style format using only fixed-width numeric directives
+        (%Y %y %m %d %H %M %S %f %j %%).  Two-digit years %y follow the
+        strptime convention: 69-99 -> 1969-1999, 00-68 -> 2000-2068.
+    unit : str, optional
+        Resolution of the returned datetime64 array.
+
+    Returns
+    -------
+    dt : ndarray of datetime64[unit]
+
+    Raises
+    ------
+    ValueError
+        If any string doesn't match `fmt` or has out-of-range fields.
+    """
+    spec = compile_format(fmt)
+    shape = np.shape(strings)
+    if spec.iso_unit is not None:
+        try:
+            return _parse_iso(strings, spec, unit).reshape(shape)
+        except ValueError:
+            pass    # Fall through to the strict parser for the error
+
+    codes, arr = _as_char_codes(strings, spec.width)
+    if (codes[:, spec.literal_pos] != spec.literal_codes).any():
+        bad = (codes[:, spec.literal_pos] != spec.literal_codes).any(axis=1)
+        raise ValueError('Timestamp %r does not match format %r'
+                         % (arr[bad][0], fmt))
+
+    # Unsigned wraparound maps every non-digit character above 9
+    digits = codes - codes.dtype.type(ord('0'))
+    if (digits[:, spec.digit_pos] > 9).any():
+        bad = (digits[:, spec.digit_pos] > 9).any(axis=1)
+        raise ValueError('Timestamp %r does not match format %r'
+                         % (arr[bad][0], fmt))
+    fields = {}
+    for d, offset, width in spec.fields:
+        value = digits[:, offset].astype(np.int64)
+        for k in range(offset + 1, offset + width):
+            value *= 10
+            value += digits[:, k]
+        fields[d] = value
+
+    n = codes.shape[0]
+    zeros = np.zeros(n, dtype=np.int64)
+    if 'Y' in fields:
+        year = fields['Y']
+    elif 'y' in fields:
+        year = np.where(fields['y'] < 69, 2000, 1900) + fields['y']
+    else:
+        year = zeros + 1900
+    years = (year - 1970).astype('M8[Y]')
+    if 'j' in fields:
+        yearlen = (years + 1).astype('M8[D]') - years.astype('M8[D]')
+        doy = fields['j']
+        if ((doy < 1) | (doy > yearlen.view(np.int64))).any():
+            raise ValueError('Day of year out of range')
+        days = years.astype('M8[D]') + (doy - 1)
+    else:
+        month = fields.get('m', zeros + 1)
+        day = fields.get('d', zeros + 1)
+        if ((month < 1) | (month > 12)).any():
+            raise ValueError('Month out of range')
+        months = years.astype('M8[M]') + (month - 1)
+        monthlen = (months + 1).astype('M8[D]') - months.astype('M8[D]')
+        if ((day < 1) | (day > monthlen.view(np.int64))).any():
+            raise ValueError('Day out of range')
+        days = months.astype('M8[D]') + (day - 1)
+
+    hour = fields.get('H', zeros)
+    minute = fields.get('M', zeros)
+    second = fields.get('S', zeros)
+    if (hour > 23).any() or (minute > 59).any() or (second > 59).any():
+        raise ValueError('Time of day out of range')
+    usec = (((hour * 60 + minute) * 60 + second) * 10**6
+            + fields.get('f', zeros))
+    dt = days.astype('M8[%s]' % unit) + usec.astype('m8[us]')
+    return dt.astype('M8[%s]' % unit).reshape(shape)
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+
+def benchmark(n=10**6, fmts=('%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S.%f')):
+    """Print timings against per-item datetime.strftime / strptime."""
+    rng = np.random.RandomState(0)
+    epoch = rng.randint(0, 2 * 10**9, size=n) + rng.rand(n).round(6)
+    dt = from_epoch(epoch, 'us')
+    # Per-item timings are measured on a subset and scaled up
+    nsub = min(n, 10**5)
+    objs = dt[:nsub].astype(datetime)
+
+    print('%d timestamps' % n)
+    for fmt in fmts:
+        print('Format %r' % fmt)
+        t0 = time.time()
+        strs = format_datetimes(dt, fmt)
+        t_fmt = time.time() - t0
+        t0 = time.time()
+        parsed = parse_datetimes(strs, fmt)
+        t_parse = time.time() - t0
+        t0 = time.time()
+        ref = [d.strftime(fmt) for d in objs]
+        t_strftime = (time.time() - t0) * n / nsub
+        t0 = time.time()
+        [datetime.strptime(s, fmt) for s in ref]
+        t_strptime = (time.time() - t0) * n / nsub
+
+        assert list(strs[:nsub]) == ref
+        if '%f' in fmt:
+            assert (parsed == dt).all()
+        print('  format:  %8.3f s   strftime: %8.3f s   speedup %6.1fx'
+              % (t_fmt, t_strftime, t_strftime / t_fmt))
+        print('  parse:   %8.3f s   strptime: %8.3f s   speedup %6.1fx'
+              % (t_parse, t_strptime, t_strptime / t_parse))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,7 +1,12 @@
-def visit(animals, name):
-    print('Welcome to the zoo, ' + name + '! We have: ')
-    for key in animals:
-        print('  %d %s' % (animals[key], key))
+def visit(animals, name, sink=None):
+    if sink is None:
+        print('Welcome to the zoo, ' + name + '! We have: ')
+        for key in animals:
+            print('  %d %s' % (animals[key], key))
+    else:
+        # Buffered output for big inventories, see sinks.py
+        sink.write_line('Welcome to the zoo, ' + name + '! We have: ')
+        sink.write_lines('  %d %s' % (animals[key], key) for key in animals)
 
 animals = {'zebras': 5, 'elephants': 4, 'penguins': 10}
 name = 'Jennifer'